@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+import isoweeks
+import repository as repo
+
+logger = logging.getLogger(__name__)
+
+# longest wait between attempts to reopen the change stream, in seconds
+MAX_RETRY_DELAY = 60
+# a reopened stream starts this far before the failure, for events not delivered yet
+RESUME_MARGIN = datetime.timedelta(seconds=5)
+
+
+class BudgetAlerts:
+    # Tells a chat when one of its expense categories goes past the week's
+    # estimate. New records come from a change stream on `records` where the
+    # backend supports_watch, or from polling `created_at` (standalone mongod, SQLite).
+    # Running totals live in memory: a week is read from storage once, when
+    # its first new record shows up, and every later record only adds its amount.
+
+    def __init__(self, bot, loop, poll_interval=5, max_weeks=4096):
+        self.bot = bot
+        self.loop = loop
+        self.poll_interval = poll_interval
+        self.max_weeks = max_weeks
+        # (tenant, year-week) -> {"ids": record ids counted, "totals": {category: amount}}
+        self._weeks = OrderedDict()
+        # weeks dropped from _weeks, see _week
+        self._evicted = OrderedDict()
+        # records created before this are read from storage, later ones are watched
+        self._started = datetime.datetime.utcnow()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="budget-alerts", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        self._started = datetime.datetime.utcnow()
+        if repo.backend().supports_watch:
+            self._watch(self._started)
+        else:
+            logger.info("No change notifications for records, polling every %ss for budget alerts", self.poll_interval)
+            self._poll(self._started)
+
+    def _watch(self, since):
+        # A broken stream (network, failover, invalidate) is reopened with
+        # backoff from where it broke, records seen twice are skipped in handle()
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                for doc in repo.backend().watch_records(self._stop, since):
+                    self._safe_handle(doc)
+                    delay = 1
+                if self._stop.is_set():
+                    return
+                logger.warning("Change stream on records closed, reopening in %ss", delay)
+            except Exception:
+                logger.exception("Change stream on records failed, reopening in %ss", delay)
+            since = datetime.datetime.utcnow() - RESUME_MARGIN
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _poll(self, since):
+        seen = set()
+        while not self._stop.wait(self.poll_interval):
+            try:
+                batch = repo.backend().records_since(since)
+            except Exception:
+                logger.exception("Polling records for budget alerts failed")
+                continue
+            # >= re-reads records stamped at `since`, skip the ones already handled
+            fresh = [doc for doc in batch if doc["_id"] not in seen]
+            if batch:
+                since = batch[-1]["created_at"]
+                seen = {doc["_id"] for doc in batch if doc["created_at"] == since}
+            for doc in fresh:
+                self._safe_handle(doc)
+
+    def _safe_handle(self, doc):
+        try:
+            self.handle(doc)
+        except Exception:
+            logger.exception("Budget alert check failed for record %s", doc.get("_id"))
+
+    def _week(self, doc):
+        key = (doc["tenant"], isoweeks.key(doc["year"], doc["week"]))
+        state = self._weeks.get(key)
+        if state is None:
+            # Records created before the watcher started never come through the
+            # stream or polling, they are the starting totals. Every later one
+            # is counted when it shows up, in whatever order that happens. For a
+            # week dropped from memory before, everything older than `doc` was
+            # counted already.
+            cutoff = self._started
+            if self._evicted.pop(key, False):
+                cutoff = doc.get("created_at") or cutoff
+            state = {"ids": set(), "totals": {}}
+            for r in repo.backend().week_records(doc["tenant"], doc["year"], doc["week"], cutoff):
+                state["ids"].add(r["_id"])
+                state["totals"][r["category"]] = state["totals"].get(r["category"], 0) + r["amount"]
+            self._weeks[key] = state
+            while len(self._weeks) > self.max_weeks:
+                evicted, _ = self._weeks.popitem(last=False)
+                self._evicted[evicted] = True
+                while len(self._evicted) > self.max_weeks:
+                    self._evicted.popitem(last=False)
+        self._weeks.move_to_end(key)
+        return key[1], state
+
+    def handle(self, doc):
+        # fold one inserted record in and alert when its category just crossed the estimate
+        if "tenant" not in doc:
+            return
+        year_week, state = self._week(doc)
+        if doc["_id"] in state["ids"]:
+            return  # already part of the totals read from storage
+        category, amount = doc["category"], doc["amount"]
+        before = state["totals"].get(category, 0)
+        after = before + amount
+        state["ids"].add(doc["_id"])
+        state["totals"][category] = after
+        if amount >= 0:
+            return
+
+        estimate = repo.get_estimate_sync(doc["tenant"], year_week)
+        expected = (estimate or {}).get("expected_expenses", {}).get(category)
+        if expected is None:
+            return
+        # expenses are negative, "past the estimate" means below it
+        if after < expected <= before:
+            # every worker watches the same records, the one that claims the alert sends it
+            alert_id = f"alert:{doc['tenant']}:{year_week}:{category}"
+            if not repo.backend().claim_update(alert_id):
+                return
+            text = (
+                f"⚠️ {category} spending for {year_week} is {-after:.2f}, "
+                f"over the {-expected:.2f} estimate by {expected - after:.2f}."
+            )
+            asyncio.run_coroutine_threadsafe(self._send(doc["tenant"], text, alert_id), self.loop)
+
+    async def _send(self, chat_id, text, alert_id):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except Exception:
+            logger.exception("Could not send budget alert to %s", chat_id)
+            # not delivered, so don't keep it claimed
+            await repo.release_update(alert_id)
@@ -0,0 +1,83 @@
+import datetime
+import isoweeks
+import config
+import repository as repo
+
+# Tiered records: weeks older than ARCHIVE_WEEKS leave the hot records table
+# for records_archive, and one summary per tenant and week keeps what the
+# bot reads from them, a row per day, category and sign:
+#   {"_id": "42:2024-10", "tenant": 42, "year": 2024, "week": 10, "complete": True, "rows": [
+#       {"day": "2024-03-04", "category": "groceries", "income": False, "amount": -55.0, "count": 3}, ...]}
+# While the hot copies of a run are being deleted, the summary lists them in
+# `hot_ids` and reads skip those ids in records (Mongo, see
+# MongoStorage.archive_weeks; SQLite moves a whole run in one transaction).
+# Reads also skip summaries without `complete`, which older runs left pending.
+# Week totals and balances are unchanged by the move, /showrecords and range
+# views read summaries for archived weeks and exports read archived records.
+# A record added to an archived week later stays hot until the next run.
+# Re-adding an archived record is a no-op like for hot ones, as long as its
+# week is still before the cutoff (see is_archived).
+
+
+def cutoff(weeks, today=None):
+    # (year, week) of the oldest week that stays hot when the last `weeks`
+    # (ARCHIVE_WEEKS) stay, None when archiving is off
+    if weeks <= 0:
+        return None
+    this_week = isoweeks.of(today or datetime.date.today())
+    # no further back than the first week of the calendar table, nothing is older
+    return isoweeks.shift(this_week, -min(weeks, this_week.index))[:2]
+
+
+def is_archived(year, week, weeks, today=None):
+    # whether records of this week may live in the archive already, so inserts
+    # only look for archived duplicates where there can be some
+    first_hot = cutoff(weeks, today)
+    return first_hot is not None and (year, week) < first_hot
+
+
+def merge_day_rows(*row_sets):
+    # records_by_day_category rows from raw records and summaries, summed per day and category
+    merged = {}
+    for rows in row_sets:
+        for row in rows:
+            key = (row["day"], row["category"])
+            total = merged.setdefault(key, {"day": row["day"], "category": row["category"],
+                                            "income": 0, "expense": 0, "count": 0})
+            total["income"] += row["income"]
+            total["expense"] += row["expense"]
+            total["count"] += row["count"]
+    return [merged[key] for key in sorted(merged)]
+
+
+def day_rows(summary):
+    # a summary's rows in the records_by_day_category shape
+    return [
+        {
+            "day": datetime.date.fromisoformat(row["day"]),
+            "category": row["category"],
+            "income": row["amount"] if row["income"] else 0,
+            "expense": 0 if row["income"] else row["amount"],
+            "count": row["count"],
+        }
+        for row in summary["rows"]
+    ]
+
+
+def run(weeks, today=None):
+    # Moves every week before the cutoff out of the hot records. Returns the
+    # number of records archived.
+    first_hot = cutoff(weeks, today)
+    if first_hot is None:
+        return 0
+    return repo.backend().archive_weeks(first_hot)
+
+
+async def archive_job(context):
+    # run by telegram_app.job_queue with ARCHIVE_WEEKS as data, see bot.on_startup
+    await repo.run_blocking(run, context.job.data)
+
+
+# Usage: python archive.py (runs the job once)
+if __name__ == "__main__":
+    print(f"Archived {run(config.ARCHIVE_WEEKS)} records")
@@ -0,0 +1,170 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+# Archival check: seeds a few tenants with records spread over the last
+# --weeks weeks, reads balances, week totals and the per-day/per-week views,
+# archives everything older than --keep weeks and fails when any of those
+# reads changed. Usage, from the repo root:
+#
+#   python -m bench.archive --mongomock
+#   python -m bench.archive --sqlite /tmp/expenses_archive.db
+#
+# Mongo runs use the `expenses_archive` database, which is dropped first.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = ["salary", "groceries", "rent", "travel", "other"]
+EPSILON = 1e-6
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Archival consistency check")
+    parser.add_argument("--users", type=int, default=3, help="distinct tenants")
+    parser.add_argument("--weeks", type=int, default=80, help="weeks of seeded history per tenant")
+    parser.add_argument("--records-per-week", type=int, default=10)
+    parser.add_argument("--keep", type=int, default=26, help="weeks that stay hot (ARCHIVE_WEEKS)")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--mongomock", action="store_true", help="use in-memory mongomock instead of mongod")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite backend with this database file")
+    return parser.parse_args()
+
+
+def configure(args):
+    # must run before config is imported
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_TLS"] = "false"
+    os.environ["DB_NAME"] = "expenses_archive"
+    os.environ["ARCHIVE_WEEKS"] = str(args.keep)
+    if args.sqlite:
+        os.environ["STORAGE_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = args.sqlite
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+    elif args.mongomock:
+        import mongomock
+        import pymongo
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **kw: client
+
+
+def seed(args):
+    import config
+    import isoweeks
+    import repository as repo
+
+    if not args.sqlite:
+        config.connect()
+        config.client.drop_database(config.DB_NAME)
+    store = repo.backend()
+    store.bootstrap()
+    this_week = isoweeks.current()
+    batch = []
+    for user in range(1, args.users + 1):
+        store.set_initial_balance(user, 1000)
+        for w in range(args.weeks):
+            week = isoweeks.shift(this_week, -w)
+            for i in range(args.records_per_week):
+                category = random.choice(CATEGORIES)
+                amount = round(random.uniform(1, 100), 2)
+                batch.append({
+                    "_id": f"bench:{user}:{week.key}:{i}",
+                    "tenant": user,
+                    "user": f"user{user}",
+                    "amount": amount if category == "salary" else -amount,
+                    "category": category,
+                    "date": datetime.datetime.combine(week.start + datetime.timedelta(days=i % 7), datetime.time(12)),
+                    "year": week.year,
+                    "week": week.week,
+                })
+    repo.insert_records_sync(batch)
+    return batch
+
+
+def snapshot(args):
+    # everything the bot shows for each tenant, read straight from storage
+    import isoweeks
+    import repository as repo
+
+    store = repo.backend()
+    this_week = isoweeks.current()
+    weeks = [isoweeks.shift(this_week, -w) for w in range(args.weeks)]
+    year_weeks = [w.key for w in weeks]
+    result = {}
+    for user in range(1, args.users + 1):
+        settings = store.get_settings(user)
+        result[(user, "balance")] = settings["balance"]
+        result[(user, "records")] = sum(1 for _ in store.iter_records(user))
+        for yw, doc in store.week_totals(user, year_weeks).items():
+            for field in ("count", "income", "expense"):
+                result[(user, yw, field)] = doc.get(field, 0)
+            for side in ("incomes", "expenses"):
+                for cat, amount in doc.get(side, {}).items():
+                    result[(user, yw, side, cat)] = amount
+        for yw, doc in store.records_by_week_category(user, year_weeks).items():
+            result[(user, yw, "week count")] = doc["count"]
+            for cat, amount in doc["categories"].items():
+                result[(user, yw, "week", cat)] = amount
+        for week in weeks:
+            for row in store.records_by_day_category(user, week.year, week.week):
+                for field in ("income", "expense", "count"):
+                    result[(user, week.key, str(row["day"]), row["category"], field)] = row[field]
+    return result
+
+
+def compare(before, after):
+    drift = []
+    for key in sorted(set(before) | set(after), key=str):
+        if abs((before.get(key) or 0) - (after.get(key) or 0)) > EPSILON:
+            drift.append(f"{key}: before {before.get(key)}, after {after.get(key)}")
+    return drift
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    import archive
+    import repository as repo
+
+    batch = seed(args)
+    before = snapshot(args)
+
+    started = time.perf_counter()
+    moved = archive.run(args.keep)
+    elapsed = time.perf_counter() - started
+    again = archive.run(args.keep)
+    # re-adding archived records must not count them twice
+    old = [entry for entry in batch if archive.is_archived(entry["year"], entry["week"], args.keep)]
+    copies = [{k: v for k, v in entry.items() if k != "created_at"} for entry in old[:50]]
+    readded = repo.insert_records_sync(copies)
+    drift = compare(before, snapshot(args))
+
+    # a late record in an archived week is folded into the existing summary
+    late = dict(copies[0], _id="bench:late", amount=-12.34, category="other")
+    repo.insert_records_sync([late])
+    before_late = snapshot(args)
+    late_moved = archive.run(args.keep)
+    drift += compare(before_late, snapshot(args))
+
+    if not args.sqlite:
+        import rollups
+        drift += rollups.verify()
+    print(f"archived:          {moved} of {len(batch)} records in {elapsed * 1000:.0f} ms")
+    print(f"second run:        {again} records")
+    print(f"re-added:          {readded} archived records")
+    print(f"late record:       {late_moved} archived")
+    print(f"values compared:   {len(before)}")
+    for line in drift[:20]:
+        print("drift:", line)
+    print("No drift" if not drift else f"{len(drift)} drifted values")
+    repo.shutdown()
+    if drift or again or readded or not moved or late_moved != 1:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
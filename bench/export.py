@@ -0,0 +1,144 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+
+# Export memory check: seeds one tenant with --records synthetic records,
+# then runs the /export writer in a fresh interpreter and reports how much
+# its peak RSS grew while exporting. The writers stream from batched
+# cursors, so the growth must not depend on the number of records.
+# Usage, from the repo root:
+#
+#   python -m bench.export --sqlite /tmp/expenses_export.db
+#   python -m bench.export --records 100000 --format csv
+#
+# Mongo runs use the `expenses_export` database, which is dropped first.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CATEGORIES = ["salary", "groceries", "rent", "travel", "other"]
+TENANT = 1
+
+PROBE = """
+import json, os, resource, sys, tempfile, time
+from handlers import export
+
+def peak_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+fmt, tenant = sys.argv[1], int(sys.argv[2])
+with tempfile.TemporaryDirectory() as tmp:
+    export.repo.backend()
+    baseline = peak_mb()
+    started = time.perf_counter()
+    paths = [os.path.join(tmp, "export.xlsx")] if fmt == "xlsx" else [
+        os.path.join(tmp, "records.csv"), os.path.join(tmp, "estimates.csv")]
+    writer = export._write_xlsx if fmt == "xlsx" else export._write_csv
+    writer(*paths, tenant, None, None)
+    elapsed = time.perf_counter() - started
+    size = sum(os.path.getsize(path) for path in paths)
+print(json.dumps({"baseline_mb": baseline, "peak_mb": peak_mb(), "seconds": elapsed, "bytes": size}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export memory check")
+    parser.add_argument("--records", type=int, default=1_000_000, help="records of the exported tenant")
+    parser.add_argument("--weeks", type=int, default=520, help="weeks the records are spread over")
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--budget", type=float, default=50, help="MB the export may add to peak RSS")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite backend with this database file")
+    return parser.parse_args()
+
+
+def environment(args):
+    # the settings for this process and the export probe
+    env = {
+        "MONGO_URI": args.mongo_uri,
+        "MONGO_TLS": "false",
+        "DB_NAME": "expenses_export",
+    }
+    if args.sqlite:
+        env.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=args.sqlite)
+    return env
+
+
+def seed(store, records, weeks, tenant=TENANT):
+    # `records` records spread evenly over the last `weeks` weeks, inserted in batches
+    import isoweeks
+    import repository as repo
+
+    this_week = isoweeks.current()
+    per_week = max(1, records // weeks)
+    batch = []
+    for i in range(records):
+        week = isoweeks.shift(this_week, -(i // per_week))
+        category = random.choice(CATEGORIES)
+        amount = round(random.uniform(1, 100), 2)
+        batch.append({
+            "_id": f"bench:{tenant}:{i}",
+            "tenant": tenant,
+            "user": f"user{tenant}",
+            "amount": amount if category == "salary" else -amount,
+            "category": category,
+            "date": datetime.datetime.combine(week.start + datetime.timedelta(days=i % 7), datetime.time(12)),
+            "year": week.year,
+            "week": week.week,
+        })
+        if len(batch) >= 10000:
+            repo.insert_records_sync(batch)
+            batch = []
+    repo.insert_records_sync(batch)
+    store.set_estimates(tenant, this_week.key, {"expected_expenses.groceries": -60.0})
+
+
+def measure(env, fmt="xlsx", tenant=TENANT):
+    # runs the export in a fresh interpreter so seeding doesn't count towards its peak RSS
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, fmt, str(tenant)],
+        cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    env = environment(args)
+    # must happen before config is imported
+    os.environ.update(env)
+    if args.sqlite:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+    import config
+    import repository as repo
+
+    if not args.sqlite:
+        config.connect()
+        config.client.drop_database(config.DB_NAME)
+    store = repo.backend()
+    store.bootstrap()
+    seed(store, args.records, args.weeks)
+    repo.shutdown()
+
+    result = measure(env, args.format)
+    growth = result["peak_mb"] - result["baseline_mb"]
+    print(f"exported:     {args.records} records as {args.format}, {result['bytes'] / 1e6:.1f} MB "
+          f"in {result['seconds']:.1f} s")
+    print(f"peak RSS:     {result['peak_mb']:.0f} MB ({result['baseline_mb']:.0f} MB before the export)")
+    print(f"export added: {growth:.1f} MB (budget {args.budget:.0f} MB)")
+    if growth > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
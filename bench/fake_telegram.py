@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+import uvicorn
+from fastapi import FastAPI
+
+# Minimal stand-in for the Bot API: answers every method with a plausible
+# result so telegram_app can run without network access.
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+calls = Counter()
+latency = 0.0
+_message_id = 0
+
+app = FastAPI()
+
+
+def _message():
+    global _message_id
+    _message_id += 1
+    return {
+        "message_id": _message_id,
+        "date": int(time.time()),
+        "chat": {"id": 0, "type": "private"},
+        "from": BOT_USER,
+        "text": "",
+    }
+
+
+@app.post("/bot{token}/{method}")
+async def bot_api(token: str, method: str):
+    calls[method] += 1
+    if latency:
+        await asyncio.sleep(latency)
+
+    if method == "getMe":
+        result = BOT_USER
+    elif method in ("sendMessage", "editMessageText", "sendDocument"):
+        result = _message()
+    else:
+        result = True
+    return {"ok": True, "result": result}
+
+
+def start(port, api_latency=0.0):
+    # Runs the server on its own thread/loop so it doesn't compete with the bot's loop
+    global latency
+    latency = api_latency
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="fake-telegram", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
@@ -0,0 +1,69 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Import-time budget check: imports bot in a fresh interpreter without
+# TELEGRAM_TOKEN / MONGO_URI and fails when that takes longer than the
+# budget or creates a MongoClient / telegram Application. Usage, from the
+# repo root (tests/test_import_time.py runs it as well):
+#
+#   python -m bench.import_time --budget 1.5 --runs 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = 1.5
+
+PROBE = """
+import time
+started = time.perf_counter()
+import pymongo
+import telegram.ext
+
+created = []
+for cls in (pymongo.MongoClient, telegram.ext.Application):
+    def init(self, *args, _init=cls.__init__, _name=cls.__name__, **kwargs):
+        created.append(_name)
+        _init(self, *args, **kwargs)
+    cls.__init__ = init
+
+import bot
+elapsed = time.perf_counter() - started
+assert not created, f"{', '.join(created)} created at import"
+print(elapsed)
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds allowed for `import bot`")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to sample, the median counts")
+    return parser.parse_args()
+
+
+def measure():
+    env = {k: v for k, v in os.environ.items() if k not in ("TELEGRAM_TOKEN", "MONGO_URI")}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def sample(runs):
+    # (median, sorted samples) of `runs` fresh imports
+    samples = sorted(measure() for _ in range(runs))
+    return samples[len(samples) // 2], samples
+
+
+def main():
+    args = parse_args()
+    median, samples = sample(args.runs)
+    print(f"import bot: median {median * 1000:.0f} ms, min {samples[0] * 1000:.0f} ms, "
+          f"max {samples[-1] * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    if median > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
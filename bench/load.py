@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import time
+
+# Synthetic load against the bot's /webhook with a fake Bot API and a local
+# Mongo (or mongomock, or an SQLite file). Usage, from the repo root:
+#
+#   python -m bench.load --users 50 --weeks 52 --rate 50 --duration 20
+#   python -m bench.load --mongomock
+#   python -m bench.load --sqlite /tmp/expenses_bench.db
+#
+# Everything goes to the `expenses_bench` database (or the SQLite file),
+# which is dropped first.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = ["groceries", "rent", "travel", "party", "supplies", "subscriptions", "other"]
+
+# (weight, list of messages sent in order by the same chat)
+SCENARIOS = [
+    (30, ["/balance"]),
+    (20, ["/weekstats {week}"]),
+    (20, ["/showrecords {week}"]),
+    (30, ["/add", "-12.5", "groceries", "current"]),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Webhook load benchmark")
+    parser.add_argument("--users", type=int, default=20, help="distinct chats")
+    parser.add_argument("--weeks", type=int, default=52, help="weeks of seeded history per user")
+    parser.add_argument("--records-per-week", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=20, help="target updates per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--port", type=int, default=8081, help="port for the fake Bot API")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--mongomock", action="store_true", help="use in-memory mongomock instead of mongod")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite backend with this database file")
+    return parser.parse_args()
+
+
+def configure(args):
+    # must run before config/bot are imported
+    os.environ["TELEGRAM_TOKEN"] = "123456:bench"
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.port}/bot"
+    os.environ["WEBHOOK_URL"] = "http://127.0.0.1"
+    os.environ["WEBHOOK_SECRET"] = ""
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_TLS"] = "false"
+    os.environ["DB_NAME"] = "expenses_bench"
+    if args.sqlite:
+        os.environ["STORAGE_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = args.sqlite
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+    elif args.mongomock:
+        import mongomock
+        import pymongo
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **kw: client
+
+
+def seed(args):
+    import config
+    import repository as repo
+
+    if not args.sqlite:
+        config.connect()
+        config.client.drop_database(config.DB_NAME)
+    store = repo.backend()
+    store.bootstrap()
+    today = datetime.date.today()
+    batch = []
+    for user in range(1, args.users + 1):
+        for w in range(args.weeks):
+            day = today - datetime.timedelta(weeks=w)
+            year, week, _ = day.isocalendar()
+            for _ in range(args.records_per_week):
+                batch.append({
+                    "tenant": user,
+                    "user": f"user{user}",
+                    "amount": -round(random.uniform(1, 100), 2),
+                    "category": random.choice(CATEGORIES),
+                    "date": datetime.datetime.combine(day, datetime.time(12)),
+                    "year": year,
+                    "week": week,
+                })
+            if len(batch) >= 5000:
+                repo.insert_records_sync(batch)
+                batch = []
+    repo.insert_records_sync(batch)
+    for user in range(1, args.users + 1):
+        store.set_initial_balance(user, 1000)
+
+
+def make_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}", "username": f"user{chat_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def mongo_ops():
+    import metrics
+    return sum(
+        s.value for m in metrics.MONGO_LATENCY.collect() for s in m.samples if s.name.endswith("_count")
+    )
+
+
+async def run(args):
+    import httpx
+    import bot
+    from bench import fake_telegram
+
+    latencies = []
+    api = bot.create_app()
+    lifespan = api.router.lifespan_context(api)  # runs on_startup / on_shutdown
+    await lifespan.__aenter__()
+    api.state.dispatcher.on_processed = lambda update, seconds: latencies.append(seconds)
+    transport = httpx.ASGITransport(app=api)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+    today = datetime.date.today()
+    year, week, _ = today.isocalendar()
+    current = f"{year}-{week:02d}"
+
+    weights = [w for w, _ in SCENARIOS]
+    avg_updates = sum(w * len(msgs) for w, msgs in SCENARIOS) / sum(weights)
+    interval = avg_updates / args.rate
+
+    free_chats = list(range(1, args.users + 1))
+    next_id = iter(range(1, 10 ** 9))
+    statuses = {}
+    sent = 0
+
+    async def session(chat_id, messages):
+        nonlocal sent
+        try:
+            for text in messages:
+                response = await client.post("/webhook", json=make_update(next(next_id), chat_id, text.format(week=current)))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                sent += 1
+        finally:
+            free_chats.append(chat_id)
+
+    ops_before = mongo_ops()
+    api_before = sum(fake_telegram.calls.values())
+    started = time.perf_counter()
+    tasks = []
+    while time.perf_counter() - started < args.duration:
+        if free_chats:
+            chat_id = free_chats.pop(random.randrange(len(free_chats)))
+            messages = random.choices([m for _, m in SCENARIOS], weights=weights)[0]
+            tasks.append(asyncio.create_task(session(chat_id, messages)))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+
+    accepted = statuses.get(200, 0)
+    while len(latencies) < accepted:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    ops = mongo_ops() - ops_before
+    api_calls = sum(fake_telegram.calls.values()) - api_before
+    await client.aclose()
+    await lifespan.__aexit__(None, None, None)
+
+    print(f"updates sent:      {sent} ({statuses})")
+    print(f"throughput:        {len(latencies) / elapsed:.1f} updates/s")
+    print(f"latency p50/p95/p99: {percentile(latencies, 50) * 1000:.1f} / "
+          f"{percentile(latencies, 95) * 1000:.1f} / {percentile(latencies, 99) * 1000:.1f} ms")
+    if args.mongomock or args.sqlite:
+        print("mongo ops/update:  n/a with mongomock/sqlite")
+    else:
+        print(f"mongo ops/update:  {ops / max(len(latencies), 1):.2f}")
+    print(f"bot api calls/update: {api_calls / max(len(latencies), 1):.2f}")
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    from bench import fake_telegram
+    fake_telegram.start(args.port, args.api_latency)
+    seed(args)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,25 @@
 from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes
-from config import TELEGRAM_TOKEN, db, WEBHOOK_URL
+from telegram.ext import Application, AIORateLimiter, CommandHandler, ContextTypes
+import config
+from alerts import BudgetAlerts
+from dispatcher import UpdateDispatcher
+from persistence import StoragePersistence
+import repository as repo
+from replies import reply
 from fastapi import FastAPI, Request
-from handlers.balance import setbalance, balance
-from handlers.weekly import showweekly, currentweek, weekstats
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+import metrics
+from handlers.balance import setbalance, balance, forecast
+from handlers.weekly import showweekly, currentweek, weekstats, copyweekly
 from handlers.records import showrecords
+from handlers.ranges import range_page
+from handlers.export import export
+from handlers.recurring import recurring_command, materialise_job
+from archive import archive_job
+from handlers.importer import import_start, import_document, import_expect_document, IMPORT_FILE
 from telegram.ext import ConversationHandler, MessageHandler, filters
-from handlers.records import add_start, add_amount, add_category, add_week, cancel
+from handlers.records import add_start, add_amount, add_category, add_week, cancel, quick_add, QUICK_ADD_FILTER
 from handlers.records import ADD_AMOUNT, ADD_CATEGORY, ADD_WEEK
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackQueryHandler
@@ -16,7 +29,8 @@ from handlers.weekly import (
     setweekly_category, setweekly_amount, setweekly_continue,
     WEEK, TYPE, CATEGORY, AMOUNT, CONTINUE
 )
-import datetime
+import asyncio
+import isoweeks
 
 # === Commands ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -27,131 +41,281 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         return
     
-    await target.reply_text("Hello! Retrieving settings...")
-
-    settings = db.settings.find_one({"_id": "settings"})
+    tenant = update.effective_chat.id
+    settings = await repo.get_settings(tenant)
     keyboard = [
         [InlineKeyboardButton("➕ Add record", callback_data="add")],
         [InlineKeyboardButton("💰 Set balance", callback_data="setbalance")],
         [InlineKeyboardButton("💵 Project balance", callback_data="balance")],
+        [InlineKeyboardButton("🔮 Forecast", callback_data="forecast")],
         [InlineKeyboardButton("📅 Weekly estimate", callback_data="setweekly")],
         [InlineKeyboardButton("📊 Show weekly", callback_data="showweekly")],
         [InlineKeyboardButton("📈 Week stats", callback_data="weekstats")],
         [InlineKeyboardButton("📆 Current week", callback_data="currentweek")],
         [InlineKeyboardButton("📒 Show records", callback_data="showrecords")],
+        [InlineKeyboardButton("📤 Export", callback_data="export")],
+        [InlineKeyboardButton("📥 Import statement", callback_data="import")],
+        [InlineKeyboardButton("🔁 Recurring", callback_data="recurring")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    if not settings:
+    if not settings or "initial_balance" not in settings:
         # If missing, create default
-        settings = {
-            "_id": "settings",
-            "initial_balance": 0
-        }
-        db.settings.insert_one(settings)
-        await target.reply_text("No settings found. Created default settings with balance = 0.\nUse /setbalance <amount> to change it.")
+        await repo.set_initial_balance(tenant, 0)
+        msg = "No settings found. Created default settings with balance = 0.\nUse /setbalance <amount> to change it."
     else:
         balance = settings.get("initial_balance", 0)
-        await target.reply_text(f"Welcome! Current initial balance: {balance}.\nUse /setbalance <amount> to update.")
+        msg = f"Welcome! Current initial balance: {balance}.\nUse /setbalance <amount> to update."
 
-    await target.reply_text("Available commands:", reply_markup=reply_markup)
+    await reply(target, msg + "\n\nAvailable commands:", reply_markup=reply_markup)
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    today = datetime.date.today()
-    year, week, _ = today.isocalendar()
-    currentweekstring = f"{year}-{week:02d}"
+    currentweekstring = isoweeks.current().key
 
     # match callback_data
     if query.data == "add":
         keyboard = [[KeyboardButton("/add")]]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-        await query.edit_message_text("Choose the command below:")
+        await query.edit_message_text("Choose the command below, or just send records, one per line: -12.5 groceries")
         await query.message.reply_text("👇 Tap to send:", reply_markup=reply_markup)
     elif query.data == "setbalance":
         await query.edit_message_text("ℹ️ To set balance, use:\n`/setbalance <amount>`", parse_mode="Markdown")
-    if query.data == "setweekly":
+    elif query.data == "setweekly":
         keyboard = [[KeyboardButton("/setweekly")]]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-        await query.edit_message_text("Choose the command below:")
+        await query.edit_message_text(
+            "Choose the command below, or set a whole week at once:\n"
+            "/setweekly 2025-41 salary 2000, groceries -150\n"
+            "Copy a week's estimates with /copyweekly <src-week> <from>..<to>"
+        )
         await query.message.reply_text("👇 Tap to send:", reply_markup=reply_markup)
     elif query.data == "showweekly":
         await query.edit_message_text(f"ℹ️ To show weekly estimates, use:\n`/showweekly <year-week>`.\nCurrent week is {currentweekstring}", parse_mode="Markdown")
     elif query.data == "weekstats":
-        await query.edit_message_text(f"ℹ️ To view weekly stats, use:\n`/weekstats <year-week>`.\nCurrent week is {currentweekstring}", parse_mode="Markdown")
+        await query.edit_message_text(f"ℹ️ To view weekly stats, use:\n`/weekstats <year-week>`\nor a range: `/weekstats 2025-30..2025-42`, `/weekstats month`, `/weekstats quarter`.\nCurrent week is {currentweekstring}", parse_mode="Markdown")
     elif query.data == "currentweek":
         await query.edit_message_text("ℹ️ To show the current week, just use:\n`/currentweek`", parse_mode="Markdown")
     elif query.data == "showrecords":
-        await query.edit_message_text(f"ℹ️ To show records, use:\n`/showrecords <year-week>`.\nCurrent week is {currentweekstring}", parse_mode="Markdown")
+        await query.edit_message_text(f"ℹ️ To show records, use:\n`/showrecords <year-week>`\nor a range: `/showrecords 2025-30..2025-42`, `/showrecords month`, `/showrecords quarter`.\nCurrent week is {currentweekstring}", parse_mode="Markdown")
+    elif query.data == "recurring":
+        await query.edit_message_text(
+            "ℹ️ To manage recurring records, use:\n`/recurring` to list rules\n"
+            "`/recurring add <amount> <category> weekly|monthly [YYYY-MM-DD]`\n`/recurring del <id>`",
+            parse_mode="Markdown"
+        )
+    elif query.data == "forecast":
+        await query.edit_message_text("ℹ️ To forecast your balance, use:\n`/forecast [weeks]` (up to 52 weeks)", parse_mode="Markdown")
+    elif query.data == "export":
+        await query.edit_message_text("ℹ️ To export records and estimates, use:\n`/export [csv|xlsx] [from-week] [to-week]`", parse_mode="Markdown")
+    elif query.data == "import":
+        keyboard = [[KeyboardButton("/import")]]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+        await query.edit_message_text("Choose the command below:")
+        await query.message.reply_text("👇 Tap to send:", reply_markup=reply_markup)
     elif query.data == "balance":
         await balance(update, context)
         return
+    elif query.data.startswith("range:"):
+        await range_page(update, context)
+        return
     elif query.data == "return_start":
         await start(update, context)
         return
     else:
         await query.edit_message_text("❌ Unknown action")
 
-telegram_app  = Application.builder().token(TELEGRAM_TOKEN).build()
-
-telegram_app.add_handler(CommandHandler("start", start))
-telegram_app.add_handler(CallbackQueryHandler(button_handler))
-telegram_app.add_handler(CommandHandler("setbalance", setbalance))
-telegram_app.add_handler(CommandHandler("balance", balance))
-
-setweekly_conv = ConversationHandler(
-entry_points=[CommandHandler("setweekly", setweekly_start)],
-states={
-        WEEK: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_week)],
-        TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_type)],
-        CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_category)],
-        AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_amount)],
-        CONTINUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_continue)],
-    },
-fallbacks=[CommandHandler("cancel", cancel)],
+# === App ===
+def build_telegram_app(settings=config):
+    persistence = StoragePersistence(update_interval=settings.PERSISTENCE_INTERVAL)
+    telegram_app = (
+        Application.builder()
+        .token(settings.TELEGRAM_TOKEN)
+        .base_url(settings.TELEGRAM_API_URL)
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
+        .persistence(persistence)
+        # queue outgoing calls under Telegram's global and per-group limits, retry 429s
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=settings.RATE_LIMIT_OVERALL,
+            group_max_rate=settings.RATE_LIMIT_GROUP,
+            max_retries=settings.RATE_LIMIT_RETRIES
+        ))
+        .build()
     )
-telegram_app.add_handler(setweekly_conv)
+
+    telegram_app.add_handler(CommandHandler("start", start))
+    telegram_app.add_handler(CallbackQueryHandler(button_handler))
+    telegram_app.add_handler(CommandHandler("setbalance", setbalance))
+    telegram_app.add_handler(CommandHandler("balance", balance))
+    telegram_app.add_handler(CommandHandler("forecast", forecast))
+
+    setweekly_conv = ConversationHandler(
+        entry_points=[CommandHandler("setweekly", setweekly_start)],
+        states={
+            WEEK: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_week)],
+            TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_type)],
+            CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_category)],
+            AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_amount)],
+            CONTINUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, setweekly_continue)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="setweekly",
+        persistent=True,
+    )
+    telegram_app.add_handler(setweekly_conv)
 
     # app.add_handler(CommandHandler("setweekly", setweekly))
-telegram_app.add_handler(CommandHandler("showweekly", showweekly))
-telegram_app.add_handler(CommandHandler("currentweek", currentweek))
-
-conv_handler = ConversationHandler(
-entry_points=[CommandHandler("add", add_start)],
-states={
-        ADD_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_amount)],
-        ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_category)],
-        ADD_WEEK: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_week)],
-    },
-fallbacks=[CommandHandler("cancel", cancel)],
-)
-telegram_app.add_handler(conv_handler)
-
-# app.add_handler(CommandHandler("add", add))
-telegram_app.add_handler(CommandHandler("showrecords", showrecords))
-telegram_app.add_handler(CommandHandler("weekstats", weekstats))
-
-api = FastAPI()
-@api.post("/webhook")
-async def webhook(request: Request):
-    data = await request.json()
-    update = Update.de_json(data, telegram_app.bot)
-    await telegram_app.process_update(update)
-    return {"ok": True}
-
-@api.on_event("startup")
-async def on_startup():
-    # Initialize and start telegram app
-    await telegram_app.initialize()
-    await telegram_app.start()
-    # Set webhook
-    await telegram_app.bot.set_webhook(WEBHOOK_URL + "/webhook")
-@api.on_event("shutdown")
-async def on_shutdown():
-    await telegram_app.stop()
-    await telegram_app.shutdown()
+    telegram_app.add_handler(CommandHandler("showweekly", showweekly))
+    telegram_app.add_handler(CommandHandler("currentweek", currentweek))
+    telegram_app.add_handler(CommandHandler("copyweekly", copyweekly))
+
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("add", add_start)],
+        states={
+            ADD_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_amount)],
+            ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_category)],
+            ADD_WEEK: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_week)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="add",
+        persistent=True,
+    )
+    telegram_app.add_handler(conv_handler)
+
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", import_start)],
+        states={
+            IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, import_document),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, import_expect_document),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="import",
+        persistent=True,
+    )
+    telegram_app.add_handler(import_conv)
+
+    # app.add_handler(CommandHandler("add", add))
+    telegram_app.add_handler(CommandHandler("showrecords", showrecords))
+    telegram_app.add_handler(CommandHandler("weekstats", weekstats))
+    telegram_app.add_handler(CommandHandler("export", export))
+    telegram_app.add_handler(CommandHandler("recurring", recurring_command))
+    # "-12.5 groceries" style messages outside a conversation, see quick_add
+    telegram_app.add_handler(MessageHandler(QUICK_ADD_FILTER, quick_add))
+
+    # Time every handler, including ones registered after this point
+    metrics.instrument(telegram_app)
+    return telegram_app
+
+
+def create_app(settings=config):
+    # `settings` is any object with the names defined in config.py, handed
+    # on to the repository, storage backend, migrations and jobs. Only the
+    # year span of the ISO-week table (WEEKS_*_YEAR) is read from config, as
+    # isoweeks.py builds it at import. Nothing here connects to Mongo or
+    # Telegram, that happens in on_startup, so the module imports fast and
+    # the app can be built without real credentials.
+    api = FastAPI()
+    api.state.telegram_app = None
+    api.state.dispatcher = None
+    api.state.alerts = None
+
+    @api.post("/webhook")
+    async def webhook(request: Request):
+        if settings.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != settings.WEBHOOK_SECRET:
+            metrics.WEBHOOK_UPDATES.labels("forbidden").inc()
+            return JSONResponse({"ok": False}, status_code=403)
+        telegram_app, dispatcher = api.state.telegram_app, api.state.dispatcher
+        if dispatcher is None:
+            # still starting up, Telegram retries later
+            metrics.WEBHOOK_UPDATES.labels("rejected").inc()
+            return JSONResponse({"ok": False}, status_code=503)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, telegram_app.bot)
+        except Exception:
+            update = None
+        if update is None:
+            metrics.WEBHOOK_UPDATES.labels("invalid").inc()
+            return JSONResponse({"ok": False}, status_code=400)
+
+        # seen by this worker (in memory) or by any worker (processed_updates)
+        if dispatcher.is_duplicate(update) or not await repo.claim_update(update.update_id):
+            metrics.WEBHOOK_UPDATES.labels("duplicate").inc()
+            return {"ok": True}
+        # Acknowledge right away, handlers run on the dispatcher workers.
+        # When the chat's queue is full Telegram will redeliver the update later.
+        if not dispatcher.submit(update):
+            await repo.release_update(update.update_id)
+            metrics.WEBHOOK_UPDATES.labels("rejected").inc()
+            return JSONResponse({"ok": False}, status_code=503)
+        metrics.WEBHOOK_UPDATES.labels("accepted").inc()
+        return {"ok": True}
+
+    @api.get("/cache")
+    async def cache_stats():
+        return repo.cache_stats()
+
+    @api.get("/metrics")
+    async def prometheus_metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    @api.on_event("startup")
+    async def on_startup():
+        repo.configure(settings)
+        # Make sure tables, indexes and schema are up to date before serving updates
+        await repo.bootstrap()
+        repo.start_cache_watchers()
+        # Build, initialize and start telegram app
+        telegram_app = build_telegram_app(settings)
+        await telegram_app.initialize()
+        await telegram_app.start()
+        # due recurring records, first run right after startup catches up on downtime
+        telegram_app.job_queue.run_repeating(materialise_job, interval=settings.RECURRING_INTERVAL, first=1)
+        # old weeks out of the hot records, first run once startup traffic has settled
+        if settings.ARCHIVE_WEEKS > 0:
+            telegram_app.job_queue.run_repeating(
+                archive_job, interval=settings.ARCHIVE_INTERVAL, first=60, data=settings.ARCHIVE_WEEKS
+            )
+        dispatcher = UpdateDispatcher(
+            telegram_app,
+            workers=settings.WEBHOOK_WORKERS,
+            queue_size=settings.WEBHOOK_QUEUE_SIZE,
+            persistence=telegram_app.persistence
+        )
+        await dispatcher.start()
+        metrics.QUEUE_DEPTH.set_function(dispatcher.qsize)
+        api.state.telegram_app, api.state.dispatcher = telegram_app, dispatcher
+        if settings.BUDGET_ALERTS:
+            api.state.alerts = BudgetAlerts(
+                telegram_app.bot, asyncio.get_running_loop(), poll_interval=settings.BUDGET_ALERTS_POLL_INTERVAL
+            )
+            api.state.alerts.start()
+        # Set webhook
+        await telegram_app.bot.set_webhook(settings.WEBHOOK_URL + "/webhook", secret_token=settings.WEBHOOK_SECRET)
+
+    @api.on_event("shutdown")
+    async def on_shutdown():
+        telegram_app, dispatcher = api.state.telegram_app, api.state.dispatcher
+        api.state.telegram_app = api.state.dispatcher = None
+        if api.state.alerts is not None:
+            api.state.alerts.stop()
+            api.state.alerts = None
+        if dispatcher is not None:
+            await dispatcher.stop()
+        if telegram_app is not None:
+            await telegram_app.stop()
+            await telegram_app.shutdown()
+        repo.shutdown()
+
+    return api
+
+
+# uvicorn bot:api (or uvicorn --factory bot:create_app)
+api = create_app()
 
 # === Main ===
 # def main():
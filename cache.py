@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class TTLCache:
+    # Small LRU cache whose entries also expire after `ttl` seconds. Used from
+    # both the event loop and the repository thread pool, hence the lock.
+    # `requests` is an optional prometheus Counter labelled by cache and result.
+    #
+    # Read-through callers take `generation` before reading storage and pass
+    # it to set(), which drops the value when an invalidate() ran in between,
+    # so a read racing a write never caches what the write replaced.
+
+    def __init__(self, name, maxsize=1024, ttl=60, requests=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._counted = requests is not None
+        if self._counted:
+            self._hit = requests.labels(name, "hit")
+            self._miss = requests.labels(name, "miss")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._data.pop(key, None)
+                self.misses += 1
+                if self._counted:
+                    self._miss.inc()
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            if self._counted:
+                self._hit.inc()
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=MISSING):
+        with self._lock:
+            self.generation += 1
+            if key is MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+def watch(collection, cache, stop_event, max_delay=60):
+    # Invalidate `cache` whenever another process changes `collection`. A failed
+    # stream is reopened with backoff, and as changes may have been missed
+    # meanwhile the whole cache is dropped first.
+    delay = 1
+    while not stop_event.is_set():
+        try:
+            with collection.watch(max_await_time_ms=1000) as stream:
+                cache.invalidate()
+                while stream.alive and not stop_event.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    delay = 1
+                    key = change.get("documentKey", {}).get("_id", MISSING)
+                    cache.invalidate(key)
+        except Exception:
+            logger.exception("Change stream on %s failed, reopening in %ss", collection.name, delay)
+            if stop_event.wait(delay):
+                return
+            delay = min(delay * 2, max_delay)
@@ -1,23 +1,133 @@
 import os
+import sys
+import threading
 from pymongo import MongoClient
 from dotenv import load_dotenv
-from telegram.ext import Application
+from metrics import MongoCommandListener
 
 load_dotenv()
 
-DB_NAME = "expenses"
+DB_NAME = os.getenv("DB_NAME", "expenses")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Bot API base url, override to point the bot at a local/fake Bot API server
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+# set to false for a local mongod without TLS
+MONGO_TLS = os.getenv("MONGO_TLS", "true").lower() in ("1", "true", "yes")
+# chat id that inherits data created before the bot became multi-tenant
+DEFAULT_TENANT = int(os.getenv("DEFAULT_TENANT")) if os.getenv("DEFAULT_TENANT") else None
+# optional secret Telegram sends back in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# concurrent update consumers and per-consumer queue capacity
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+# outgoing Bot API limits: messages/sec overall, messages/min per group chat
+RATE_LIMIT_OVERALL = float(os.getenv("RATE_LIMIT_OVERALL", "30"))
+RATE_LIMIT_GROUP = float(os.getenv("RATE_LIMIT_GROUP", "20"))
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+# seconds between persistence syncs of conversation state / user data
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "1"))
+# read-through cache for settings and week estimates
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "1024"))
+# invalidate caches from Mongo change streams (needs a replica set), for multi-worker setups
+CACHE_CHANGE_STREAM = os.getenv("CACHE_CHANGE_STREAM", "").lower() in ("1", "true", "yes")
+# size of the thread pool that runs blocking storage calls
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+# push a message when a category's spending passes its weekly estimate;
+# the poll interval (seconds) is used when change streams are unavailable
+BUDGET_ALERTS = os.getenv("BUDGET_ALERTS", "true").lower() in ("1", "true", "yes")
+BUDGET_ALERTS_POLL_INTERVAL = float(os.getenv("BUDGET_ALERTS_POLL_INTERVAL", "5"))
+# seconds between runs of the job that turns due recurring rules into records
+RECURRING_INTERVAL = float(os.getenv("RECURRING_INTERVAL", "3600"))
+# records of weeks older than ARCHIVE_WEEKS are moved to records_archive and
+# read through per-week summaries, checked every ARCHIVE_INTERVAL seconds (0 disables)
+ARCHIVE_WEEKS = int(os.getenv("ARCHIVE_WEEKS", "52"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "86400"))
+# years covered by the precomputed ISO-week table (isoweeks.py)
+WEEKS_FIRST_YEAR = int(os.getenv("WEEKS_FIRST_YEAR", "2000"))
+WEEKS_LAST_YEAR = int(os.getenv("WEEKS_LAST_YEAR", "2100"))
+# where data lives: "mongo" (MONGO_URI) or "sqlite", an embedded database
+# file at SQLITE_PATH for single-household deployments and local runs
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "expenses.db")
+# how long handled update ids are remembered, Telegram gives up redelivering after 24h
+PROCESSED_UPDATES_TTL = int(os.getenv("PROCESSED_UPDATES_TTL", "86400"))
+# seconds a worker waits for a migration another worker is running; a claim
+# older than that is taken to belong to a crashed worker and run again
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "600"))
+
+# MongoClient pool; timeouts are in milliseconds, 0 means no socket timeout
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+
+# The client is created on first use (or by connect() on startup), so
+# importing this module never touches the network.
+client = None
+db = None
+_settings = None
+_connect_lock = threading.Lock()
+
+
+def connect(settings=None):
+    # `settings` is any object with the names above. Without one, the last
+    # settings passed here are used, or this module before the first call.
+    global client, db, _settings
+    if client is not None:
+        return db
+    with _connect_lock:
+        if client is not None:
+            return db
+        settings = _settings = settings or _settings or sys.modules[__name__]
+        new_client = MongoClient(
+            settings.MONGO_URI,
+            tls=settings.MONGO_TLS,
+            tlsAllowInvalidCertificates=False,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[MongoCommandListener()]
+        )
+        db = new_client[settings.DB_NAME]
+        client = new_client
+    return db
+
+
+def close():
+    global client, db
+    with _connect_lock:
+        if client is not None:
+            client.close()
+        client = db = None
+
+
+class LazyCollection:
+    # Stands in for a pymongo Collection and resolves it on every use, so
+    # modules can keep `from config import records` without connecting at import.
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(connect()[self.name], attr)
 
-client = MongoClient(
-    MONGO_URI,
-    tls=True,
-    tlsAllowInvalidCertificates=False
-)
-db = client[DB_NAME]
 
 # Collections
-settings = db["settings"]
-records = db["records"]
-week_estimates = db["week_estimates"]
+settings = LazyCollection("settings")
+records = LazyCollection("records")
+week_estimates = LazyCollection("week_estimates")
+week_totals = LazyCollection("week_totals")
+migrations = LazyCollection("migrations")
+persistence = LazyCollection("persistence")
+processed_updates = LazyCollection("processed_updates")
+recurring = LazyCollection("recurring")
+records_archive = LazyCollection("records_archive")
+week_summaries = LazyCollection("week_summaries")
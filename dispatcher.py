@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from telegram import Update
+from metrics import UPDATE_ERRORS, UPDATE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDispatcher:
+    # Decouples the webhook from handler execution. Updates are sharded by chat
+    # onto one bounded queue per worker, so a chat's updates are always handled
+    # by the same worker in arrival order while different chats run concurrently.
+
+    def __init__(self, application, workers=4, queue_size=100, dedup_size=10000, persistence=None):
+        self.application = application
+        self.persistence = persistence
+        self.workers = workers
+        self.queue_size = queue_size
+        self.dedup_size = dedup_size
+        self._queues = []
+        self._tasks = []
+        self._seen = OrderedDict()
+        # optional callable(update, seconds) run after each update, used by the benchmarks
+        self.on_processed = None
+
+    async def start(self):
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"update-worker-{i}")
+            for i, queue in enumerate(self._queues)
+        ]
+
+    async def stop(self):
+        # let already accepted updates finish before shutting the app down
+        for queue in self._queues:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    def is_duplicate(self, update: Update):
+        return update.update_id in self._seen
+
+    def submit(self, update: Update):
+        # Returns False when the chat's queue is full, the caller should then
+        # ask Telegram to redeliver later instead of blocking the request.
+        if self.is_duplicate(update):
+            return True
+
+        queue = self._queues[self._shard(update)]
+        try:
+            queue.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            return False
+
+        self._seen[update.update_id] = True
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        return True
+
+    def _shard(self, update: Update):
+        if update.effective_chat:
+            key = update.effective_chat.id
+        elif update.effective_user:
+            key = update.effective_user.id
+        else:
+            key = update.update_id
+        return key % self.workers
+
+    async def _worker(self, queue):
+        while True:
+            update, enqueued = await queue.get()
+            try:
+                if self.persistence:
+                    await self.persistence.load_update_state(self.application, update)
+                await self.application.process_update(update)
+                if self.persistence:
+                    # hand the new state to other workers before the next update of the chat
+                    await self.persistence.save_update_state(self.application)
+            except Exception:
+                UPDATE_ERRORS.inc()
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                elapsed = time.perf_counter() - enqueued
+                UPDATE_LATENCY.observe(elapsed)
+                if self.on_processed:
+                    self.on_processed(update, elapsed)
+                queue.task_done()
@@ -0,0 +1,91 @@
+import datetime
+import isoweeks
+
+# Balance forecast over the coming weeks. Each week and category is
+# forecast from the week estimate when one exists and otherwise from a
+# rolling average of the HISTORY_WEEKS weeks before it (actuals for the
+# past, forecasts once the window moves into the future). Only what is
+# still expected on top of already recorded records moves the balance,
+# since those are part of the current balance already.
+
+HISTORY_WEEKS = 12
+MAX_WEEKS = 52
+
+
+def horizon(today=None):
+    # (past weeks, forecast weeks), the current week is the first forecast week
+    this_week = isoweeks.of(today or datetime.date.today())
+    past = isoweeks.between(isoweeks.shift(this_week, -HISTORY_WEEKS), isoweeks.shift(this_week, -1))
+    future = isoweeks.between(this_week, isoweeks.shift(this_week, MAX_WEEKS - 1))
+    return [w.key for w in past], [w.key for w in future]
+
+
+def _per_category(doc, *fields):
+    values = {}
+    for field in fields:
+        for cat, amount in (doc or {}).get(field, {}).items():
+            values[cat] = values.get(cat, 0) + amount
+    return values
+
+
+def build(balance, past, future, totals, estimates):
+    # `totals` and `estimates` are week_totals / week_estimates docs keyed by
+    # year-week (see repository.weeks_summary). Returns one row per future week:
+    # {"year_week", "delta", "balance", "source"}, source being "est", "avg" or "est+avg".
+    import numpy as np  # imported on first use to keep startup fast
+
+    actual = [_per_category(totals.get(yw), "incomes", "expenses") for yw in past + future]
+    planned = [_per_category(estimates.get(yw), "expected_incomes", "expected_expenses") for yw in future]
+    categories = sorted({cat for week in actual + planned for cat in week})
+    index = {cat: i for i, cat in enumerate(categories)}
+
+    def matrix(weeks):
+        m = np.zeros((len(weeks), len(categories)))
+        mask = np.zeros((len(weeks), len(categories)), dtype=bool)
+        for row, week in enumerate(weeks):
+            for cat, amount in week.items():
+                m[row, index[cat]] = amount
+                mask[row, index[cat]] = True
+        return m, mask
+
+    history, _ = matrix(actual[:len(past)])
+    recorded, _ = matrix(actual[len(past):])
+    planned, has_plan = matrix(planned)
+
+    # Leading weeks before the tenant's first record would drag the average to 0
+    active = np.flatnonzero(history.any(axis=1))
+    history = history[active[0]:] if active.size else history[:0]
+
+    # Rolling window over actuals followed by forecasts, one row per step
+    series = np.vstack([history, np.zeros_like(planned)])
+    forecast = np.empty_like(planned)
+    for i in range(len(future)):
+        end = len(history) + i
+        window = series[max(0, end - HISTORY_WEEKS):end]
+        average = window.mean(axis=0) if len(window) else np.zeros(len(categories))
+        forecast[i] = np.where(has_plan[i], planned[i], average)
+        series[end] = forecast[i]
+
+    # Still to come: forecast minus what is recorded already, never past zero
+    # (nothing for categories forecast at 0, their records are in the balance)
+    remaining = forecast - recorded
+    remaining = np.where(forecast > 0, np.maximum(remaining, 0), np.minimum(remaining, 0))
+    remaining = np.where(forecast == 0, 0, remaining)
+    deltas = remaining.sum(axis=1)
+    balances = balance + np.cumsum(deltas)
+
+    rows = []
+    for i, yw in enumerate(future):
+        if not has_plan[i].any():
+            source = "avg"
+        elif has_plan[i].all():
+            source = "est"
+        else:
+            source = "est+avg"
+        rows.append({
+            "year_week": yw,
+            "delta": round(float(deltas[i]), 2),
+            "balance": round(float(balances[i]), 2),
+            "source": source,
+        })
+    return rows
@@ -1,8 +1,11 @@
-from config import db
+import repository as repo
 from telegram import Update
 from telegram.ext import ContextTypes
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from replies import reply
 import datetime
+import isoweeks
+import recurring
+from forecast import MAX_WEEKS
 
 async def setbalance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -11,16 +14,9 @@ async def setbalance(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /setbalance <amount>")
         return
     
-    db.settings.update_one(
-        {"_id": "settings"},
-        {"$set": {"initial_balance": amount}},
-        upsert=True
-    )
+    await repo.set_initial_balance(update.effective_chat.id, amount)
     
-    await update.message.reply_text(f"Initial balance set to {amount}")
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, f"Initial balance set to {amount}")
 
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:   # normal command
@@ -30,49 +26,71 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         return
     
-    settings = db.settings.find_one({"_id": "settings"})
-    if not settings:
+    tenant = update.effective_chat.id
+    # --- Step 1: current balance is maintained incrementally on every write
+    current_balance = await repo.get_balance(tenant)
+    if current_balance is None:
         await target.reply_text("⚠️ No initial balance set. Use /setbalance <amount> first.")
         return
     
-    initial_balance = settings.get("initial_balance", 0)
     today = datetime.date.today()
-    year, week, _ = today.isocalendar()
-    current_year_week = f"{year}-{week:02d}"
-
-    # --- Step 1: sum all real records up to today
-    real_records = list(db.records.find())
-    real_total = sum(r["amount"] for r in real_records)
-    current_balance = initial_balance + real_total
 
     msg = f"💵 Current balance: {current_balance}\n\n"
 
     # --- Step 2: projection for next 4 weeks
     weeks_to_show = 4
-    projected_balance = current_balance
-    for i in range(weeks_to_show):
-        future_date = today + datetime.timedelta(weeks=i)
-        y, w, _ = future_date.isocalendar()
-        yw = f"{y}-{w:02d}"
+    this_week = isoweeks.of(today)
+    weeks = [isoweeks.shift(this_week, i) for i in range(weeks_to_show)]
 
-        est_doc = db.week_estimates.find_one({"_id": yw})
+    summary = await repo.weeks_summary(tenant, [w.key for w in weeks])
+    rules = await repo.list_rules(tenant)
+    projected_balance = current_balance
+    for week in weeks:
+        yw = week.key
+        est_doc = summary["estimates"].get(yw)
         expected_incomes = sum(est_doc.get("expected_incomes", {}).values()) if est_doc else 0
         expected_expenses = sum(est_doc.get("expected_expenses", {}).values()) if est_doc else 0
         expected_net = expected_incomes - expected_expenses
 
         # real records for that week (if already added)
-        real_week_records = list(db.records.find({"year": y, "week": w}))
-        real_net = sum(r["amount"] for r in real_week_records)
+        totals = summary["weeks"].get(yw)
 
-        # use real if available, else estimates
-        if real_week_records:
-            delta = real_net
+        # use real if available, else estimates, else recurring rules
+        if totals and totals.get("count"):
+            delta = totals.get("income", 0) + totals.get("expense", 0)
             note = "real"
-        else:
+        elif est_doc or not rules:
             delta = expected_net
             note = "est"
+        else:
+            delta = recurring.weekly_amount(rules, week)
+            note = "recurring"
         
         projected_balance += delta
         msg += f"Week {yw}: change {delta} ({note}), balance → {projected_balance}\n"
 
     await target.reply_text(msg)
+
+async def forecast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        weeks = int(context.args[0]) if context.args else 12
+        if not 1 <= weeks <= MAX_WEEKS:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"Usage: /forecast [weeks], 1 to {MAX_WEEKS}")
+        return
+
+    rows = await repo.get_forecast(update.effective_chat.id)
+    if rows is None:
+        await update.message.reply_text("⚠️ No initial balance set. Use /setbalance <amount> first.")
+        return
+
+    msg = f"📈 Forecast for the next {weeks} weeks\n"
+    msg += "(est = weekly estimate, avg = average of recent weeks)\n\n"
+    msg += "```\n"
+    msg += f"{'week':<8}{'change':>11}{'balance':>12}  source\n"
+    for row in rows[:weeks]:
+        msg += f"{row['year_week']:<8}{row['delta']:>11.2f}{row['balance']:>12.2f}  {row['source']}\n"
+    msg += "```\n"
+
+    await reply(update.message, msg, parse_mode="Markdown")
@@ -0,0 +1,98 @@
+import csv
+import os
+import tempfile
+from telegram import Update
+from telegram.ext import ContextTypes
+from replies import MENU
+import repository as repo
+import isoweeks
+
+RECORD_COLUMNS = ["date", "year", "week", "category", "amount", "user"]
+ESTIMATE_COLUMNS = ["year_week", "type", "category", "amount"]
+
+
+def _record_row(r):
+    return [r.get("date"), r.get("year"), r.get("week"), r.get("category"), r.get("amount"), r.get("user")]
+
+
+def _estimate_rows(doc):
+    for est_type in ("income", "expense"):
+        for cat, amount in doc.get(f"expected_{est_type}s", {}).items():
+            yield [doc["year_week"], est_type, cat, amount]
+
+
+# Both writers pull documents from the cursors batch by batch and write them out
+# immediately, so memory stays flat no matter how many weeks are exported.
+def _write_xlsx(path, tenant, start, end):
+    from openpyxl import Workbook  # heavy, only needed for xlsx exports
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("records")
+    ws.append(RECORD_COLUMNS)
+    for r in repo.iter_records(tenant, start, end):
+        ws.append(_record_row(r))
+
+    ws = wb.create_sheet("estimates")
+    ws.append(ESTIMATE_COLUMNS)
+    for doc in repo.iter_estimates(tenant, start, end):
+        for row in _estimate_rows(doc):
+            ws.append(row)
+    wb.save(path)
+
+
+def _write_csv(records_path, estimates_path, tenant, start, end):
+    with open(records_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RECORD_COLUMNS)
+        for r in repo.iter_records(tenant, start, end):
+            writer.writerow(_record_row(r))
+
+    with open(estimates_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ESTIMATE_COLUMNS)
+        for doc in repo.iter_estimates(tenant, start, end):
+            writer.writerows(_estimate_rows(doc))
+
+
+def _parse_week(text):
+    week = isoweeks.parse(text)
+    return week.year, week.week
+
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = list(context.args)
+    fmt = "xlsx"
+    if args and args[0].lower() in ("csv", "xlsx"):
+        fmt = args.pop(0).lower()
+
+    try:
+        start = _parse_week(args[0]) if len(args) > 0 else None
+        end = _parse_week(args[1]) if len(args) > 1 else None
+    except ValueError:
+        await update.message.reply_text("Usage: /export [csv|xlsx] [from-week] [to-week]")
+        return
+
+    suffix = ""
+    if start:
+        suffix += f"_{isoweeks.key(*start)}"
+    if end:
+        suffix += f"_{isoweeks.key(*end)}"
+
+    tenant = update.effective_chat.id
+    await update.message.reply_text("⏳ Preparing export...")
+    with tempfile.TemporaryDirectory() as tmp:
+        if fmt == "xlsx":
+            files = [(os.path.join(tmp, "export.xlsx"), f"expenses{suffix}.xlsx")]
+            await repo.run_blocking(_write_xlsx, files[0][0], tenant, start, end)
+        else:
+            files = [
+                (os.path.join(tmp, "records.csv"), f"records{suffix}.csv"),
+                (os.path.join(tmp, "estimates.csv"), f"estimates{suffix}.csv"),
+            ]
+            await repo.run_blocking(_write_csv, files[0][0], files[1][0], tenant, start, end)
+
+        for i, (path, filename) in enumerate(files):
+            # menu keyboard rides on the last document instead of a separate message
+            reply_markup = MENU if i == len(files) - 1 else None
+            with open(path, "rb") as f:
+                await update.message.reply_document(document=f, filename=filename, reply_markup=reply_markup)
@@ -0,0 +1,268 @@
+import csv
+import datetime
+import hashlib
+import os
+import re
+import tempfile
+import time
+from telegram import Update
+from telegram.ext import ContextTypes, ConversationHandler
+from replies import reply
+import repository as repo
+import isoweeks
+from handlers.records import CATEGORIES, check_sign
+
+# States
+IMPORT_FILE = 0
+
+CHUNK_SIZE = 500
+
+# Column names we recognise in bank statements (lowercased)
+DATE_COLUMNS = ["date", "booking date", "transaction date", "value date"]
+AMOUNT_COLUMNS = ["amount", "value", "sum"]
+DESCRIPTION_COLUMNS = ["description", "details", "payee", "memo", "note", "category"]
+
+# First keyword found as a whole word (or its plural) in the lowercased
+# description wins, so "tip" matches "tips" but not "multiple"
+CATEGORY_RULES = [
+    ("salary", "salary"),
+    ("payroll", "salary"),
+    ("bonus", "bonus"),
+    ("tip", "tips"),
+    ("rent", "rent"),
+    ("landlord", "rent"),
+    ("supermarket", "groceries"),
+    ("grocery", "groceries"),
+    ("groceries", "groceries"),
+    ("lidl", "groceries"),
+    ("aldi", "groceries"),
+    ("tesco", "groceries"),
+    ("uber", "travel"),
+    ("bolt", "travel"),
+    ("airline", "travel"),
+    ("railway", "travel"),
+    ("hotel", "travel"),
+    ("bar", "party"),
+    ("pub", "party"),
+    ("club", "party"),
+    ("netflix", "subscriptions"),
+    ("spotify", "subscriptions"),
+    ("subscription", "subscriptions"),
+    ("office", "supplies"),
+    ("stationery", "supplies"),
+]
+
+KEYWORD_PATTERNS = [(re.compile(rf"\b{re.escape(keyword)}s?\b"), category) for keyword, category in CATEGORY_RULES]
+
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y"]
+
+
+def categorize(description):
+    text = description.strip().lower()
+    if text in CATEGORIES:
+        return text
+    for pattern, category in KEYWORD_PATTERNS:
+        if pattern.search(text):
+            return category
+    return "other"
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"unknown date '{text}'")
+
+
+def _grouped(text, separator):
+    # "1.234.567" with separator "." - every group after the first has 3 digits
+    head, *groups = text.lstrip("+-").split(separator)
+    return 1 <= len(head) <= 3 and all(len(group) == 3 for group in groups)
+
+
+def _parse_amount(value):
+    # "12.5", "12,5", "1,234.56" and "1.234,56" are all understood; when both
+    # separators appear the last one is the decimal mark. A single separator
+    # before three digits ("1,234") could be either and is rejected.
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(" ", "").replace("\xa0", "")
+    commas, dots = text.count(","), text.count(".")
+    if commas and dots:
+        decimal, thousands = (",", ".") if text.rfind(",") > text.rfind(".") else (".", ",")
+        whole, _, fraction = text.rpartition(decimal)
+        if decimal in whole or not _grouped(whole, thousands):
+            raise ValueError(f"ambiguous amount '{value}'")
+        text = whole.replace(thousands, "") + "." + fraction
+    elif commas > 1 or dots > 1:
+        separator = "," if commas else "."
+        if not _grouped(text, separator):
+            raise ValueError(f"ambiguous amount '{value}'")
+        text = text.replace(separator, "")
+    else:
+        separator = "," if commas else "."
+        head, _, fraction = text.partition(separator)
+        # "1,234" is a thousand or one and a bit depending on the bank, "0,125" is not
+        if len(fraction) == 3 and fraction.isdigit() and _grouped(text, separator) and not head.lstrip("+-").startswith("0"):
+            raise ValueError(f"ambiguous amount '{value}'")
+        text = text.replace(",", ".")
+    return float(text)
+
+
+def _find_column(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def _iter_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _iter_xlsx(path):
+    from openpyxl import load_workbook  # heavy, only needed for xlsx imports
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _content_id(tenant, date, amount, description, occurrence):
+    # Same statement line → same id, so importing a file twice is a no-op.
+    # `occurrence` keeps genuinely repeated lines (two identical coffees) apart.
+    raw = f"{tenant}|{date.isoformat()}|{amount}|{description}|{occurrence}"
+    return "import:" + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def import_file(path, kind, tenant, user):
+    rows = _iter_xlsx(path) if kind == "xlsx" else _iter_csv(path)
+    stats = {"rows": 0, "inserted": 0, "duplicates": 0, "rejected": [], "seconds": 0}
+    started = time.monotonic()
+
+    header = [str(c or "").strip().lower() for c in next(rows, [])]
+    date_col = _find_column(header, DATE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    desc_col = _find_column(header, DESCRIPTION_COLUMNS)
+    if date_col is None or amount_col is None:
+        raise ValueError("File needs 'date' and 'amount' columns")
+
+    seen = {}
+    chunk = []
+
+    def flush():
+        inserted = repo.insert_records_sync(chunk)
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(chunk) - inserted
+        chunk.clear()
+
+    for line_no, row in enumerate(rows, start=2):
+        if not row or all(c in (None, "") for c in row):
+            continue
+        stats["rows"] += 1
+        try:
+            date = _parse_date(row[date_col])
+            amount = _parse_amount(row[amount_col])
+            description = str(row[desc_col] or "").strip() if desc_col is not None else ""
+        except (ValueError, IndexError, TypeError) as e:
+            stats["rejected"].append(f"line {line_no}: {e}")
+            continue
+
+        category = categorize(description)
+        error = check_sign(amount, category)
+        if error:
+            stats["rejected"].append(f"line {line_no}: {error} ({amount} {category})")
+            continue
+
+        signature = (date, amount, description)
+        seen[signature] = seen.get(signature, 0) + 1
+        try:
+            week = isoweeks.of(date)
+        except ValueError as e:
+            stats["rejected"].append(f"line {line_no}: {e}")
+            continue
+        chunk.append({
+            "_id": _content_id(tenant, date, amount, description, seen[signature]),
+            "tenant": tenant,
+            "user": user,
+            "amount": amount,
+            "category": category,
+            "description": description,
+            "date": date,
+            "year": week.year,
+            "week": week.week,
+        })
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+
+    if chunk:
+        flush()
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Send a CSV or XLSX bank statement with 'date', 'amount' and 'description' columns:"
+    )
+    return IMPORT_FILE
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    name = (document.file_name or "").lower()
+    if name.endswith(".xlsx"):
+        kind = "xlsx"
+    elif name.endswith(".csv"):
+        kind = "csv"
+    else:
+        await update.message.reply_text("❌ Only .csv and .xlsx files are supported.")
+        return IMPORT_FILE
+
+    await update.message.reply_text("⏳ Importing...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"statement.{kind}")
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(path)
+        try:
+            stats = await repo.run_blocking(
+                import_file, path, kind, update.effective_chat.id, update.effective_user.username
+            )
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return IMPORT_FILE
+
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else stats["rows"]
+    msg = (
+        f"✅ Imported {stats['inserted']} of {stats['rows']} rows ({rate:.0f} rows/sec)\n"
+        f"Already imported: {stats['duplicates']}\n"
+        f"Rejected: {len(stats['rejected'])}\n"
+    )
+    for reason in stats["rejected"][:10]:
+        msg += f"- {reason}\n"
+    if len(stats["rejected"]) > 10:
+        msg += f"... and {len(stats['rejected']) - 10} more\n"
+
+    await reply(update.message, msg)
+    return ConversationHandler.END
+
+
+async def import_expect_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Please send the statement as a file, or /cancel.")
+    return IMPORT_FILE
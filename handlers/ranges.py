@@ -0,0 +1,151 @@
+import datetime
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+import repository as repo
+import isoweeks
+from replies import reply
+
+# Weeks shown per message, longer ranges get prev/next buttons
+PAGE_SIZE = 13
+# Refuse ranges longer than ~3 years
+MAX_WEEKS = 160
+
+
+def parse_range(args):
+    # "2025-30..2025-42", "month [YYYY-MM]" or "quarter [YYYY-Qn]" → list of
+    # year-weeks. None when the args are not a range (plain single week).
+    if not args:
+        return None
+    today = datetime.date.today()
+    head = args[0].lower()
+
+    if head == "month":
+        if len(args) > 1:
+            year, month = (int(x) for x in args[1].split("-"))
+        else:
+            year, month = today.year, today.month
+        weeks = [w.key for _, _, w in isoweeks.month_weeks(year, month)]
+    elif head == "quarter":
+        if len(args) > 1:
+            year, quarter = args[1].upper().split("-")
+            year, quarter = int(year), int(quarter.lstrip("Q"))
+        else:
+            year, quarter = today.year, (today.month - 1) // 3 + 1
+        if not 1 <= quarter <= 4:
+            raise ValueError("quarter out of range")
+        first = isoweeks.month_weeks(year, 3 * quarter - 2)[0][2]
+        last = isoweeks.month_weeks(year, 3 * quarter)[-1][2]
+        weeks = [w.key for w in isoweeks.between(first, last)]
+    elif ".." in head:
+        first, last = head.split("..")
+        weeks = [w.key for w in isoweeks.between(isoweeks.parse(first), isoweeks.parse(last))]
+    else:
+        return None
+
+    if not weeks or len(weeks) > MAX_WEEKS:
+        raise ValueError("empty or too long range")
+    return weeks
+
+
+def _keyboard(kind, weeks, page):
+    pages = (len(weeks) - 1) // PAGE_SIZE + 1
+    span = f"{weeks[0]}..{weeks[-1]}"
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"range:{kind}:{span}:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"range:{kind}:{span}:{page + 1}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")])
+    return InlineKeyboardMarkup(rows)
+
+
+def _title(icon, name, weeks, page):
+    pages = (len(weeks) - 1) // PAGE_SIZE + 1
+    msg = f"{icon} {name} for {weeks[0]}..{weeks[-1]}"
+    if pages > 1:
+        msg += f" (page {page + 1}/{pages})"
+    return msg + "\n\n"
+
+
+async def _weekstats_page(tenant, weeks, page):
+    page_weeks = weeks[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+    summary = await repo.weeks_summary(tenant, page_weeks)
+
+    msg = _title("📊", "Stats", weeks, page)
+    msg += "```\n"
+    msg += f"{'week':<8}{'income':>10}{'expense':>10}{'net':>10}{'exp.net':>10}\n"
+    real_incomes, real_expenses, est_incomes, est_expenses = {}, {}, {}, {}
+    for yw in page_weeks:
+        totals = summary["weeks"].get(yw) or {}
+        est = summary["estimates"].get(yw) or {}
+        income, expense = totals.get("income", 0), totals.get("expense", 0)
+        expected = sum(est.get("expected_incomes", {}).values()) + sum(est.get("expected_expenses", {}).values())
+        msg += f"{yw:<8}{income:>10.2f}{expense:>10.2f}{income + expense:>10.2f}{expected:>10.2f}\n"
+
+        for target, source in (
+            (real_incomes, totals.get("incomes", {})),
+            (real_expenses, totals.get("expenses", {})),
+            (est_incomes, est.get("expected_incomes", {})),
+            (est_expenses, est.get("expected_expenses", {})),
+        ):
+            for cat, amount in source.items():
+                target[cat] = target.get(cat, 0) + amount
+    msg += "```\n"
+
+    for label, real, est in (("💰 Incomes", real_incomes, est_incomes), ("💸 Expenses", real_expenses, est_expenses)):
+        msg += f"{label}:\n"
+        cats = sorted(set(real) | set(est))
+        for cat in cats:
+            e, r = est.get(cat, 0), real.get(cat, 0)
+            msg += f"- {cat}: expected {e:.2f}, real {r:.2f}, diff {r - e:.2f}\n"
+        if not cats:
+            msg += "None\n"
+        msg += "\n"
+
+    real_net = sum(real_incomes.values()) + sum(real_expenses.values())
+    est_net = sum(est_incomes.values()) + sum(est_expenses.values())
+    msg += f"📌 Net: expected {est_net:.2f}, real {real_net:.2f}, diff {real_net - est_net:.2f}\n"
+    return msg
+
+
+async def _showrecords_page(tenant, weeks, page):
+    page_weeks = weeks[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+    rows = await repo.records_by_week_category(tenant, page_weeks)
+
+    msg = _title("📒", "Records", weeks, page)
+    for yw in page_weeks:
+        week = rows.get(yw)
+        if not week:
+            continue
+        net = sum(week["categories"].values())
+        msg += f"{yw} ({week['count']} records, net {net:.2f}):\n"
+        for cat, total in sorted(week["categories"].items()):
+            msg += f"  {cat}: {total:.2f}\n"
+        msg += "\n"
+    if not any(yw in rows for yw in page_weeks):
+        msg += "No records in these weeks\n"
+    return msg
+
+
+RENDERERS = {
+    "ws": _weekstats_page,
+    "sr": _showrecords_page,
+}
+
+
+async def send_range(update: Update, kind, weeks):
+    text = await RENDERERS[kind](update.effective_chat.id, weeks, 0)
+    await reply(update.message, text, reply_markup=_keyboard(kind, weeks, 0), parse_mode="Markdown")
+
+
+async def range_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # callback_data: range:<kind>:<first>..<last>:<page>
+    query = update.callback_query
+    _, kind, span, page = query.data.split(":")
+    first, last = span.split("..")
+    weeks = [w.key for w in isoweeks.between(isoweeks.parse(first), isoweeks.parse(last))]
+    page = int(page)
+
+    text = await RENDERERS[kind](update.effective_chat.id, weeks, page)
+    await query.edit_message_text(text, reply_markup=_keyboard(kind, weeks, page), parse_mode="Markdown")
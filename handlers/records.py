@@ -3,9 +3,11 @@ from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
     ConversationHandler, ContextTypes
 )
-from config import db
+import repository as repo
 import datetime
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from replies import reply
+import isoweeks
+from handlers.ranges import parse_range, send_range
 
 # States
 ADD_AMOUNT, ADD_CATEGORY, ADD_WEEK = range(3)
@@ -13,7 +15,95 @@ ADD_AMOUNT, ADD_CATEGORY, ADD_WEEK = range(3)
 
 CATEGORIES = ["salary", "bonus", "tips", "groceries", "rent", "travel", "party", "supplies", "subscriptions", "other" ]
 
+def check_sign(amount, category):
+    # Returns why the amount/category pair is not allowed, or None if it is
+    if amount < 0 and category == "salary":
+        return "Salary cannot be negative"
+    if amount < 0 and category != "salary":
+        # normal expense → allowed
+        return None
+    if amount >= 0 and category == "salary":
+        # income → allowed
+        return None
+    return "Invalid combination of amount and category"
+
+def parse_quick_add(text):
+    # One record per line: "<signed amount> <category> [week]", e.g.
+    # "-12.5 groceries" or "+2000 salary 2025-41". The week may be bracketed
+    # and defaults to the current one. Returns (records, errors) where records
+    # are (amount, category, week) tuples.
+    parsed, errors = [], []
+    for line_no, line in enumerate(text.strip().splitlines(), start=1):
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            if len(parts) not in (2, 3):
+                raise ValueError("expected '<amount> <category> [week]'")
+            amount = float(parts[0])
+            category = parts[1].lower()
+            if category not in CATEGORIES:
+                raise ValueError(f"unknown category '{category}'")
+            error = check_sign(amount, category)
+            if error:
+                raise ValueError(error)
+            week = isoweeks.parse_or_current(parts[2].strip("[]")) if len(parts) == 3 else isoweeks.current()
+        except ValueError as e:
+            errors.append(f"line {line_no}: {e}")
+            continue
+        parsed.append((amount, category, week))
+    return parsed, errors
+
+
+# New messages only: an edited message has no update.message, and an edit
+# must not add its lines a second time under the same ids
+QUICK_ADD_FILTER = filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND & filters.Regex(r"^\s*[+-]\d")
+
+
+async def quick_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Fast path: every line of one message becomes a record, one insert_many for all
+    text = update.message.text
+    if context.args:  # "/add ..." rather than a plain message
+        text = text.split(maxsplit=1)[1]
+    parsed, errors = parse_quick_add(text)
+    if errors or not parsed:
+        await reply(update.message, "❌ Nothing added:\n" + "\n".join(errors or ["empty message"])
+                    + "\n\nFormat: one '-12.5 groceries' or '+2000 salary 2025-41' per line.")
+        return
+
+    tenant = update.effective_chat.id
+    now = datetime.datetime.utcnow()
+    entries = [
+        {
+            # keyed by message and line, a redelivered message adds nothing
+            "_id": f"msg:{tenant}:{update.message.message_id}:{i}",
+            "tenant": tenant,
+            "user": update.effective_user.username,
+            "amount": amount,
+            "category": category,
+            "date": now,
+            "year": week.year,
+            "week": week.week,
+        }
+        for i, (amount, category, week) in enumerate(parsed)
+    ]
+    inserted = await repo.insert_records(entries)
+    if not inserted:
+        await reply(update.message, "ℹ️ These records were already added.")
+        return
+
+    msg = f"✅ Added {inserted} record{'s' if inserted != 1 else ''}:\n"
+    for amount, category, week in parsed:
+        msg += f"{amount} ({category}) for week {week.key}\n"
+    msg += f"Net: {sum(amount for amount, _, _ in parsed)}"
+    await reply(update.message, msg)
+
+
 async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        # "/add -12.5 groceries" skips the conversation
+        await quick_add(update, context)
+        return ConversationHandler.END
     await update.message.reply_text("Enter amount (use negative for expense, positive for income):")
     return ADD_AMOUNT
 
@@ -46,96 +136,85 @@ async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ADD_CATEGORY
 
     # ✅ Business rule check
-    if amount < 0 and category == "salary":
-        await update.message.reply_text("❌ Salary cannot be negative. Canceled.")
+    error = check_sign(amount, category)
+    if error:
+        await update.message.reply_text(f"❌ {error}. Canceled.")
         context.user_data.clear()
         return ConversationHandler.END
 
-    if amount < 0 and category != "salary":
-        # normal expense → allowed
-        context.user_data["category"] = category
-    elif amount >= 0 and category == "salary":
-        # income → allowed
-        context.user_data["category"] = category
-    else:
-        await update.message.reply_text("❌ Invalid combination of amount and category. Canceled.")
-        context.user_data.clear()
-        return ConversationHandler.END
+    context.user_data["category"] = category
 
     await update.message.reply_text("Use 'current' week or enter year-week (e.g. 2025-39):")
     return ADD_WEEK
 
 
 async def add_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text.lower().startswith("current"):
-        today = datetime.date.today()
-        year, week, _ = today.isocalendar()
-    else:
-        try:
-            year, week = text.split("-")
-            year, week = int(year), int(week)
-        except Exception:
-            await update.message.reply_text("Invalid format. Use 'current' or 'YYYY-WW'.")
-            return ADD_WEEK
+    try:
+        week = isoweeks.parse_or_current(update.message.text)
+    except ValueError:
+        await update.message.reply_text("Invalid format. Use 'current' or 'YYYY-WW'.")
+        return ADD_WEEK
 
     entry = {
+        # keyed by the message that completed the record, a redelivered message adds nothing
+        "_id": f"msg:{update.effective_chat.id}:{update.message.message_id}",
+        "tenant": update.effective_chat.id,
         "user": update.effective_user.username,
         "amount": context.user_data["amount"],
         "category": context.user_data["category"],
         "date": datetime.datetime.utcnow(),
-        "year": year,
-        "week": week,
+        "year": week.year,
+        "week": week.week,
     }
-    db.records.insert_one(entry)
+    if not await repo.insert_record(entry):
+        await reply(update.message, "ℹ️ This record was already added.")
+        context.user_data.clear()
+        return ConversationHandler.END
 
-    await update.message.reply_text(f"✅ Added {entry['amount']} ({entry['category']}) for week {year}-{week:02d}")
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, f"✅ Added {entry['amount']} ({entry['category']}) for week {week.key}")
     context.user_data.clear()
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("❌ Canceled.")
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, "❌ Canceled.")
     context.user_data.clear()
     return ConversationHandler.END
 
 async def showrecords(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        year_week = context.args[0]  # e.g. "2025-39"
-        year, week = year_week.split("-")
-        year, week = int(year), int(week)
+        weeks = parse_range(context.args)  # e.g. "2025-30..2025-42", "month", "quarter"
+        if weeks is None:
+            week = isoweeks.parse(context.args[0])  # e.g. "2025-39", "2025-9"
     except (IndexError, ValueError):
-        await update.message.reply_text("Usage: /showrecords <year-week>")
+        await update.message.reply_text("Usage: /showrecords <year-week> | <from>..<to> | month [YYYY-MM] | quarter [YYYY-Qn]")
+        return
+
+    if weeks is not None:
+        await send_range(update, "sr", weeks)
         return
 
-    records = list(db.records.find({"year": year, "week": week}))
-    if not records:
-        await update.message.reply_text(f"No records found for {year_week}")
+    tenant = update.effective_chat.id
+    totals = await repo.get_week_totals(tenant, week.key)
+    if not totals or not totals.get("count"):
+        await update.message.reply_text(f"No records found for {week.key}")
         return
 
-    # Group by day + category
-    days = {}
-    for r in records:
-        d = r["date"].strftime("%d.%m")
-        cat = r["category"]
-        amt = r["amount"]
-        days.setdefault(d, {}).setdefault(cat, 0)
-        days[d][cat] += amt
+    # Summed per day + category by the server
+    rows = await repo.records_by_day_category(tenant, week.year, week.week)
 
     # Build message
-    msg = f"📒 Records for {year_week}:\n\n"
-    for day, cats in sorted(days.items()):
-        msg += f"{day}:\n"
-        for cat, total in cats.items():
-            msg += f"  {cat}: {total}\n"
-        msg += "\n"
-
-    await update.message.reply_text(msg)
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
\ No newline at end of file
+    msg = f"📒 Records for {week.key}:\n\n"
+    day = None
+    for row in rows:
+        if row["day"] != day:
+            if day is not None:
+                msg += "\n"
+            day = row["day"]
+            msg += f"{day.strftime('%d.%m')}:\n"
+        msg += f"  {row['category']}: {row['income'] + row['expense']}\n"
+    msg += "\n"
+
+    income, expense = totals.get("income", 0), totals.get("expense", 0)
+    msg += f"Total: income {income}, expense {expense}, net {income + expense} ({totals['count']} records)\n"
+
+    await reply(update.message, msg)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import datetime
+import secrets
+from telegram import Update
+from telegram.ext import ContextTypes
+import recurring
+import repository as repo
+from replies import reply
+from handlers.records import CATEGORIES, check_sign
+
+USAGE = (
+    "Usage:\n"
+    "/recurring - list rules\n"
+    "/recurring add <amount> <category> weekly|monthly [YYYY-MM-DD]\n"
+    "/recurring del <id>"
+)
+
+
+async def recurring_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    if not args:
+        await list_rules(update)
+    elif args[0] == "add":
+        await add_rule(update, args[1:])
+    elif args[0] == "del" and len(args) == 2:
+        tenant = update.effective_chat.id
+        if await repo.delete_rule(tenant, f"{tenant}:{args[1]}"):
+            await reply(update.message, f"🗑 Rule {args[1]} deleted. Records it already added stay.")
+        else:
+            await update.message.reply_text(f"No rule {args[1]}")
+    else:
+        await update.message.reply_text(USAGE)
+
+
+async def list_rules(update: Update):
+    rules = await repo.list_rules(update.effective_chat.id)
+    if not rules:
+        await reply(update.message, "No recurring rules yet.\n\n" + USAGE)
+        return
+    msg = "🔁 Recurring rules:\n\n"
+    for rule in rules:
+        short_id = rule["_id"].split(":", 1)[1]
+        msg += (f"{short_id}: {rule['amount']} {rule['category']} {rule['cadence']}, "
+                f"next on {rule['next_due']:%Y-%m-%d}\n")
+    await reply(update.message, msg)
+
+
+async def add_rule(update: Update, args):
+    try:
+        amount, category, cadence = float(args[0]), args[1].lower(), args[2].lower()
+        start = datetime.date.fromisoformat(args[3]) if len(args) > 3 else datetime.date.today()
+        if category not in CATEGORIES or cadence not in recurring.CADENCES:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(USAGE)
+        return
+    error = check_sign(amount, category)
+    if error:
+        await update.message.reply_text(f"❌ {error}.")
+        return
+
+    tenant = update.effective_chat.id
+    short_id = secrets.token_hex(3)
+    start = datetime.datetime.combine(start, datetime.time())
+    await repo.add_rule({
+        "_id": f"{tenant}:{short_id}",
+        "tenant": tenant,
+        "amount": amount,
+        "category": category,
+        "cadence": cadence,
+        "start": start,
+        "next_due": start,
+    })
+    # a rule starting today (or earlier) shows up in the records right away
+    added = await repo.run_blocking(recurring.materialise)
+
+    msg = f"✅ Rule {short_id}: {amount} {category} {cadence} from {start:%Y-%m-%d}"
+    if added:
+        msg += f"\nAdded {added} due record{'s' if added != 1 else ''}."
+    await reply(update.message, msg)
+
+
+async def materialise_job(context: ContextTypes.DEFAULT_TYPE):
+    # run by telegram_app.job_queue, see bot.on_startup
+    await repo.run_blocking(recurring.materialise)
@@ -1,16 +1,13 @@
-from config import db
-from telegram import Update
-from telegram.ext import ContextTypes
+import repository as repo
 import datetime
-import calendar
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import (
     ContextTypes, ConversationHandler,
     CommandHandler, MessageHandler, filters
 )
-import datetime
-from config import db
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from replies import reply
+import isoweeks
+from handlers.ranges import MAX_WEEKS, parse_range, send_range
 
 # states
 WEEK, TYPE, CATEGORY, AMOUNT, CONTINUE = range(5)
@@ -20,27 +17,92 @@ EXPENSE_CATEGORIES = [ "groceries", "rent", "travel", "party", "supplies", "subs
 
 
 
+def parse_estimates(text):
+    # "salary 2000, groceries -150" or one "<category> <amount>" per line,
+    # "=" works as separator too. Returns ({field: amount}, errors).
+    fields, errors = {}, []
+    for item in text.replace(",", "\n").splitlines():
+        parts = item.replace("=", " ").split()
+        if not parts:
+            continue
+        try:
+            if len(parts) != 2:
+                raise ValueError(f"expected '<category> <amount>', got '{item.strip()}'")
+            category, amount = parts[0].lower(), float(parts[1])
+            if category in INCOME_CATEGORIES:
+                if amount < 0:
+                    raise ValueError(f"{category}: income cannot be negative")
+                est_type = "income"
+            elif category in EXPENSE_CATEGORIES:
+                if amount > 0:
+                    raise ValueError(f"{category}: expense must be negative")
+                est_type = "expense"
+            else:
+                raise ValueError(f"unknown category '{category}'")
+        except ValueError as e:
+            errors.append(str(e))
+            continue
+        fields[f"expected_{est_type}s.{category}"] = amount
+    return fields, errors
+
+
+async def setweekly_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /setweekly <week> salary 2000, groceries -150 (or one category per line)
+    try:
+        week = isoweeks.parse_or_current(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid week. Use 'current' or 'YYYY-WW'.")
+        return
+    payload = update.message.text.split(maxsplit=2)
+    fields, errors = parse_estimates(payload[2] if len(payload) > 2 else "")
+    if errors or not fields:
+        await reply(update.message, "❌ Nothing saved:\n" + "\n".join(errors or ["no categories given"])
+                    + "\n\nFormat: /setweekly 2025-41 salary 2000, groceries -150")
+        return
+
+    await repo.set_estimates(update.effective_chat.id, week.key, fields)
+
+    msg = f"✅ Estimates for {week.key}:\n"
+    for field, amount in fields.items():
+        msg += f"- {field.split('.', 1)[1]}: {amount}\n"
+    await reply(update.message, msg)
+
+
+async def copyweekly(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /copyweekly <src-week> <from>..<to>
+    try:
+        source = isoweeks.parse_or_current(context.args[0])
+        first, last = context.args[1].split("..")
+        targets = [w.key for w in isoweeks.between(isoweeks.parse(first), isoweeks.parse(last)) if w != source]
+        if not targets or len(targets) > MAX_WEEKS:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(f"Usage: /copyweekly <src-week> <from>..<to> (up to {MAX_WEEKS} weeks)")
+        return
+
+    if not await repo.copy_estimates(update.effective_chat.id, source.key, targets):
+        await update.message.reply_text(f"No estimates found for week {source.key}")
+        return
+
+    await reply(update.message, f"✅ Copied estimates of {source.key} to {len(targets)} weeks ({targets[0]}..{targets[-1]})")
+
+
 async def setweekly_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        # whole plan in one message, no conversation needed
+        await setweekly_bulk(update, context)
+        return ConversationHandler.END
     await update.message.reply_text(
         "Use 'current' week or enter year-week (e.g. 2025-39):"
     )
     return WEEK
 
 async def setweekly_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip().lower()
-
-    if text == "current":
-        today = datetime.date.today()
-        year, week, _ = today.isocalendar()
-        context.user_data["year_week"] = f"{year}-{week:02d}"
-    else:
-        try:
-            year, week = text.split("-")
-            year, week = int(year), int(week)
-            context.user_data["year_week"] = f"{year}-{week:02d}"
-        except Exception:
-            await update.message.reply_text("❌ Invalid format. Use 'current' or 'YYYY-WW'.")
-            return WEEK
+    try:
+        context.user_data["year_week"] = isoweeks.parse_or_current(update.message.text).key
+    except ValueError:
+        await update.message.reply_text("❌ Invalid format. Use 'current' or 'YYYY-WW'.")
+        return WEEK
 
     # ask income/expense
     keyboard = [["income"], ["expense"]]
@@ -102,11 +164,7 @@ async def setweekly_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # save in DB
     year_week = context.user_data["year_week"]
     field = f"expected_{est_type}s.{context.user_data['category']}"
-    db.week_estimates.update_one(
-        {"_id": year_week, "year_week": year_week},
-        {"$set": {field: amount}},
-        upsert=True
-    )
+    await repo.set_estimate(update.effective_chat.id, year_week, field, amount)
 
     await update.message.reply_text(
         f"✅ Set {est_type} estimate for {context.user_data['category']} = {amount} in {year_week}\nAdd more or finish?",
@@ -130,18 +188,18 @@ async def setweekly_continue(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("❌ Canceled.")
+    await reply(update.message, "❌ Canceled.")
     context.user_data.clear()
     return ConversationHandler.END
 
 async def showweekly(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        year_week = context.args[0]
-    except IndexError:
+        year_week = isoweeks.parse(context.args[0]).key
+    except (IndexError, ValueError):
         await update.message.reply_text("Usage: /showweekly <year-week>")
         return
 
-    doc = db.week_estimates.find_one({"_id": year_week})
+    doc = await repo.get_estimate(update.effective_chat.id, year_week)
     if not doc:
         await update.message.reply_text(f"No estimates found for week {year_week}")
         return
@@ -157,77 +215,47 @@ async def showweekly(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for k, v in expenses.items():
         msg += f"- {k}: {v}\n"
 
-    await update.message.reply_text(msg)
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, msg)
 
 async def currentweek(update: Update, context: ContextTypes.DEFAULT_TYPE):
     today = datetime.date.today()
-    year, week_num, _ = today.isocalendar()
-    await update.message.reply_text(f"Current week is {year}-{week_num:02d}")
 
-    # Current month
-    month = today.month
-    cal = calendar.Calendar(firstweekday=0)  # Monday = 0
-    
-    # Collect weekly ranges
-    weeks = []
-    month_days = [d for d in cal.itermonthdates(year, month) if d.month == month]
-    
-    start = None
-    for d in month_days:
-        if start is None:
-            start = d
-        if d.weekday() == 6:  # Sunday closes the week
-            end = d
-            w_year, w_num, _ = d.isocalendar()
-            weeks.append((start, end, f"{w_year}-{w_num:02d}"))
-            start = None
-    
-    # If last week spills over into next month
-    if start is not None:
-        last_day = month_days[-1]
-        w_year, w_num, _ = last_day.isocalendar()
-        weeks.append((start, last_day, f"{w_year}-{w_num:02d}"))
+    # Weekly ranges of the current month
+    weeks = isoweeks.month_weeks(today.year, today.month)
     
     # Format output
-    msg = f"Current week is {year}-{week_num:02d}\n\n"
-    for start, end, wn in weeks:
-        msg += f"{start.day:02d}.{start.month:02d} - {end.day:02d}.{end.month:02d}    {wn}\n"
+    msg = f"Current week is {isoweeks.of(today).key}\n\n"
+    for start, end, w in weeks:
+        msg += f"{start.day:02d}.{start.month:02d} - {end.day:02d}.{end.month:02d}    {w.key}\n"
     
-    await update.message.reply_text(msg)
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, msg)
 
 async def weekstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        year_week = context.args[0]  # e.g. "2025-39"
-        year, week = year_week.split("-")
-        year, week = int(year), int(week)
+        weeks = parse_range(context.args)  # e.g. "2025-30..2025-42", "month", "quarter"
+        if weeks is None:
+            week = isoweeks.parse(context.args[0])  # e.g. "2025-39", "2025-9"
     except (IndexError, ValueError):
-        await update.message.reply_text("Usage: /weekstats <year-week>")
+        await update.message.reply_text("Usage: /weekstats <year-week> | <from>..<to> | month [YYYY-MM] | quarter [YYYY-Qn]")
+        return
+
+    if weeks is not None:
+        await send_range(update, "ws", weeks)
         return
 
     # --- Fetch expected ---
-    est_doc = db.week_estimates.find_one({"_id": year_week})
+    tenant = update.effective_chat.id
+    est_doc = await repo.get_estimate(tenant, week.key)
     est_incomes = est_doc.get("expected_incomes", {}) if est_doc else {}
     est_expenses = est_doc.get("expected_expenses", {}) if est_doc else {}
 
-    # --- Fetch real ---
-    records = list(db.records.find({"year": year, "week": week}))
-    real_incomes, real_expenses = {}, {}
-    for r in records:
-        cat = r["category"]
-        amt = r["amount"]
-        if amt >= 0:
-            real_incomes[cat] = real_incomes.get(cat, 0) + amt
-        else:
-            real_expenses[cat] = real_expenses.get(cat, 0) + amt  # keep negative
+    # --- Fetch real (pre-summed per category in week_totals) ---
+    totals = await repo.get_week_totals(tenant, week.key)
+    real_incomes = totals.get("incomes", {}) if totals else {}
+    real_expenses = totals.get("expenses", {}) if totals else {}  # keep negative
 
     # --- Build report ---
-    msg = f"📊 Stats for {year_week}\n\n"
+    msg = f"📊 Stats for {week.key}\n\n"
 
     msg += "💰 Incomes:\n"
     cats = set(est_incomes) | set(real_incomes)
@@ -264,8 +292,5 @@ async def weekstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg += f"Expense: expected {total_est_expense}, real {total_real_expense}, diff {total_real_expense - total_est_expense}\n"
     msg += f"Balance difference (real - expected): {balance_diff}\n"
 
-    await update.message.reply_text(msg)
-    keyboard = [[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("⬇️ What next?", reply_markup=reply_markup)
+    await reply(update.message, msg)
 
@@ -0,0 +1,100 @@
+import datetime
+import functools
+from typing import NamedTuple
+from config import WEEKS_FIRST_YEAR, WEEKS_LAST_YEAR
+
+# ISO-week calendar shared by all handlers. The table covers every week of
+# WEEKS_FIRST_YEAR..WEEKS_LAST_YEAR and is built once on first use, after that
+# lookups by key, (year, week), date or month are dict/list indexing.
+
+
+class Week(NamedTuple):
+    year: int
+    week: int
+    key: str                 # normalized "YYYY-WW", as stored in week_estimates/week_totals ids
+    start: datetime.date     # Monday
+    end: datetime.date       # Sunday
+    months: tuple            # (year, month) pairs the week has days in
+    index: int               # position in the table, consecutive weeks differ by 1
+
+
+def key(year, week):
+    return f"{year}-{week:02d}"
+
+
+class _Table:
+    def __init__(self, first_year, last_year):
+        self.weeks = []
+        self.by_week = {}
+        self.by_month = {}
+        day = datetime.date.fromisocalendar(first_year, 1, 1)
+        end = datetime.date.fromisocalendar(last_year + 1, 1, 1)
+        while day < end:
+            year, week, _ = day.isocalendar()
+            sunday = day + datetime.timedelta(days=6)
+            months = tuple(sorted({(day.year, day.month), (sunday.year, sunday.month)}))
+            w = Week(year, week, key(year, week), day, sunday, months, len(self.weeks))
+            self.weeks.append(w)
+            self.by_week[(year, week)] = w
+            for m in months:
+                self.by_month.setdefault(m, []).append(w)
+            day += datetime.timedelta(weeks=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _table():
+    return _Table(WEEKS_FIRST_YEAR, WEEKS_LAST_YEAR)
+
+
+def get(year, week):
+    # ValueError for weeks that don't exist (2025-53) or are outside the table
+    w = _table().by_week.get((year, week))
+    if w is None:
+        raise ValueError(f"no such week: {year}-{week}")
+    return w
+
+
+@functools.lru_cache(maxsize=4096)
+def parse(text):
+    # "2025-9", "2025-09" and "2025-W09" all give the week keyed "2025-09"
+    year, week = text.strip().upper().split("-")
+    return get(int(year), int(week.lstrip("W")))
+
+
+def of(date):
+    year, week, _ = date.isocalendar()
+    return get(year, week)
+
+
+def current():
+    return of(datetime.date.today())
+
+
+def parse_or_current(text):
+    # week answers in conversations: 'current' or a year-week
+    text = text.strip()
+    return current() if text.lower().startswith("current") else parse(text)
+
+
+def shift(w, weeks):
+    index = w.index + weeks
+    table = _table().weeks
+    if not 0 <= index < len(table):
+        raise ValueError("week outside the calendar table")
+    return table[index]
+
+
+def between(first, last):
+    # inclusive list of weeks, empty when last is before first
+    return _table().weeks[first.index:last.index + 1]
+
+
+def month_weeks(year, month):
+    # (first day, last day, week) for every week touching the month,
+    # clipped to the month's days
+    weeks = _table().by_month.get((year, month))
+    if weeks is None:
+        raise ValueError(f"no such month: {year}-{month}")
+    first = datetime.date(year, month, 1)
+    last = (first + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+    return [(max(w.start, first), min(w.end, last), w) for w in weeks]
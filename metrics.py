@@ -0,0 +1,138 @@
+import functools
+import logging
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+from telegram import Update
+from telegram.ext import ConversationHandler, TypeHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_latency_seconds", "Time spent in a Telegram handler callback", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Handler callbacks that raised", ["handler"]
+)
+MONGO_LATENCY = Histogram(
+    "bot_mongo_command_seconds", "Mongo command duration", ["collection", "command"]
+)
+MONGO_ERRORS = Counter(
+    "bot_mongo_command_errors_total", "Failed Mongo commands", ["collection", "command"]
+)
+TELEGRAM_LATENCY = Histogram(
+    "bot_telegram_api_seconds", "Bot API call duration", ["method"]
+)
+TELEGRAM_ERRORS = Counter(
+    "bot_telegram_api_errors_total", "Bot API calls that failed or returned non-200", ["method"]
+)
+WEBHOOK_UPDATES = Counter(
+    "bot_webhook_updates_total", "Updates received on /webhook by outcome", ["result"]
+)
+UPDATE_LATENCY = Histogram(
+    "bot_update_latency_seconds", "Time from webhook acceptance until the update is handled"
+)
+UPDATE_ERRORS = Counter(
+    "bot_update_errors_total", "Updates whose processing raised"
+)
+QUEUE_DEPTH = Gauge(
+    "bot_webhook_queue_depth", "Updates waiting for a dispatcher worker"
+)
+CACHE_REQUESTS = Counter(
+    "bot_cache_requests", "Cache lookups by cache and result", ["cache", "result"]
+)
+
+
+def timed(callback, name=None):
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for child in handler.entry_points + handler.fallbacks:
+            _instrument_handler(child)
+        for handlers in handler.states.values():
+            for child in handlers:
+                _instrument_handler(child)
+    elif not getattr(handler.callback, "instrumented", False):
+        handler.callback = timed(handler.callback)
+
+
+def instrument(application):
+    # Times every handler callback (conversation steps included). Wrapping
+    # happens in the update path, from a group -1 handler that runs before all
+    # others, so handlers added at any time are timed from their first update.
+    async def instrument_handlers(update, context):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                _instrument_handler(handler)
+
+    instrument_handlers.instrumented = True
+    application.add_handler(TypeHandler(Update, instrument_handlers), group=-1)
+    application.add_error_handler(count_error)
+
+
+async def count_error(update, context):
+    # PTB catches handler exceptions and passes them to the error handlers
+    UPDATE_ERRORS.inc()
+    logger.error("Failed to handle update %s", getattr(update, "update_id", None), exc_info=context.error)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # Times every command the driver sends, labelled by collection
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self._started[(event.connection_id, event.request_id)] = (time.perf_counter(), collection)
+
+    def _finish(self, event, failed):
+        started, collection = self._started.pop((event.connection_id, event.request_id), (None, ""))
+        if started is None:
+            return
+        MONGO_LATENCY.labels(collection, event.command_name).observe(time.perf_counter() - started)
+        if failed:
+            MONGO_ERRORS.labels(collection, event.command_name).inc()
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # HTTPXRequest that records Bot API latency per method (sendMessage, ...)
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.labels(api_method).inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(api_method).observe(time.perf_counter() - started)
+        if code != 200:
+            TELEGRAM_ERRORS.labels(api_method).inc()
+        return code, payload
@@ -0,0 +1,190 @@
+import datetime
+import logging
+import time
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+import config
+from config import connect
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Indexes every deployment needs. create_index is a no-op when the index
+# already exists with the same spec and a changed TTL is applied with collMod
+# (see ensure_index), so this is safe to run on every startup.
+# An entry is either a key list or a (key list, create_index options) pair.
+INDEXES = {
+    "records": [
+        [("tenant", ASCENDING), ("year", ASCENDING), ("week", ASCENDING)],
+        [("tenant", ASCENDING), ("user", ASCENDING), ("year", ASCENDING), ("week", ASCENDING)],
+        [("tenant", ASCENDING), ("date", ASCENDING)],
+        # budget alerts poll new records by insertion time without change streams
+        [("created_at", ASCENDING)],
+    ],
+    # old weeks moved out of records by archive.py, read back per week and for exports
+    "records_archive": [
+        [("tenant", ASCENDING), ("year", ASCENDING), ("week", ASCENDING), ("date", ASCENDING)],
+    ],
+    "week_estimates": [
+        [("tenant", ASCENDING), ("year_week", ASCENDING)],
+    ],
+    "week_totals": [
+        [("tenant", ASCENDING), ("year", ASCENDING), ("week", ASCENDING)],
+    ],
+    "recurring": [
+        [("tenant", ASCENDING)],
+        [("next_due", ASCENDING)],
+    ],
+}
+
+# TTL indexes, expiring after the named setting (seconds)
+TTL_INDEXES = {
+    "processed_updates": ([("created_at", ASCENDING)], "PROCESSED_UPDATES_TTL"),
+}
+
+# seconds between checks while another worker runs a migration
+CLAIM_POLL_INTERVAL = 1
+
+# Versioned schema changes, filled by the @migration decorator below.
+# Each one is called with the database and the settings bootstrap got, and
+# must be safe to run again: a worker that dies halfway leaves it to the next.
+MIGRATIONS = {}
+
+
+def migration(version):
+    def register(fn):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = fn
+        return fn
+    return register
+
+
+@migration(1)
+def backfill_week_totals(db, settings):
+    rollups.rebuild()
+
+
+@migration(2)
+def move_global_data_to_default_tenant(db, settings):
+    # Before tenancy there was one global settings document and estimates
+    # keyed by year-week only. Everything moves to the DEFAULT_TENANT chat.
+    legacy = (
+        db.settings.find_one({"_id": "settings"})
+        or db.records.find_one({"tenant": {"$exists": False}})
+        or db.week_estimates.find_one({"tenant": {"$exists": False}})
+    )
+    if legacy:
+        if settings.DEFAULT_TENANT is None:
+            raise RuntimeError("Existing data has no tenant, set DEFAULT_TENANT to the chat id that owns it")
+        tenant = settings.DEFAULT_TENANT
+
+        db.records.update_many({"tenant": {"$exists": False}}, {"$set": {"tenant": tenant}})
+
+        old = db.settings.find_one({"_id": "settings"})
+        if old:
+            old.pop("_id")
+            db.settings.replace_one({"_id": tenant}, {**old, "tenant": tenant}, upsert=True)
+            db.settings.delete_one({"_id": "settings"})
+
+        for doc in db.week_estimates.find({"tenant": {"$exists": False}}):
+            year_week = doc.pop("_id")
+            doc.update(tenant=tenant, year_week=year_week)
+            db.week_estimates.replace_one({"_id": rollups.doc_id(tenant, year_week)}, doc, upsert=True)
+            db.week_estimates.delete_one({"_id": year_week})
+
+    # tenant-prefixed indexes replace these
+    existing = db.records.index_information()
+    for name in ("year_1_week_1", "user_1_year_1_week_1", "date_1"):
+        if name in existing:
+            db.records.drop_index(name)
+
+    rollups.rebuild()
+
+
+@migration(3)
+def mark_week_summaries_complete(db, settings):
+    # reads only use summaries flagged complete, the ones archived before the flag are
+    db.week_summaries.update_many({"complete": {"$exists": False}}, {"$set": {"complete": True}})
+
+
+def ensure_index(collection, keys, options):
+    # create_index refuses to change the TTL of an existing index
+    # (IndexOptionsConflict), collMod updates it in place instead
+    ttl = options.get("expireAfterSeconds")
+    if ttl is not None:
+        name = "_".join(f"{field}_{direction}" for field, direction in keys)
+        existing = collection.index_information().get(name)
+        if existing is not None and existing.get("expireAfterSeconds") != ttl:
+            logger.info("Changing TTL of %s.%s to %s seconds", collection.name, name, ttl)
+            collection.database.command("collMod", collection.name, index={"keyPattern": dict(keys), "expireAfterSeconds": ttl})
+            return
+    collection.create_index(keys, **options)
+
+
+def ensure_indexes(settings=config):
+    db = connect(settings)
+    for collection, specs in INDEXES.items():
+        for spec in specs:
+            keys, options = spec if isinstance(spec, tuple) else (spec, {})
+            ensure_index(db[collection], keys, options)
+    for collection, (keys, setting) in TTL_INDEXES.items():
+        ensure_index(db[collection], keys, {"expireAfterSeconds": getattr(settings, setting)})
+
+
+def _claim(db, version, fn, settings):
+    # True when this worker should run `version`: it claimed it, or took over
+    # a claim left "running" for longer than MIGRATION_LOCK_TIMEOUT by a
+    # worker that died. Waits while another worker runs it, False once done.
+    while True:
+        now = datetime.datetime.utcnow()
+        try:
+            db.migrations.insert_one({"_id": version, "name": fn.__name__, "state": "running", "started_at": now})
+            return True
+        except DuplicateKeyError:
+            pass
+        claim = db.migrations.find_one({"_id": version})
+        if claim is None:
+            continue  # released after a failure, claim it again
+        if claim["state"] == "done":
+            return False
+        started = claim.get("started_at") or datetime.datetime.min
+        if (now - started).total_seconds() >= settings.MIGRATION_LOCK_TIMEOUT:
+            # every migration is idempotent, so a half-applied one can run again
+            taken = db.migrations.update_one(
+                {"_id": version, "state": "running", "started_at": claim.get("started_at")},
+                {"$set": {"started_at": now}}
+            )
+            if taken.modified_count:
+                logger.warning("Migration %s (%s) was claimed at %s and never finished, running it again",
+                               version, fn.__name__, started)
+                return True
+            continue
+        logger.info("Waiting for another worker to finish migration %s (%s)", version, fn.__name__)
+        time.sleep(CLAIM_POLL_INTERVAL)
+
+
+def run_migrations(settings=config):
+    db = connect(settings)
+    for version in sorted(MIGRATIONS):
+        fn = MIGRATIONS[version]
+        # claim the version first so concurrent workers don't run it twice,
+        # and don't serve requests before it is applied
+        if not _claim(db, version, fn, settings):
+            continue
+
+        logger.info("Applying migration %s (%s)", version, fn.__name__)
+        try:
+            fn(db, settings)
+        except Exception:
+            db.migrations.delete_one({"_id": version})
+            raise
+        db.migrations.update_one(
+            {"_id": version},
+            {"$set": {"state": "done", "applied_at": datetime.datetime.utcnow()}}
+        )
+
+
+def bootstrap(settings=config):
+    ensure_indexes(settings)
+    run_migrations(settings)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import time
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+import repository as repo
+
+logger = logging.getLogger(__name__)
+
+
+class StoragePersistence(BasePersistence):
+    # Stores conversation states and user/chat data as `persistence` documents
+    # of the storage backend so they survive restarts and are shared between workers.
+    #
+    # Documents:
+    #   {"_id": "user:<id>", "data": {...}}
+    #   {"_id": "chat:<id>", "data": {...}}
+    #   {"_id": "conversation:<name>:<key json>", "name": ..., "key": [...], "state": ...}
+    #
+    # Writes are buffered and sent as one batch after `flush_delay`
+    # seconds, reads go through a small TTL cache that our own writes keep warm.
+    # Updates handled by UpdateDispatcher are written before the worker moves on
+    # (save_update_state), the chat's next update may reach another worker.
+    #
+    # load_update_state uses PTB internals that have no public counterpart:
+    # ConversationHandler._get_key and ConversationHandler._conversations
+    # (update_no_track, data). requirements.txt pins the version they were
+    # written against, check them before bumping it.
+
+    def __init__(self, update_interval=1, flush_delay=0.2, cache_ttl=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.flush_delay = flush_delay
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._pending = {}
+        self._flush_task = None
+
+    # --- cache / write-behind
+    def _cached(self, doc_id):
+        hit = self._cache.get(doc_id)
+        if hit and time.monotonic() - hit[0] < self.cache_ttl:
+            return hit
+        return None
+
+    def _remember(self, doc_id, doc):
+        self._cache[doc_id] = (time.monotonic(), doc)
+
+    def _write(self, doc_id, doc):
+        self._remember(doc_id, doc)
+        self._pending[doc_id] = doc
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._flush_pending()
+
+    async def _flush_pending(self):
+        if not self._pending:
+            return
+        docs, self._pending = self._pending, {}
+        try:
+            await repo.write_states(docs)
+        except Exception:
+            logger.exception("Failed to write %s persistence documents", len(docs))
+
+    async def _load(self, doc_ids):
+        missing = [doc_id for doc_id in doc_ids if not self._cached(doc_id)]
+        if missing:
+            found = {doc["_id"]: doc for doc in await repo.find_states(missing)}
+            for doc_id in missing:
+                # don't let a stale read overwrite a write that is still buffered
+                if doc_id not in self._pending:
+                    self._remember(doc_id, found.get(doc_id))
+        return {doc_id: self._cache[doc_id][1] for doc_id in doc_ids}
+
+    @staticmethod
+    def _conversation_id(name, key):
+        return f"conversation:{name}:{json.dumps(list(key))}"
+
+    # --- loaded once on Application.initialize
+    async def get_user_data(self):
+        docs = await repo.find_states_by_prefix("user:")
+        return {int(doc["_id"].split(":", 1)[1]): doc["data"] for doc in docs}
+
+    async def get_chat_data(self):
+        docs = await repo.find_states_by_prefix("chat:")
+        return {int(doc["_id"].split(":", 1)[1]): doc["data"] for doc in docs}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        docs = await repo.find_conversations(name)
+        return {tuple(doc["key"]): doc["state"] for doc in docs}
+
+    # --- called by Application.update_persistence
+    async def update_user_data(self, user_id, data):
+        self._write(f"user:{user_id}", {"data": data} if data else None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._write(f"chat:{chat_id}", {"data": data} if data else None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        doc = {"name": name, "key": list(key), "state": new_state} if new_state is not None else None
+        self._write(self._conversation_id(name, key), doc)
+
+    async def drop_user_data(self, user_id):
+        self._write(f"user:{user_id}", None)
+
+    async def drop_chat_data(self, chat_id):
+        self._write(f"chat:{chat_id}", None)
+
+    # --- called before every handler callback
+    async def refresh_user_data(self, user_id, user_data):
+        doc = (await self._load([f"user:{user_id}"]))[f"user:{user_id}"]
+        user_data.clear()
+        user_data.update(doc["data"] if doc else {})
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        doc = (await self._load([f"chat:{chat_id}"]))[f"chat:{chat_id}"]
+        chat_data.clear()
+        chat_data.update(doc["data"] if doc else {})
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._flush_pending()
+
+    async def save_update_state(self, application):
+        # store what the update changed now instead of after flush_delay
+        await application.update_persistence()
+        await self.flush()
+
+    async def load_update_state(self, application, update: Update):
+        # Another worker may have advanced this chat's conversations, pull the
+        # current state (and user data) in one query before dispatching.
+        handlers = [
+            h for group in application.handlers.values() for h in group
+            if isinstance(h, ConversationHandler) and h.persistent
+        ]
+        keys = {}
+        for handler in handlers:
+            try:
+                keys[handler] = self._conversation_id(handler.name, handler._get_key(update))
+            except RuntimeError:
+                continue
+
+        doc_ids = list(keys.values())
+        if update.effective_user:
+            doc_ids.append(f"user:{update.effective_user.id}")
+        for doc_id in doc_ids:
+            if doc_id not in self._pending:
+                self._cache.pop(doc_id, None)
+        docs = await self._load(doc_ids)
+
+        for handler, doc_id in keys.items():
+            doc = docs[doc_id]
+            key = tuple(doc["key"]) if doc else handler._get_key(update)
+            if doc:
+                handler._conversations.update_no_track({key: doc["state"]})
+            else:
+                handler._conversations.data.pop(key, None)
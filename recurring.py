@@ -0,0 +1,86 @@
+import calendar
+import datetime
+import isoweeks
+import repository as repo
+
+# Recurring rules, one document each:
+#   {"_id": "42:a1b2c3", "tenant": 42, "amount": -800.0, "category": "rent",
+#    "cadence": "monthly", "start": datetime(2025, 11, 1), "next_due": datetime(2025, 12, 1)}
+# Due occurrences become records with the id "rec:<rule id>:<YYYY-MM-DD>", so
+# materialising the same day twice (restarts, several workers) inserts nothing.
+
+CADENCES = ("weekly", "monthly")
+BATCH_SIZE = 500
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _monthly(start, months):
+    # the start's day of month, clipped to shorter months (31st → 30th/28th)
+    year, month = divmod(start.month - 1 + months, 12)
+    year, month = start.year + year, month + 1
+    return datetime.date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrences(rule, first, last):
+    # dates of `rule` within [first, last]
+    start = _as_date(rule["start"])
+    if rule["cadence"] == "weekly":
+        skip = max(0, (first - start).days // 7)
+        step = lambda n: start + datetime.timedelta(weeks=n)
+    else:
+        skip = max(0, (first.year - start.year) * 12 + first.month - start.month - 1)
+        step = lambda n: _monthly(start, n)
+    dates = []
+    n = skip
+    while (day := step(n)) <= last:
+        if day >= first:
+            dates.append(day)
+        n += 1
+    return dates
+
+
+def next_due(rule, after):
+    # first occurrence strictly after `after`
+    day = after + datetime.timedelta(days=1)
+    horizon = day + datetime.timedelta(days=62)
+    return occurrences(rule, day, horizon)[0]
+
+
+def materialise(today=None):
+    # Inserts every occurrence due up to `today` and advances the rules.
+    # Returns the number of records inserted.
+    today = today or datetime.date.today()
+    due = repo.backend().due_rules(datetime.datetime.combine(today, datetime.time()))
+    inserted = 0
+    batch, advances = [], {}
+    for rule in due:
+        for day in occurrences(rule, _as_date(rule["next_due"]), today):
+            week = isoweeks.of(day)
+            batch.append({
+                "_id": f"rec:{rule['_id']}:{day.isoformat()}",
+                "tenant": rule["tenant"],
+                "user": "recurring",
+                "amount": rule["amount"],
+                "category": rule["category"],
+                "date": datetime.datetime.combine(day, datetime.time()),
+                "year": week.year,
+                "week": week.week,
+                "rule": rule["_id"],
+            })
+        # records first, so a crash in between only repeats (skipped) inserts
+        advances[rule["_id"]] = datetime.datetime.combine(next_due(rule, today), datetime.time())
+        if len(batch) >= BATCH_SIZE:
+            inserted += repo.insert_records_sync(batch)
+            batch = []
+    inserted += repo.insert_records_sync(batch)
+    if advances:
+        repo.backend().advance_rules(advances)
+    return inserted
+
+
+def weekly_amount(rules, week):
+    # what `rules` add up to within one isoweeks.Week
+    return sum(rule["amount"] * len(occurrences(rule, week.start, week.end)) for rule in rules)
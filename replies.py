@@ -0,0 +1,61 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Telegram rejects messages longer than this
+MESSAGE_LIMIT = 4096
+
+FENCE = "```"
+
+MENU = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Return to menu", callback_data="return_start")]])
+
+
+def _units(text):
+    # Telegram counts length in UTF-16 code units, most emoji are two
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _cut(line, limit):
+    # `line` split after at most `limit` UTF-16 units, never inside a character
+    units = 0
+    for i, char in enumerate(line):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return line[:max(i, 1)], line[max(i, 1):]
+    return line, ""
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    # Split on line boundaries, hard-splitting only lines longer than `limit`.
+    # A ``` block cut by a split is closed at the end of one part and reopened
+    # at the start of the next, so every part is valid Markdown on its own.
+    closing = _units("\n" + FENCE)
+    chunks = []
+    current, size = "", 0
+    in_code = False
+
+    for line in text.splitlines(keepends=True):
+        toggles = line.count(FENCE) % 2 == 1
+        reopen = FENCE + "\n" if in_code else ""
+        room = limit - (closing if in_code or toggles else 0)
+        while line and size + _units(line) > room:
+            if current == reopen:
+                head, line = _cut(line, room - size)
+                current += head
+            if in_code:
+                current += ("" if current.endswith("\n") else "\n") + FENCE
+            chunks.append(current)
+            current, size = reopen, _units(reopen)
+        current += line
+        size += _units(line)
+        in_code ^= toggles
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+async def reply(message, text, reply_markup=MENU, **kwargs):
+    # Content and keyboard go out as one message. Only text over the limit
+    # is split, with the keyboard attached to the last part.
+    chunks = split_message(text)
+    for chunk in chunks[:-1]:
+        await message.reply_text(chunk, **kwargs)
+    return await message.reply_text(chunks[-1], reply_markup=reply_markup, **kwargs)
@@ -0,0 +1,342 @@
+import asyncio
+import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+import forecast
+import metrics
+import rollups
+import storage
+from cache import TTLCache, MISSING
+
+# Settings and estimates change only through our own writes, so reads are
+# served from memory and every write path below invalidates what it touched.
+# Each read-through takes the cache generation first, see cache.TTLCache.
+# Sizes and TTLs are applied by configure().
+settings_cache = TTLCache("settings", requests=metrics.CACHE_REQUESTS)
+estimates_cache = TTLCache("week_estimates", requests=metrics.CACHE_REQUESTS)
+# Forecasts depend on records, settings and estimates, dropped per tenant on any of its writes
+forecast_cache = TTLCache("forecast", requests=metrics.CACHE_REQUESTS)
+CACHES = (settings_cache, estimates_cache, forecast_cache)
+
+# Everything below is set up by configure() from the settings passed to
+# create_app (config by default), on startup or on first use, so importing
+# this module opens nothing:
+#   _backend   the storage.base.Storage picked by STORAGE_BACKEND
+#   _executor  storage calls block (pymongo, sqlite3), so every call is pushed
+#              onto a bounded thread pool instead of running inside the event
+#              loop shared by FastAPI and telegram_app
+_settings = None
+_backend = None
+_executor = None
+_watch_stop = threading.Event()
+_configure_lock = threading.Lock()
+
+
+def configure(settings=config):
+    global _settings, _backend, _executor, _watch_stop
+    with _configure_lock:
+        if _backend is None:
+            for cache in CACHES:
+                cache.maxsize, cache.ttl = settings.CACHE_SIZE, settings.CACHE_TTL
+                cache.invalidate()
+            _executor = ThreadPoolExecutor(max_workers=settings.DB_THREADS, thread_name_prefix="storage")
+            _watch_stop = threading.Event()
+            _settings = settings
+            _backend = storage.create(settings)
+    return _backend
+
+
+# For background jobs that are already off the event loop (alerts, recurring)
+def backend():
+    return _backend or configure()
+
+
+async def _run(fn, *args, **kwargs):
+    backend()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+# For callers that stream cursors themselves (exports), runs `fn` on the pool.
+async def run_blocking(fn, *args, **kwargs):
+    return await _run(fn, *args, **kwargs)
+
+
+def shutdown():
+    global _backend, _executor
+    with _configure_lock:
+        _watch_stop.set()
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in CACHES}
+
+
+def start_cache_watchers():
+    # Other workers write too, pick up their changes from change streams
+    store = backend()
+    if not _settings.CACHE_CHANGE_STREAM or not store.supports_watch:
+        return
+    # every record write bumps the tenant's settings document, so watching
+    # settings also catches foreign records for the forecast cache
+    watched = (("settings", settings_cache), ("week_estimates", estimates_cache), ("settings", forecast_cache))
+    for kind, cache in watched:
+        threading.Thread(
+            target=store.watch, args=(kind, cache, _watch_stop),
+            name=f"watch-{kind}-{cache.name}", daemon=True
+        ).start()
+
+
+# Tables/indexes and pending schema migrations, run once on startup.
+async def bootstrap():
+    await _run(backend().bootstrap)
+
+
+# === Settings ===
+# Every chat is its own tenant: its settings document is keyed by chat id,
+# records carry a `tenant` field and estimates/rollups use "<tenant>:<year-week>" ids.
+#
+# The running balance changes with every record, written by any worker, so it
+# is not part of the cached settings: read it with get_balance.
+RUNNING_FIELDS = ("balance", "records_total")
+
+
+async def get_settings(tenant):
+    generation = settings_cache.generation
+    doc = settings_cache.get(tenant)
+    if doc is MISSING:
+        doc = await _run(backend().get_settings, tenant)
+        if doc:
+            doc = {k: v for k, v in doc.items() if k not in RUNNING_FIELDS}
+        settings_cache.set(tenant, doc, generation)
+    return doc
+
+
+# initial_balance plus all records, read from the rollup on every call.
+# None until an initial balance is set.
+async def get_balance(tenant):
+    return await _run(backend().get_balance, tenant)
+
+
+async def set_initial_balance(tenant, amount):
+    await _run(backend().set_initial_balance, tenant, amount)
+    settings_cache.invalidate(tenant)
+    forecast_cache.invalidate(tenant)
+
+
+# === Records ===
+# Inserts unless a record with the entry's deterministic _id exists, so a
+# retried or repeated write is a no-op. Returns whether the record was new.
+async def insert_record(entry):
+    return await _run(_insert_record, entry)
+
+
+def _insert_record(entry):
+    entry.setdefault("created_at", datetime.datetime.utcnow())
+    if not backend().insert_record(entry):
+        return False
+    forecast_cache.invalidate(entry["tenant"])
+    return True
+
+
+# Batch insert that skips documents whose _id already exists, so re-imports
+# are idempotent. Returns the number of inserted records.
+async def insert_records(entries):
+    return await _run(insert_records_sync, entries)
+
+
+def insert_records_sync(entries):
+    if not entries:
+        return 0
+    now = datetime.datetime.utcnow()
+    for entry in entries:
+        entry.setdefault("created_at", now)
+    inserted = backend().insert_records(entries)
+    for tenant in {entry["tenant"] for entry in inserted}:
+        forecast_cache.invalidate(tenant)
+    return len(inserted)
+
+
+# Records of one week summed per day and category by the database, so only
+# the summed rows travel back. Rows are ordered by day, then category:
+# {"day": datetime.date, "category": "groceries", "income": 0, "expense": -55.0, "count": 3}
+async def records_by_day_category(tenant, year, week):
+    return await _run(backend().records_by_day_category, tenant, year, week)
+
+
+# Synchronous generator, iterate it on the pool (see run_blocking)
+def iter_records(tenant, start=None, end=None, batch_size=1000):
+    return backend().iter_records(tenant, start, end, batch_size)
+
+
+# Week totals and estimates for `year_weeks`, two batched queries no matter
+# how many records exist. Both dicts are keyed by year-week.
+async def weeks_summary(tenant, year_weeks):
+    return await _run(_weeks_summary, tenant, year_weeks)
+
+
+def _weeks_summary(tenant, year_weeks):
+    return {
+        "weeks": backend().week_totals(tenant, year_weeks),
+        "estimates": _get_estimates(tenant, year_weeks),
+    }
+
+
+# Records of `year_weeks` summed per week and category in one query:
+# {"2025-39": {"count": 3, "categories": {"groceries": -55.0, ...}}, ...}
+async def records_by_week_category(tenant, year_weeks):
+    return await _run(backend().records_by_week_category, tenant, year_weeks)
+
+
+async def get_week_totals(tenant, year_week):
+    totals = await _run(backend().week_totals, tenant, [year_week])
+    return totals.get(year_week)
+
+
+# === Week estimates ===
+async def get_estimate(tenant, year_week):
+    key = rollups.doc_id(tenant, year_week)
+    generation = estimates_cache.generation
+    doc = estimates_cache.get(key)
+    if doc is MISSING:
+        doc = (await _run(backend().get_estimates, tenant, [year_week])).get(year_week)
+        estimates_cache.set(key, doc, generation)
+    return doc
+
+
+def _get_estimates(tenant, year_weeks):
+    # one query for whatever is not cached, misses are cached as None too
+    found = {}
+    missing = []
+    generation = estimates_cache.generation
+    for yw in year_weeks:
+        doc = estimates_cache.get(rollups.doc_id(tenant, yw))
+        if doc is MISSING:
+            missing.append(yw)
+        elif doc:
+            found[yw] = doc
+    if missing:
+        fetched = backend().get_estimates(tenant, missing)
+        for yw in missing:
+            estimates_cache.set(rollups.doc_id(tenant, yw), fetched.get(yw), generation)
+        found.update(fetched)
+    return found
+
+
+# For background threads that are already off the event loop (budget alerts)
+def get_estimate_sync(tenant, year_week):
+    return _get_estimates(tenant, [year_week]).get(year_week)
+
+
+# Synchronous generator, iterate it on the pool (see run_blocking)
+def iter_estimates(tenant, start=None, end=None, batch_size=1000):
+    return backend().iter_estimates(tenant, start, end, batch_size)
+
+
+async def set_estimate(tenant, year_week, field, amount):
+    await set_estimates(tenant, year_week, {field: amount})
+
+
+# Several "expected_<type>s.<category>" fields of one week in a single write
+async def set_estimates(tenant, year_week, fields):
+    await _run(backend().set_estimates, tenant, year_week, fields)
+    estimates_cache.invalidate(rollups.doc_id(tenant, year_week))
+    forecast_cache.invalidate(tenant)
+
+
+# Clones the estimates of `source` onto every week in `targets` in one batch,
+# replacing the targets' expected incomes/expenses.
+# Returns False when `source` has no estimates.
+async def copy_estimates(tenant, source, targets):
+    return await _run(_copy_estimates, tenant, source, targets)
+
+
+def _copy_estimates(tenant, source, targets):
+    doc = _get_estimates(tenant, [source]).get(source)
+    if not doc:
+        return False
+    plan = {
+        "expected_incomes": doc.get("expected_incomes", {}),
+        "expected_expenses": doc.get("expected_expenses", {}),
+    }
+    if targets:
+        backend().copy_estimates(tenant, plan, targets)
+    for yw in targets:
+        estimates_cache.invalidate(rollups.doc_id(tenant, yw))
+    forecast_cache.invalidate(tenant)
+    return True
+
+
+# === Recurring rules (materialised by recurring.py) ===
+async def add_rule(rule):
+    await _run(backend().add_rule, rule)
+
+
+async def list_rules(tenant):
+    return await _run(backend().list_rules, tenant)
+
+
+async def delete_rule(tenant, rule_id):
+    return await _run(backend().delete_rule, tenant, rule_id)
+
+
+# === Forecast ===
+# Balance curve for the next forecast.MAX_WEEKS weeks, None without an initial
+# balance. Memoised per tenant until its next write or the start of a new week;
+# a balance changed by another worker's records also recomputes it.
+async def get_forecast(tenant):
+    past, future = forecast.horizon()
+    generation = forecast_cache.generation
+    current_balance = await get_balance(tenant)
+    if current_balance is None:
+        return None
+    cached = forecast_cache.get(tenant)
+    if cached is not MISSING and cached[:2] == (future[0], current_balance):
+        return cached[2]
+
+    rows = await _run(_forecast, tenant, current_balance, past, future)
+    forecast_cache.set(tenant, (future[0], current_balance, rows), generation)
+    return rows
+
+
+def _forecast(tenant, current_balance, past, future):
+    summary = _weeks_summary(tenant, past + future)
+    return forecast.build(current_balance, past, future, summary["weeks"], summary["estimates"])
+
+
+# === Bot persistence (conversation states, user/chat data) ===
+async def find_states(doc_ids):
+    return await _run(backend().find_states, doc_ids)
+
+
+async def find_states_by_prefix(prefix):
+    return await _run(backend().find_states_by_prefix, prefix)
+
+
+async def find_conversations(name):
+    return await _run(backend().find_conversations, name)
+
+
+# {doc id: doc to store, or None to delete it}
+async def write_states(docs):
+    await _run(backend().write_states, docs)
+
+
+# === Processed updates ===
+# One entry per accepted webhook update, shared by all workers and expired
+# after PROCESSED_UPDATES_TTL. Claiming is a single insert.
+async def claim_update(update_id):
+    return await _run(backend().claim_update, update_id)
+
+
+# Gives the id back when the update could not be queued, so Telegram's redelivery goes through
+async def release_update(update_id):
+    await _run(backend().release_update, update_id)
@@ -0,0 +1,168 @@
+import sys
+from pymongo import UpdateOne
+import isoweeks
+from config import settings, records, records_archive, week_totals
+
+# week_totals holds one document per tenant and year-week:
+#   {"_id": "42:2025-39", "tenant": 42, "year": 2025, "week": 39, "count": 3,
+#    "income": 2000.0, "expense": -55.0,
+#    "incomes": {"salary": 2000.0}, "expenses": {"groceries": -55.0}}
+# and each tenant's settings document caches the sum of its records in
+# `records_total` and `balance` (= initial_balance + records_total).
+# Both count archived records too (see archive.py), which keep their totals.
+
+EPSILON = 1e-6
+
+
+def doc_id(tenant, year_week):
+    return f"{tenant}:{year_week}"
+
+
+def week_key(tenant, year, week):
+    return doc_id(tenant, isoweeks.key(year, week))
+
+
+def _increments(entries):
+    weeks = {}
+    for r in entries:
+        amt = r["amount"]
+        total_field, side = ("income", "incomes") if amt >= 0 else ("expense", "expenses")
+        key = (r["tenant"], r["year"], r["week"])
+        inc = weeks.setdefault(key, {"count": 0})
+        inc["count"] += 1
+        inc[total_field] = inc.get(total_field, 0) + amt
+        cat_field = f"{side}.{r['category']}"
+        inc[cat_field] = inc.get(cat_field, 0) + amt
+    return weeks
+
+
+def apply(entries):
+    # Fold freshly inserted records into week_totals and the running totals
+    if not entries:
+        return
+    ops = [
+        UpdateOne(
+            {"_id": week_key(tenant, year, week)},
+            {"$inc": inc, "$setOnInsert": {"tenant": tenant, "year": year, "week": week}},
+            upsert=True
+        )
+        for (tenant, year, week), inc in _increments(entries).items()
+    ]
+    week_totals.bulk_write(ops, ordered=False)
+
+    deltas = {}
+    for r in entries:
+        deltas[r["tenant"]] = deltas.get(r["tenant"], 0) + r["amount"]
+    for tenant, delta in deltas.items():
+        settings.update_one(
+            {"_id": tenant},
+            {"$inc": {"records_total": delta, "balance": delta}, "$setOnInsert": {"tenant": tenant}},
+            upsert=True
+        )
+
+
+def compute(tenant=None):
+    # Recompute rollups from raw (hot and archived) records, grouped server-side
+    match = {"tenant": tenant} if tenant is not None else {"tenant": {"$exists": True}}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "tenant": "$tenant", "year": "$year", "week": "$week", "category": "$category",
+                "income": {"$gte": ["$amount", 0]},
+            },
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+    ]
+    # an archived record whose hot copy is not deleted yet (see archive.py) counts once, as hot
+    archived = [
+        pipeline[0],
+        {"$lookup": {"from": "records", "localField": "_id", "foreignField": "_id", "as": "hot"}},
+        {"$match": {"hot": {"$size": 0}}},
+        *pipeline[1:],
+    ]
+    weeks = {}
+    groups = (g for collection, stages in ((records, pipeline), (records_archive, archived)) for g in collection.aggregate(stages))
+    for g in groups:
+        key = g["_id"]
+        total_field, side = ("income", "incomes") if key["income"] else ("expense", "expenses")
+        doc = weeks.setdefault(week_key(key["tenant"], key["year"], key["week"]), {
+            "tenant": key["tenant"], "year": key["year"], "week": key["week"], "count": 0,
+            "income": 0, "expense": 0, "incomes": {}, "expenses": {},
+        })
+        doc["count"] += g["count"]
+        doc[total_field] += g["amount"]
+        doc[side][key["category"]] = doc[side].get(key["category"], 0) + g["amount"]
+    return weeks
+
+
+def _tenant_totals(weeks):
+    totals = {doc["tenant"]: 0 for doc in settings.find({"tenant": {"$exists": True}}, {"tenant": 1})}
+    for doc in weeks.values():
+        totals[doc["tenant"]] = totals.get(doc["tenant"], 0) + doc["income"] + doc["expense"]
+    return totals
+
+
+def rebuild():
+    weeks = compute()
+    week_totals.delete_many({})
+    if weeks:
+        week_totals.insert_many([{"_id": k, **doc} for k, doc in weeks.items()])
+    for tenant, total in _tenant_totals(weeks).items():
+        settings.update_one(
+            {"_id": tenant},
+            [{"$set": {
+                "tenant": tenant,
+                "records_total": total,
+                "balance": {"$add": [{"$ifNull": ["$initial_balance", 0]}, total]},
+            }}],
+            upsert=True
+        )
+    return len(weeks)
+
+
+def _differs(a, b):
+    return abs((a or 0) - (b or 0)) > EPSILON
+
+
+def verify():
+    # Compare stored rollups against raw records, returns a list of drift lines
+    expected = compute()
+    stored = {doc["_id"]: doc for doc in week_totals.find()}
+    drift = []
+
+    for key in sorted(set(expected) | set(stored)):
+        e, s = expected.get(key, {}), stored.get(key, {})
+        for field in ("count", "income", "expense"):
+            if _differs(e.get(field), s.get(field)):
+                drift.append(f"{key} {field}: stored {s.get(field)}, actual {e.get(field)}")
+        for side in ("incomes", "expenses"):
+            e_cats, s_cats = e.get(side, {}), s.get(side, {})
+            for cat in sorted(set(e_cats) | set(s_cats)):
+                if _differs(e_cats.get(cat), s_cats.get(cat)):
+                    drift.append(f"{key} {side}.{cat}: stored {s_cats.get(cat)}, actual {e_cats.get(cat)}")
+
+    for tenant, total in sorted(_tenant_totals(expected).items()):
+        doc = settings.find_one({"_id": tenant}) or {}
+        if _differs(doc.get("records_total"), total):
+            drift.append(f"{tenant} records_total: stored {doc.get('records_total')}, actual {total}")
+        if _differs(doc.get("balance"), doc.get("initial_balance", 0) + total):
+            drift.append(f"{tenant} balance: stored {doc.get('balance')}, actual {doc.get('initial_balance', 0) + total}")
+    return drift
+
+
+# Usage: python rollups.py verify|rebuild
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if command == "rebuild":
+        print(f"Rebuilt totals for {rebuild()} weeks")
+    elif command == "verify":
+        drift = verify()
+        for line in drift:
+            print(line)
+        print("No drift" if not drift else f"{len(drift)} drifted values")
+        sys.exit(1 if drift else 0)
+    else:
+        print("Usage: python rollups.py verify|rebuild")
+        sys.exit(2)
@@ -0,0 +1,22 @@
+# Storage backends behind repository.py. A backend does the blocking reads
+# and writes against one database; repository.py keeps the thread pool, the
+# caches and the async API the handlers use. STORAGE_BACKEND picks one:
+#
+#   mongo   MongoDB at MONGO_URI (storage/mongo.py)
+#   sqlite  an embedded SQLite file at SQLITE_PATH (storage/sqlite.py)
+#
+# Every backend implements storage.base.Storage and returns the same
+# document shapes, so nothing above repository.py knows which one runs.
+
+BACKENDS = ("mongo", "sqlite")
+
+
+def create(settings):
+    # `settings` is the config module or any object with the same names
+    if settings.STORAGE_BACKEND == "mongo":
+        from storage.mongo import MongoStorage
+        return MongoStorage(settings)
+    if settings.STORAGE_BACKEND == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(settings)
+    raise ValueError(f"Unknown STORAGE_BACKEND {settings.STORAGE_BACKEND!r}, expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,178 @@
+import abc
+
+
+class Storage(abc.ABC):
+    # The operations repository.py and the background jobs need from a
+    # database. All methods block, callers run them on repository's pool.
+    #
+    # Documents look the same on every backend:
+    #   settings:  {"_id": 42, "tenant": 42, "initial_balance": 100.0, "records_total": -55.0, "balance": 45.0}
+    #   records:   {"_id": "msg:42:7", "tenant": 42, "user": "ann", "amount": -55.0, "category": "groceries",
+    #               "date": datetime, "year": 2025, "week": 39, "created_at": datetime, ...}
+    #   totals:    see rollups.py (week_totals)
+    #   summaries: see archive.py
+    #   estimates: {"_id": "42:2025-39", "tenant": 42, "year_week": "2025-39",
+    #               "expected_incomes": {"salary": 2000.0}, "expected_expenses": {"groceries": -60.0}}
+    #   rules:     see recurring.py
+    #   state:     see persistence.py
+    # Week ranges (`start`, `end`) are inclusive (year, week) tuples or None.
+
+    name = None
+    # whether watch_records and watch can push changes, see alerts.py
+    supports_watch = False
+
+    # --- lifecycle
+    @abc.abstractmethod
+    def bootstrap(self):
+        # create tables/indexes and apply pending migrations
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def watch(self, kind, cache, stop_event):
+        # Invalidate `cache` when another process changes `kind` ("settings"
+        # or "week_estimates") until `stop_event` is set. Backends without
+        # change notifications return right away and rely on the cache TTL.
+        pass
+
+    # --- settings
+    @abc.abstractmethod
+    def get_settings(self, tenant):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_balance(self, tenant):
+        # initial_balance plus every record (hot and archived), None without an initial balance
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_initial_balance(self, tenant, amount):
+        raise NotImplementedError
+
+    # --- records
+    @abc.abstractmethod
+    def insert_record(self, entry):
+        # insert unless the _id exists (hot or archived), returns whether it was new
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_records(self, entries):
+        # insert the entries whose _id is new, returns those entries
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def records_by_day_category(self, tenant, year, week):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def records_by_week_category(self, tenant, year_weeks):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def week_totals(self, tenant, year_weeks):
+        # {year_week: totals doc} for the weeks that have records
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_records(self, tenant, start=None, end=None, batch_size=1000):
+        # hot and archived records without _id/tenant, ordered by year, week and date
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def week_records(self, tenant, year, week, created_before):
+        # [{"_id", "category", "amount"}] of one week's records with
+        # created_at < created_before (budget alerts)
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def records_since(self, since):
+        # records with created_at >= since, oldest first (budget alerts)
+        raise NotImplementedError
+
+    def watch_records(self, stop_event, since=None):
+        # Yields newly inserted records until `stop_event` is set, starting
+        # from `since` (a past datetime) when given. Only for backends with
+        # supports_watch, the others are polled with records_since. Raises
+        # when the stream breaks, callers reopen it.
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def archive_weeks(self, before):
+        # move the records of weeks before `before` (year, week) to the archive
+        # and fold them into week summaries, see archive.py. Returns the number moved.
+        raise NotImplementedError
+
+    # --- week estimates
+    @abc.abstractmethod
+    def get_estimates(self, tenant, year_weeks):
+        # {year_week: estimates doc} for the weeks that have estimates
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_estimates(self, tenant, year_week, fields):
+        # fields: {"expected_<type>s.<category>": amount}
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def copy_estimates(self, tenant, plan, targets):
+        # replace the estimates of every week in `targets` with `plan`:
+        # {"expected_incomes": {...}, "expected_expenses": {...}}
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_estimates(self, tenant, start=None, end=None, batch_size=1000):
+        raise NotImplementedError
+
+    # --- recurring rules
+    @abc.abstractmethod
+    def add_rule(self, rule):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_rules(self, tenant):
+        # ordered by start
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_rule(self, tenant, rule_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def due_rules(self, until):
+        # rules of every tenant with next_due <= until
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def advance_rules(self, next_due):
+        # next_due: {rule id: datetime}
+        raise NotImplementedError
+
+    # --- bot persistence
+    @abc.abstractmethod
+    def find_states(self, doc_ids):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_states_by_prefix(self, prefix):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_conversations(self, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write_states(self, docs):
+        # docs: {doc id: doc to store, or None to delete it}
+        raise NotImplementedError
+
+    # --- processed updates
+    @abc.abstractmethod
+    def claim_update(self, update_id):
+        # remember `update_id` (a Telegram update id, or a key like
+        # "alert:42:2025-39:groceries"), False when it was remembered already
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release_update(self, update_id):
+        raise NotImplementedError
@@ -0,0 +1,382 @@
+import calendar
+import datetime
+import heapq
+import re
+from bson import Timestamp
+from pymongo import UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+import archive
+import cache
+import config
+import isoweeks
+import migrations
+import rollups
+from config import settings, records, records_archive, week_summaries, week_estimates, week_totals
+from config import persistence, processed_updates, recurring
+from storage.base import Storage
+
+# Collections the cache watchers can follow (see Storage.watch)
+WATCHED = {"settings": settings, "week_estimates": week_estimates}
+
+
+def _before_query(before):
+    return {"$or": [{"year": {"$lt": before[0]}}, {"year": before[0], "week": {"$lt": before[1]}}]}
+
+
+def _week_range_query(start, end):
+    # start/end are inclusive (year, week) tuples or None for an open bound
+    conditions = []
+    if start:
+        conditions.append({"$or": [{"year": {"$gt": start[0]}}, {"year": start[0], "week": {"$gte": start[1]}}]})
+    if end:
+        conditions.append({"$or": [{"year": {"$lt": end[0]}}, {"year": end[0], "week": {"$lte": end[1]}}]})
+    return {"$and": conditions} if conditions else {}
+
+
+class MongoStorage(Storage):
+    # Records, estimates and rules live in their own collections; week totals
+    # and the settings balance are rollups kept up to date on every insert
+    # (see rollups.py), so summaries never scan raw records. Archived weeks
+    # (archive.py) keep their rollups, only the per-day views need week_summaries.
+
+    name = "mongo"
+
+    def __init__(self, settings=config):
+        self.settings = settings
+        self._supports_watch = None
+
+    @property
+    def supports_watch(self):
+        # change streams need a replica set or mongos, a standalone mongod has neither
+        if self._supports_watch is None:
+            try:
+                hello = config.connect(self.settings).client.admin.command("ismaster")
+                self._supports_watch = "setName" in hello or hello.get("msg") == "isdbgrid"
+            except (PyMongoError, NotImplementedError):  # mongomock implements neither
+                self._supports_watch = False
+        return self._supports_watch
+
+    def bootstrap(self):
+        migrations.bootstrap(self.settings)
+
+    def close(self):
+        config.close()
+
+    def watch(self, kind, target, stop_event):
+        cache.watch(WATCHED[kind], target, stop_event)
+
+    # === Settings ===
+    def get_settings(self, tenant):
+        return settings.find_one({"_id": tenant})
+
+    def get_balance(self, tenant):
+        doc = settings.find_one({"_id": tenant}, {"initial_balance": 1, "balance": 1})
+        if not doc or "initial_balance" not in doc:
+            return None
+        return doc.get("balance", doc["initial_balance"])
+
+    def set_initial_balance(self, tenant, amount):
+        # pipeline update keeps the cached balance consistent in a single write
+        settings.update_one(
+            {"_id": tenant},
+            [{"$set": {
+                "tenant": tenant,
+                "initial_balance": amount,
+                "balance": {"$add": [amount, {"$ifNull": ["$records_total", 0]}]},
+            }}],
+            upsert=True
+        )
+
+    # === Records ===
+    def _archived_ids(self, entries):
+        # ids of `entries` moved to records_archive already, looked up only for archived weeks
+        weeks = self.settings.ARCHIVE_WEEKS
+        old = [entry["_id"] for entry in entries if "_id" in entry and archive.is_archived(entry["year"], entry["week"], weeks)]
+        if not old:
+            return set()
+        return {doc["_id"] for doc in records_archive.find({"_id": {"$in": old}}, {"_id": 1})}
+
+    def insert_record(self, entry):
+        if self._archived_ids([entry]):
+            return False
+        result = records.update_one({"_id": entry["_id"]}, {"$setOnInsert": entry}, upsert=True)
+        if result.upserted_id is None:
+            return False
+        rollups.apply([entry])
+        return True
+
+    def insert_records(self, entries):
+        archived = self._archived_ids(entries)
+        if archived:
+            entries = [entry for entry in entries if entry.get("_id") not in archived]
+            if not entries:
+                return []
+        try:
+            records.insert_many(entries, ordered=False)
+            inserted = entries
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            failed = {err["index"] for err in errors}
+            inserted = [entry for i, entry in enumerate(entries) if i not in failed]
+        rollups.apply(inserted)
+        return inserted
+
+    def records_by_day_category(self, tenant, year, week):
+        # the summary first, so a record archived in between is skipped by the hot read
+        summary = week_summaries.find_one({"_id": rollups.week_key(tenant, year, week), "complete": True})
+        match = {"tenant": tenant, "year": year, "week": week}
+        if summary and summary.get("hot_ids"):
+            match["_id"] = {"$nin": summary["hot_ids"]}
+        pipeline = [
+            {"$match": match},
+            {"$project": {"_id": 0, "date": 1, "category": 1, "amount": 1}},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+                    "category": "$category",
+                },
+                "income": {"$sum": {"$cond": [{"$gt": ["$amount", 0]}, "$amount", 0]}},
+                "expense": {"$sum": {"$cond": [{"$lt": ["$amount", 0]}, "$amount", 0]}},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id.day": 1, "_id.category": 1}},
+        ]
+        rows = [
+            {
+                "day": datetime.date.fromisoformat(g["_id"]["day"]),
+                "category": g["_id"]["category"],
+                "income": g["income"],
+                "expense": g["expense"],
+                "count": g["count"],
+            }
+            for g in records.aggregate(pipeline)
+        ]
+        return archive.merge_day_rows(rows, archive.day_rows(summary)) if summary else rows
+
+    def records_by_week_category(self, tenant, year_weeks):
+        weeks = [isoweeks.parse(yw)[:2] for yw in year_weeks]
+        ids = [rollups.week_key(tenant, y, w) for y, w in weeks]
+        summaries = list(week_summaries.find({"_id": {"$in": ids}, "complete": True})) if weeks else []
+        match = {"tenant": tenant, "$or": [{"year": y, "week": w} for y, w in weeks]}
+        hot_ids = [doc_id for summary in summaries for doc_id in summary.get("hot_ids", [])]
+        if hot_ids:
+            match["_id"] = {"$nin": hot_ids}
+        pipeline = [
+            {"$match": match},
+            {"$project": {"_id": 0, "year": 1, "week": 1, "category": 1, "amount": 1}},
+            {"$group": {
+                "_id": {"year": "$year", "week": "$week", "category": "$category"},
+                "amount": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+        ]
+        result = {}
+        for g in records.aggregate(pipeline):
+            key = g["_id"]
+            week = result.setdefault(isoweeks.key(key["year"], key["week"]), {"count": 0, "categories": {}})
+            week["count"] += g["count"]
+            week["categories"][key["category"]] = g["amount"]
+
+        for summary in summaries:
+            week = result.setdefault(isoweeks.key(summary["year"], summary["week"]), {"count": 0, "categories": {}})
+            for row in summary["rows"]:
+                week["count"] += row["count"]
+                week["categories"][row["category"]] = week["categories"].get(row["category"], 0) + row["amount"]
+        return result
+
+    def week_totals(self, tenant, year_weeks):
+        ids = [rollups.doc_id(tenant, yw) for yw in year_weeks]
+        return {
+            isoweeks.key(doc["year"], doc["week"]): doc
+            for doc in week_totals.find({"_id": {"$in": ids}})
+        }
+
+    def iter_records(self, tenant, start=None, end=None, batch_size=1000):
+        query = {"tenant": tenant, **_week_range_query(start, end)}
+        sort = [("year", 1), ("week", 1), ("date", 1)]
+        hot = records.find(query, {"tenant": 0}).sort(sort).batch_size(batch_size)
+        cold = records_archive.find(query, {"tenant": 0}).sort(sort).batch_size(batch_size)
+        with hot, cold:
+            # Both sorted the same way, merged without loading either. While a
+            # week is being archived its records are in both, ids seen in the
+            # current week are skipped.
+            week, seen = None, set()
+            for doc in heapq.merge(cold, hot, key=lambda r: (r["year"], r["week"], r["date"])):
+                if (doc["year"], doc["week"]) != week:
+                    week, seen = (doc["year"], doc["week"]), set()
+                doc_id = doc.pop("_id")
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    yield doc
+
+    def week_records(self, tenant, year, week, created_before):
+        # records from before created_at was stamped count as older than anything
+        query = {"tenant": tenant, "year": year, "week": week, "created_at": {"$not": {"$gte": created_before}}}
+        return list(records.find(query, {"category": 1, "amount": 1}))
+
+    def records_since(self, since):
+        return list(records.find({"created_at": {"$gte": since}}).sort("created_at", 1))
+
+    def watch_records(self, stop_event, since=None):
+        options = {}
+        if since is not None:
+            # replays inserts still in the oplog, so nothing is lost while a stream reconnects
+            options["start_at_operation_time"] = Timestamp(calendar.timegm(since.utctimetuple()), 0)
+        with records.watch([{"$match": {"operationType": "insert"}}], max_await_time_ms=1000, **options) as stream:
+            # an invalidate event (collection dropped or renamed) closes the stream
+            while stream.alive and not stop_event.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    yield change["fullDocument"]
+
+    def archive_weeks(self, before):
+        # Week by week: copy to the archive, rebuild the week's summary from
+        # everything archived for it, then delete the hot copies. The rebuilt
+        # summary lists the moved records that are still hot in `hot_ids` and
+        # reads skip those in the hot collection, so every record is counted
+        # exactly once at every step, and the summary never goes missing.
+        # Every step can be repeated: a run that dies halfway leaves the hot
+        # copies and the next run moves them again. Summaries left pending by
+        # runs before hot_ids are finished as well. A week is claimed (see
+        # claim_update) while it is worked on, so workers running the job at
+        # the same time skip each other's weeks.
+        hot_weeks = records.aggregate([
+            {"$match": _before_query(before)},
+            {"$group": {"_id": {"tenant": "$tenant", "year": "$year", "week": "$week"}}},
+        ])
+        pending = week_summaries.find({"pending": True, **_before_query(before)}, {"tenant": 1, "year": 1, "week": 1})
+        weeks = {(g["_id"]["tenant"], g["_id"]["year"], g["_id"]["week"]) for g in hot_weeks}
+        weeks |= {(doc["tenant"], doc["year"], doc["week"]) for doc in pending}
+        moved = 0
+        for tenant, year, week in sorted(weeks):
+            claim = "archive:" + rollups.week_key(tenant, year, week)
+            if not self.claim_update(claim):
+                continue
+            try:
+                moved += self._archive_week({"tenant": tenant, "year": year, "week": week})
+            finally:
+                self.release_update(claim)
+        return moved
+
+    def _archive_week(self, week):
+        summary_id = rollups.week_key(week["tenant"], week["year"], week["week"])
+        docs = list(records.find(week))
+        ids = [doc["_id"] for doc in docs]
+        if docs:
+            try:
+                records_archive.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+        rows = records_archive.aggregate([
+            {"$match": week},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+                    "category": "$category",
+                    "income": {"$gte": ["$amount", 0]},
+                },
+                "amount": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id.day": 1, "_id.category": 1}},
+        ])
+        # one update makes the summary hold the moved records and hides their hot copies
+        week_summaries.update_one(
+            {"_id": summary_id},
+            {
+                "$set": {
+                    **week, "complete": True, "hot_ids": ids,
+                    "rows": [{**g["_id"], "amount": g["amount"], "count": g["count"]} for g in rows],
+                },
+                "$unset": {"pending": ""},
+            },
+            upsert=True
+        )
+        if docs:
+            records.delete_many({"_id": {"$in": ids}})
+        week_summaries.update_one({"_id": summary_id}, {"$unset": {"hot_ids": ""}})
+        return len(docs)
+
+    # === Week estimates ===
+    def get_estimates(self, tenant, year_weeks):
+        ids = [rollups.doc_id(tenant, yw) for yw in year_weeks]
+        return {doc["year_week"]: doc for doc in week_estimates.find({"_id": {"$in": ids}})}
+
+    def set_estimates(self, tenant, year_week, fields):
+        week_estimates.update_one(
+            {"_id": rollups.doc_id(tenant, year_week)},
+            {"$set": fields, "$setOnInsert": {"tenant": tenant, "year_week": year_week}},
+            upsert=True
+        )
+
+    def copy_estimates(self, tenant, plan, targets):
+        ops = [
+            UpdateOne(
+                {"_id": rollups.doc_id(tenant, yw)},
+                {"$set": plan, "$setOnInsert": {"tenant": tenant, "year_week": yw}},
+                upsert=True
+            )
+            for yw in targets
+        ]
+        if ops:
+            week_estimates.bulk_write(ops, ordered=False)
+
+    def iter_estimates(self, tenant, start=None, end=None, batch_size=1000):
+        query = {"tenant": tenant}
+        if start:
+            query.setdefault("year_week", {})["$gte"] = isoweeks.key(*start)
+        if end:
+            query.setdefault("year_week", {})["$lte"] = isoweeks.key(*end)
+        with week_estimates.find(query).sort("year_week", 1).batch_size(batch_size) as cursor:
+            yield from cursor
+
+    # === Recurring rules ===
+    def add_rule(self, rule):
+        recurring.insert_one(rule)
+
+    def list_rules(self, tenant):
+        return list(recurring.find({"tenant": tenant}).sort("start", 1))
+
+    def delete_rule(self, tenant, rule_id):
+        return recurring.delete_one({"_id": rule_id, "tenant": tenant}).deleted_count > 0
+
+    def due_rules(self, until):
+        return list(recurring.find({"next_due": {"$lte": until}}))
+
+    def advance_rules(self, next_due):
+        ops = [UpdateOne({"_id": rule_id}, {"$set": {"next_due": due}}) for rule_id, due in next_due.items()]
+        if ops:
+            recurring.bulk_write(ops, ordered=False)
+
+    # === Bot persistence ===
+    def find_states(self, doc_ids):
+        return list(persistence.find({"_id": {"$in": list(doc_ids)}}))
+
+    def find_states_by_prefix(self, prefix):
+        return list(persistence.find({"_id": {"$regex": "^" + re.escape(prefix)}}))
+
+    def find_conversations(self, name):
+        return list(persistence.find({"name": name}))
+
+    def write_states(self, docs):
+        ops = [
+            ReplaceOne({"_id": doc_id}, doc, upsert=True) if doc else DeleteOne({"_id": doc_id})
+            for doc_id, doc in docs.items()
+        ]
+        if ops:
+            persistence.bulk_write(ops, ordered=False)
+
+    # === Processed updates ===
+    # Expired by a TTL index (see migrations.INDEXES)
+    def claim_update(self, update_id):
+        try:
+            processed_updates.insert_one({"_id": update_id, "created_at": datetime.datetime.utcnow()})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def release_update(self, update_id):
+        processed_updates.delete_one({"_id": update_id})
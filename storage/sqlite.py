@@ -0,0 +1,492 @@
+import datetime
+import itertools
+import json
+import sqlite3
+import threading
+import uuid
+import isoweeks
+import rollups
+from storage.base import Storage
+
+# Embedded storage for single-household deployments and local runs: one
+# SQLite file in WAL mode, so readers on the pool threads never wait for the
+# writer. Week totals and balances are SQL aggregates over `records` served
+# from a covering index, there are no rollup tables to keep in sync. Archived
+# weeks (archive.py) are aggregated from `week_summaries` in the same queries.
+# Timestamps are stored as ISO strings, which sort like the datetimes.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    tenant INTEGER PRIMARY KEY,
+    initial_balance REAL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT PRIMARY KEY,
+    tenant INTEGER NOT NULL,
+    user TEXT,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    date TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS records_tenant_week ON records (tenant, year, week, category, amount);
+CREATE INDEX IF NOT EXISTS records_tenant_date ON records (tenant, date);
+CREATE INDEX IF NOT EXISTS records_created_at ON records (created_at);
+CREATE TABLE IF NOT EXISTS records_archive (
+    id TEXT PRIMARY KEY,
+    tenant INTEGER NOT NULL,
+    user TEXT,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    date TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS records_archive_tenant_week ON records_archive (tenant, year, week, date);
+CREATE TABLE IF NOT EXISTS week_summaries (
+    tenant INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    category TEXT NOT NULL,
+    income INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (tenant, year, week, day, category, income)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS estimates (
+    tenant INTEGER NOT NULL,
+    year_week TEXT NOT NULL,
+    field TEXT NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (tenant, year_week, field, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS recurring (
+    id TEXT PRIMARY KEY,
+    tenant INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    cadence TEXT NOT NULL,
+    start TEXT NOT NULL,
+    next_due TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recurring_tenant ON recurring (tenant, start);
+CREATE INDEX IF NOT EXISTS recurring_next_due ON recurring (next_due);
+CREATE TABLE IF NOT EXISTS persistence (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS persistence_name ON persistence (name);
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_updates_created_at ON processed_updates (created_at);
+"""
+
+RECORD_COLUMNS = ("user", "amount", "category", "date", "year", "week", "created_at")
+ESTIMATE_FIELDS = ("expected_incomes", "expected_expenses")
+RULE_COLUMNS = ("tenant", "amount", "category", "cadence", "start", "next_due")
+
+
+def _ts(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return value.isoformat(timespec="microseconds")
+
+
+def _dt(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def _weeks_clause(year_weeks):
+    # condition and parameters matching `year_weeks`; the BETWEEN bounds the
+    # index range (SQLite only seeks on the tenant for a row-value IN list)
+    weeks = sorted(isoweeks.parse(yw)[:2] for yw in year_weeks)
+    clause = f"(year, week) BETWEEN (?, ?) AND (?, ?) AND (year, week) IN (VALUES {', '.join(['(?, ?)'] * len(weeks))})"
+    return clause, [*weeks[0], *weeks[-1], *(v for w in weeks for v in w)]
+
+
+def _week_range(start, end):
+    conditions, params = [], []
+    if start:
+        conditions.append("(year, week) >= (?, ?)")
+        params += list(start)
+    if end:
+        conditions.append("(year, week) <= (?, ?)")
+        params += list(end)
+    return "".join(f" AND {c}" for c in conditions), params
+
+
+class SQLiteStorage(Storage):
+    # One connection per thread (sqlite3 connections are not shareable),
+    # all opened on the same file with WAL and a busy timeout for writers.
+
+    name = "sqlite"
+
+    def __init__(self, settings):
+        self.path = settings.SQLITE_PATH
+        self.processed_updates_ttl = settings.PROCESSED_UPDATES_TTL
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            # with WAL a commit survives crashes without an fsync per transaction
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def bootstrap(self):
+        with self.conn as conn:
+            # processed_updates took integer update ids only before budget alerts
+            # claimed "alert:..." keys in it. Its rows expire anyway, so it is recreated.
+            columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(processed_updates)")}
+            if columns.get("update_id") == "INTEGER":
+                conn.execute("DROP TABLE processed_updates")
+            conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    # === Settings ===
+    def _records_total(self, tenant):
+        # (sum of amounts, number of records) over hot records and summaries
+        return self.conn.execute(
+            "SELECT TOTAL(amount), TOTAL(count) FROM ("
+            "SELECT amount, 1 AS count FROM records WHERE tenant = ? "
+            "UNION ALL SELECT amount, count FROM week_summaries WHERE tenant = ?)",
+            (tenant, tenant)
+        ).fetchone()
+
+    def get_settings(self, tenant):
+        row = self.conn.execute("SELECT initial_balance FROM settings WHERE tenant = ?", (tenant,)).fetchone()
+        total, count = self._records_total(tenant)
+        if row is None and not count:
+            return None
+        doc = {"_id": tenant, "tenant": tenant, "records_total": total, "balance": total}
+        if row is not None:
+            doc["initial_balance"] = row[0]
+            doc["balance"] = row[0] + total
+        return doc
+
+    def get_balance(self, tenant):
+        row = self.conn.execute("SELECT initial_balance FROM settings WHERE tenant = ?", (tenant,)).fetchone()
+        if row is None:
+            return None
+        return row[0] + self._records_total(tenant)[0]
+
+    def set_initial_balance(self, tenant, amount):
+        with self.conn as conn:
+            conn.execute(
+                "INSERT INTO settings (tenant, initial_balance) VALUES (?, ?) "
+                "ON CONFLICT (tenant) DO UPDATE SET initial_balance = excluded.initial_balance",
+                (tenant, amount)
+            )
+
+    # === Records ===
+    @staticmethod
+    def _record_row(entry):
+        entry.setdefault("_id", uuid.uuid4().hex)
+        extra = {k: v for k, v in entry.items() if k not in RECORD_COLUMNS and k not in ("_id", "tenant")}
+        return (
+            entry["_id"], entry["tenant"], entry.get("user"), entry["amount"], entry["category"],
+            _ts(entry["date"]), entry["year"], entry["week"], _ts(entry["created_at"]),
+            json.dumps(extra, default=str) if extra else None,
+        )
+
+    def insert_records(self, entries):
+        inserted = []
+        with self.conn as conn:
+            for entry in entries:
+                row = self._record_row(entry)
+                # an archived record keeps its id, re-adding it is a no-op as well
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO records (id, tenant, user, amount, category, date, year, week, created_at, extra) "
+                    "SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM records_archive WHERE id = ?)",
+                    (*row, row[0])
+                )
+                if cursor.rowcount:
+                    inserted.append(entry)
+        return inserted
+
+    def insert_record(self, entry):
+        return bool(self.insert_records([entry]))
+
+    @staticmethod
+    def _record(row, with_id=True):
+        # row: id, tenant, user, amount, category, date, year, week, created_at, extra
+        doc = {"_id": row[0], "tenant": row[1]} if with_id else {}
+        doc.update(zip(RECORD_COLUMNS, row[2:9]))
+        doc["date"], doc["created_at"] = _dt(doc["date"]), _dt(doc["created_at"])
+        if row[9]:
+            doc.update(json.loads(row[9]))
+        return doc
+
+    def records_by_day_category(self, tenant, year, week):
+        rows = self.conn.execute(
+            "SELECT day, category, "
+            "TOTAL(CASE WHEN amount > 0 THEN amount END), TOTAL(CASE WHEN amount < 0 THEN amount END), SUM(count) FROM ("
+            "SELECT substr(date, 1, 10) AS day, category, amount, 1 AS count FROM records "
+            "WHERE tenant = ? AND year = ? AND week = ? "
+            "UNION ALL SELECT day, category, amount, count FROM week_summaries "
+            "WHERE tenant = ? AND year = ? AND week = ?"
+            ") GROUP BY day, category ORDER BY day, category",
+            (tenant, year, week) * 2
+        )
+        return [
+            {
+                "day": datetime.date.fromisoformat(day),
+                "category": category,
+                "income": income,
+                "expense": expense,
+                "count": count,
+            }
+            for day, category, income, expense, count in rows
+        ]
+
+    def records_by_week_category(self, tenant, year_weeks):
+        if not year_weeks:
+            return {}
+        clause, params = _weeks_clause(year_weeks)
+        rows = self.conn.execute(
+            f"SELECT year, week, category, TOTAL(amount), SUM(count) FROM ("
+            f"SELECT year, week, category, amount, 1 AS count FROM records WHERE tenant = ? AND {clause} "
+            f"UNION ALL SELECT year, week, category, amount, count FROM week_summaries WHERE tenant = ? AND {clause}"
+            f") GROUP BY year, week, category",
+            [tenant, *params] * 2
+        )
+        result = {}
+        for year, week, category, amount, count in rows:
+            doc = result.setdefault(isoweeks.key(year, week), {"count": 0, "categories": {}})
+            doc["count"] += count
+            doc["categories"][category] = amount
+        return result
+
+    def week_totals(self, tenant, year_weeks):
+        # the week_totals shape of rollups.compute, straight from the covering index
+        # (and the summaries of archived weeks)
+        if not year_weeks:
+            return {}
+        clause, params = _weeks_clause(year_weeks)
+        rows = self.conn.execute(
+            f"SELECT year, week, category, income, TOTAL(amount), SUM(count) FROM ("
+            f"SELECT year, week, category, amount >= 0 AS income, amount, 1 AS count FROM records "
+            f"WHERE tenant = ? AND {clause} "
+            f"UNION ALL SELECT year, week, category, income, amount, count FROM week_summaries "
+            f"WHERE tenant = ? AND {clause}"
+            f") GROUP BY year, week, category, income",
+            [tenant, *params] * 2
+        )
+        result = {}
+        for year, week, category, income, amount, count in rows:
+            total_field, side = ("income", "incomes") if income else ("expense", "expenses")
+            doc = result.setdefault(isoweeks.key(year, week), {
+                "_id": rollups.week_key(tenant, year, week), "tenant": tenant, "year": year, "week": week,
+                "count": 0, "income": 0, "expense": 0, "incomes": {}, "expenses": {},
+            })
+            doc["count"] += count
+            doc[total_field] += amount
+            doc[side][category] = doc[side].get(category, 0) + amount
+        return result
+
+    def iter_records(self, tenant, start=None, end=None, batch_size=1000):
+        clause, params = _week_range(start, end)
+        cursor = self.conn.execute(
+            f"SELECT * FROM records WHERE tenant = ?{clause} "
+            f"UNION ALL SELECT * FROM records_archive WHERE tenant = ?{clause} "
+            f"ORDER BY year, week, date",
+            [tenant, *params] * 2
+        )
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield self._record(row, with_id=False)
+
+    def week_records(self, tenant, year, week, created_before):
+        rows = self.conn.execute(
+            "SELECT id, category, amount FROM records WHERE tenant = ? AND year = ? AND week = ? AND created_at < ?",
+            (tenant, year, week, _ts(created_before))
+        )
+        return [{"_id": id_, "category": category, "amount": amount} for id_, category, amount in rows]
+
+    def records_since(self, since):
+        rows = self.conn.execute(
+            "SELECT * FROM records WHERE created_at >= ? ORDER BY created_at", (_ts(since),)
+        )
+        return [self._record(row) for row in rows]
+
+    def archive_weeks(self, before):
+        # one transaction, so the summaries never count a record twice or miss it
+        with self.conn as conn:
+            conn.execute("INSERT OR IGNORE INTO records_archive SELECT * FROM records WHERE (year, week) < (?, ?)", before)
+            conn.execute(
+                "INSERT INTO week_summaries (tenant, year, week, day, category, income, amount, count) "
+                "SELECT tenant, year, week, substr(date, 1, 10), category, amount >= 0, TOTAL(amount), COUNT(*) "
+                "FROM records WHERE (year, week) < (?, ?) "
+                "GROUP BY tenant, year, week, substr(date, 1, 10), category, amount >= 0 "
+                "ON CONFLICT (tenant, year, week, day, category, income) "
+                "DO UPDATE SET amount = amount + excluded.amount, count = count + excluded.count",
+                before
+            )
+            return conn.execute("DELETE FROM records WHERE (year, week) < (?, ?)", before).rowcount
+
+    # === Week estimates ===
+    @staticmethod
+    def _estimates(tenant, rows):
+        # rows ordered by year_week: (year_week, field, category, amount), one doc per week
+        for year_week, group in itertools.groupby(rows, key=lambda row: row[0]):
+            doc = {"_id": rollups.doc_id(tenant, year_week), "tenant": tenant, "year_week": year_week}
+            for _, field, category, amount in group:
+                doc.setdefault(field, {})[category] = amount
+            yield doc
+
+    def get_estimates(self, tenant, year_weeks):
+        if not year_weeks:
+            return {}
+        rows = self.conn.execute(
+            f"SELECT year_week, field, category, amount FROM estimates "
+            f"WHERE tenant = ? AND year_week IN ({', '.join('?' * len(year_weeks))}) ORDER BY year_week",
+            [tenant, *year_weeks]
+        )
+        return {doc["year_week"]: doc for doc in self._estimates(tenant, rows)}
+
+    def set_estimates(self, tenant, year_week, fields):
+        rows = []
+        for name, amount in fields.items():
+            field, category = name.split(".", 1)
+            rows.append((tenant, year_week, field, category, amount))
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT INTO estimates (tenant, year_week, field, category, amount) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (tenant, year_week, field, category) DO UPDATE SET amount = excluded.amount",
+                rows
+            )
+
+    def copy_estimates(self, tenant, plan, targets):
+        rows = [
+            (tenant, yw, field, category, amount)
+            for yw in targets
+            for field in ESTIMATE_FIELDS
+            for category, amount in plan.get(field, {}).items()
+        ]
+        with self.conn as conn:
+            conn.executemany(
+                "DELETE FROM estimates WHERE tenant = ? AND year_week = ?", [(tenant, yw) for yw in targets]
+            )
+            conn.executemany(
+                "INSERT INTO estimates (tenant, year_week, field, category, amount) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def iter_estimates(self, tenant, start=None, end=None, batch_size=1000):
+        query, params = "SELECT year_week, field, category, amount FROM estimates WHERE tenant = ?", [tenant]
+        if start:
+            query += " AND year_week >= ?"
+            params.append(isoweeks.key(*start))
+        if end:
+            query += " AND year_week <= ?"
+            params.append(isoweeks.key(*end))
+        cursor = self.conn.execute(query + " ORDER BY year_week", params)
+        rows = itertools.chain.from_iterable(iter(lambda: cursor.fetchmany(batch_size), []))
+        yield from self._estimates(tenant, rows)
+
+    # === Recurring rules ===
+    @staticmethod
+    def _rule(row):
+        rule = {"_id": row[0], **dict(zip(RULE_COLUMNS, row[1:]))}
+        rule["start"], rule["next_due"] = _dt(rule["start"]), _dt(rule["next_due"])
+        return rule
+
+    def add_rule(self, rule):
+        with self.conn as conn:
+            conn.execute(
+                "INSERT INTO recurring (id, tenant, amount, category, cadence, start, next_due) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rule["_id"], rule["tenant"], rule["amount"], rule["category"], rule["cadence"],
+                 _ts(rule["start"]), _ts(rule["next_due"]))
+            )
+
+    def list_rules(self, tenant):
+        rows = self.conn.execute("SELECT * FROM recurring WHERE tenant = ? ORDER BY start", (tenant,))
+        return [self._rule(row) for row in rows]
+
+    def delete_rule(self, tenant, rule_id):
+        with self.conn as conn:
+            return conn.execute("DELETE FROM recurring WHERE id = ? AND tenant = ?", (rule_id, tenant)).rowcount > 0
+
+    def due_rules(self, until):
+        rows = self.conn.execute("SELECT * FROM recurring WHERE next_due <= ?", (_ts(until),))
+        return [self._rule(row) for row in rows]
+
+    def advance_rules(self, next_due):
+        with self.conn as conn:
+            conn.executemany(
+                "UPDATE recurring SET next_due = ? WHERE id = ?",
+                [(_ts(due), rule_id) for rule_id, due in next_due.items()]
+            )
+
+    # === Bot persistence ===
+    @staticmethod
+    def _states(rows):
+        return [{"_id": doc_id, **json.loads(doc)} for doc_id, doc in rows]
+
+    def find_states(self, doc_ids):
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return []
+        return self._states(self.conn.execute(
+            f"SELECT id, doc FROM persistence WHERE id IN ({', '.join('?' * len(doc_ids))})", doc_ids
+        ))
+
+    def find_states_by_prefix(self, prefix):
+        # a range on the primary key instead of LIKE, which would scan
+        return self._states(self.conn.execute(
+            "SELECT id, doc FROM persistence WHERE id >= ? AND id < ?", (prefix, prefix + "\uffff")
+        ))
+
+    def find_conversations(self, name):
+        return self._states(self.conn.execute("SELECT id, doc FROM persistence WHERE name = ?", (name,)))
+
+    def write_states(self, docs):
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO persistence (id, name, doc) VALUES (?, ?, ?)",
+                [(doc_id, doc.get("name"), json.dumps(doc)) for doc_id, doc in docs.items() if doc]
+            )
+            conn.executemany(
+                "DELETE FROM persistence WHERE id = ?", [(doc_id,) for doc_id, doc in docs.items() if not doc]
+            )
+
+    # === Processed updates ===
+    # Expired ids are dropped by the claims themselves, an index range delete
+    # that finds nothing most of the time.
+    def claim_update(self, update_id):
+        now = datetime.datetime.utcnow()
+        expired = now - datetime.timedelta(seconds=self.processed_updates_ttl)
+        with self.conn as conn:
+            conn.execute("DELETE FROM processed_updates WHERE created_at < ?", (_ts(expired),))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_updates (update_id, created_at) VALUES (?, ?)", (update_id, _ts(now))
+            )
+            return cursor.rowcount > 0
+
+    def release_update(self, update_id):
+        with self.conn as conn:
+            conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
@@ -0,0 +1,62 @@
+import os
+import types
+import pytest
+
+# config reads the environment at import, nothing connects until a test asks for storage
+os.environ.setdefault("TELEGRAM_TOKEN", "123:test")
+os.environ.setdefault("WEBHOOK_URL", "http://localhost")
+
+import mongomock
+import config
+import repository as repo
+
+
+def make_settings(**overrides):
+    # a settings object like create_app takes: config's values plus `overrides`
+    values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    values.update(overrides)
+    return types.SimpleNamespace(**values)
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(config, "MongoClient", lambda *args, **kwargs: client)
+    yield client
+    config.close()
+
+
+@pytest.fixture
+def settings_overrides():
+    # settings the store fixtures change for every test of a module that overrides this
+    return {}
+
+
+def _configure(settings):
+    backend = repo.configure(settings)
+    backend.bootstrap()
+    return backend
+
+
+@pytest.fixture(params=["mongo", "sqlite"])
+def store(request, mongo_client, tmp_path, settings_overrides):
+    # the configured backend, every test using it runs once per backend
+    yield _configure(make_settings(
+        STORAGE_BACKEND=request.param, SQLITE_PATH=str(tmp_path / "expenses.db"), DB_NAME="expenses_test",
+        **settings_overrides
+    ))
+    repo.shutdown()
+
+
+@pytest.fixture
+def mongo_store(mongo_client, settings_overrides):
+    yield _configure(make_settings(STORAGE_BACKEND="mongo", DB_NAME="expenses_test", **settings_overrides))
+    repo.shutdown()
+
+
+@pytest.fixture
+def sqlite_store(tmp_path, settings_overrides):
+    yield _configure(make_settings(
+        STORAGE_BACKEND="sqlite", SQLITE_PATH=str(tmp_path / "expenses.db"), **settings_overrides
+    ))
+    repo.shutdown()
@@ -0,0 +1,50 @@
+import datetime
+import types
+import isoweeks
+
+
+class FakeMessage:
+    # the parts of telegram.Message the handlers use, replies are collected in `sent`
+
+    def __init__(self, text="", chat_id=42, message_id=1):
+        self.text = text
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.sent = []
+
+    async def reply_text(self, text, **kwargs):
+        self.sent.append(text)
+
+    async def reply_document(self, document=None, **kwargs):
+        self.sent.append(kwargs.get("filename"))
+
+
+def make_update(text="", chat_id=42, update_id=1, message_id=1):
+    message = FakeMessage(text, chat_id, message_id)
+    return types.SimpleNamespace(
+        update_id=update_id,
+        message=message,
+        callback_query=None,
+        effective_message=message,
+        effective_chat=types.SimpleNamespace(id=chat_id),
+        effective_user=types.SimpleNamespace(id=7, username="ann"),
+    )
+
+
+def make_context(*args):
+    return types.SimpleNamespace(args=list(args), user_data={}, bot=None)
+
+
+def make_record(record_id, tenant, amount, category, week=None, day=0, **extra):
+    week = week or isoweeks.current()
+    return {
+        "_id": record_id,
+        "tenant": tenant,
+        "user": "ann",
+        "amount": amount,
+        "category": category,
+        "date": datetime.datetime.combine(week.start + datetime.timedelta(days=day), datetime.time(12)),
+        "year": week.year,
+        "week": week.week,
+        **extra,
+    }
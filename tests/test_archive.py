@@ -0,0 +1,143 @@
+import types
+import pytest
+import archive
+import isoweeks
+import repository as repo
+import rollups
+import storage.mongo
+from bench.archive import snapshot, compare
+from tests.helpers import make_record
+
+KEEP = 4
+CATEGORIES = ["salary", "groceries", "rent"]
+
+
+@pytest.fixture
+def settings_overrides():
+    return {"ARCHIVE_WEEKS": KEEP}
+
+
+def seed(store, users=2, weeks=10, per_week=3):
+    this_week = isoweeks.current()
+    batch = []
+    for user in range(1, users + 1):
+        store.set_initial_balance(user, 1000)
+        for w in range(weeks):
+            week = isoweeks.shift(this_week, -w)
+            for i in range(per_week):
+                category = CATEGORIES[(w + i) % len(CATEGORIES)]
+                amount = 10.0 * (i + 1) + w
+                batch.append(make_record(
+                    f"{user}:{week.key}:{i}", user, amount if category == "salary" else -amount, category,
+                    week=week, day=i % 7
+                ))
+    repo.insert_records_sync(batch)
+    return batch, types.SimpleNamespace(users=users, weeks=weeks)
+
+
+def test_totals_unchanged_after_archival(store):
+    batch, args = seed(store)
+    before = snapshot(args)
+
+    moved = archive.run(KEEP)
+    assert moved == sum(archive.is_archived(r["year"], r["week"], KEEP) for r in batch) > 0
+    assert compare(before, snapshot(args)) == []
+    assert archive.run(KEEP) == 0
+
+    # re-adding archived records is a no-op like for hot ones
+    old = [dict(r) for r in batch if archive.is_archived(r["year"], r["week"], KEEP)][:5]
+    for r in old:
+        r.pop("created_at", None)
+    assert repo.insert_records_sync(old) == 0
+    assert compare(before, snapshot(args)) == []
+
+    # a late record in an archived week is folded into its summary by the next run
+    repo.insert_records_sync([dict(old[0], _id="late", amount=-12.5, category="rent")])
+    before_late = snapshot(args)
+    assert archive.run(KEEP) == 1
+    assert compare(before_late, snapshot(args)) == []
+    if store.name == "mongo":
+        assert rollups.verify() == []
+
+
+class DeleteHook:
+    # stands in for the records collection and calls `hook` before each
+    # delete_many, and `after` once it is done
+    def __init__(self, collection, hook, after=None):
+        self.collection = collection
+        self.hook = hook
+        self.after = after
+
+    def delete_many(self, *args, **kwargs):
+        self.hook()
+        result = self.collection.delete_many(*args, **kwargs)
+        if self.after:
+            self.after()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_reads_during_archival_count_records_once(mongo_store, monkeypatch):
+    # between copying a week to the archive and deleting its hot copies the
+    # records exist twice, reads and rollups must still count them once, and
+    # right after the delete they must not be missing
+    batch, args = seed(mongo_store, weeks=KEEP + 3)
+    # a second run over a summarised week, with a late hot record
+    archive.run(KEEP)
+    late = next(r for r in batch if archive.is_archived(r["year"], r["week"], KEEP))
+    repo.insert_records_sync([dict(late, _id="late", amount=-7.0)])
+
+    before = snapshot(args)
+    expected = rollups.compute()
+    checked = []
+
+    def check():
+        assert compare(before, snapshot(args)) == []
+        assert rollups.compute() == expected
+        checked.append(True)
+
+    monkeypatch.setattr(storage.mongo, "records", DeleteHook(storage.mongo.records, check, after=check))
+    assert archive.run(KEEP) == 1
+    assert len(checked) == 2
+
+
+def test_interrupted_run_is_finished_by_the_next(mongo_store, monkeypatch):
+    batch, args = seed(mongo_store)
+    before = snapshot(args)
+
+    def crash():
+        raise RuntimeError("worker died")
+
+    # dies after the first week's summary is rebuilt, before its hot copies go
+    monkeypatch.setattr(storage.mongo, "records", DeleteHook(storage.mongo.records, crash))
+    with pytest.raises(RuntimeError):
+        archive.run(KEEP)
+    monkeypatch.undo()
+    assert compare(before, snapshot(args)) == []
+
+    archive.run(KEEP)
+    assert compare(before, snapshot(args)) == []
+    assert storage.mongo.week_summaries.count_documents({"hot_ids": {"$exists": True}}) == 0
+
+
+def test_claimed_weeks_are_left_to_the_claiming_worker(mongo_store):
+    batch, args = seed(mongo_store, users=1, weeks=KEEP + 2)
+    old = sorted({(r["year"], r["week"]) for r in batch if archive.is_archived(r["year"], r["week"], KEEP)})
+    claim = "archive:" + rollups.week_key(1, *old[0])
+    assert mongo_store.claim_update(claim)
+
+    moved = archive.run(KEEP)
+    assert moved == len([r for r in batch if (r["year"], r["week"]) in old[1:]])
+    mongo_store.release_update(claim)
+    assert archive.run(KEEP) == len([r for r in batch if (r["year"], r["week"]) == old[0]])
+
+
+def test_cutoff_stops_at_the_calendar_table():
+    # an ARCHIVE_WEEKS reaching before WEEKS_FIRST_YEAR archives nothing instead of failing
+    this_week = isoweeks.current()
+    first = isoweeks.shift(this_week, -this_week.index)
+    assert archive.cutoff(this_week.index + 100) == first[:2]
+    assert not archive.is_archived(first.year, first.week, this_week.index + 100)
+    assert archive.is_archived(first.year, first.week, 1)
@@ -0,0 +1,48 @@
+import asyncio
+import repository as repo
+from bench.export import seed
+from handlers.balance import balance
+from tests.helpers import make_context, make_update
+
+
+class CountingStore:
+    # the configured backend, recording the name of every storage call
+    def __init__(self, store):
+        self._store = store
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return attr(*args, **kwargs)
+        return call
+
+
+def balance_calls(store, monkeypatch):
+    counting = CountingStore(store)
+    update = make_update("/balance", chat_id=1)
+    # undone right here, the store fixture's shutdown runs before monkeypatch's own undo
+    with monkeypatch.context() as patch:
+        patch.setattr(repo, "_backend", counting)
+        for cache in repo.CACHES:
+            cache.invalidate()
+        asyncio.run(balance(update, make_context()))
+    assert update.message.sent[0].startswith("💵 Current balance:")
+    return counting.calls
+
+
+def test_balance_round_trips_do_not_grow_with_records(store, monkeypatch):
+    # the same tenant with 100 records, then 50k
+    store.set_initial_balance(1, 1000)
+    seed(store, 100, 52, tenant=1)
+    few = balance_calls(store, monkeypatch)
+    seed(store, 50000, 520, tenant=1)
+    assert sum(1 for _ in store.iter_records(1)) == 50000
+    many = balance_calls(store, monkeypatch)
+    assert few == many
+    # balance, week totals, estimates, recurring rules
+    assert len(few) <= 5, few
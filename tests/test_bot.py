@@ -0,0 +1,38 @@
+import asyncio
+import types
+import bot
+
+
+class FakeQuery:
+    # the parts of telegram.CallbackQuery button_handler uses
+    def __init__(self, data):
+        self.data = data
+        self.edits = []
+        self.message = types.SimpleNamespace(reply_text=self.reply_text)
+        self.replies = []
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def press(data):
+    query = FakeQuery(data)
+    update = types.SimpleNamespace(callback_query=query)
+    asyncio.run(bot.button_handler(update, types.SimpleNamespace()))
+    return query
+
+
+def test_add_button_shows_the_quick_add_hint():
+    query = press("add")
+    assert query.edits == ["Choose the command below, or just send records, one per line: -12.5 groceries"]
+    assert query.replies == ["👇 Tap to send:"]
+
+
+def test_unknown_button():
+    assert press("nope").edits == ["❌ Unknown action"]
@@ -0,0 +1,19 @@
+import pytest
+from bench import export as bench
+
+SMALL = 2000
+
+
+@pytest.mark.parametrize("fmt, records", [("csv", 100000), ("xlsx", 40000)])
+def test_export_memory_does_not_grow_with_records(sqlite_store, tmp_path, fmt, records):
+    # openpyxl is much slower per row, its run is smaller but still far above what fits in the margin
+    bench.seed(sqlite_store, SMALL, 52, tenant=1)
+    bench.seed(sqlite_store, records, 520, tenant=2)
+    env = {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "expenses.db")}
+
+    small = bench.measure(env, fmt, tenant=1)
+    large = bench.measure(env, fmt, tenant=2)
+    growth = [result["peak_mb"] - result["baseline_mb"] for result in (small, large)]
+    assert large["bytes"] > 10 * small["bytes"]
+    # holding the large tenant's records in memory would add more than 20 MB
+    assert growth[1] - growth[0] < 10, growth
@@ -0,0 +1,86 @@
+import datetime
+import random
+import pytest
+import forecast
+
+CATEGORIES = ["salary", "bonus", "groceries", "rent", "travel"]
+INCOMES = ("salary", "bonus")
+
+
+def reference(balance, past, future, totals, estimates):
+    # forecast.build written as plain loops over dicts, week by week
+    def per_category(doc, *fields):
+        values = {}
+        for field in fields:
+            for cat, amount in (doc or {}).get(field, {}).items():
+                values[cat] = values.get(cat, 0) + amount
+        return values
+
+    history = [per_category(totals.get(yw), "incomes", "expenses") for yw in past]
+    categories = {cat for yw in past + future for cat in per_category(totals.get(yw), "incomes", "expenses")}
+    categories |= {cat for yw in future for cat in per_category(estimates.get(yw), "expected_incomes", "expected_expenses")}
+    while history and not any(history[0].values()):
+        history.pop(0)
+    series = list(history)
+    rows = []
+    for yw in future:
+        recorded = per_category(totals.get(yw), "incomes", "expenses")
+        planned = per_category(estimates.get(yw), "expected_incomes", "expected_expenses")
+        window = series[-forecast.HISTORY_WEEKS:]
+        expected, delta = {}, 0
+        for cat in categories:
+            average = sum(week.get(cat, 0) for week in window) / len(window) if window else 0
+            expected[cat] = planned[cat] if cat in planned else average
+            remaining = expected[cat] - recorded.get(cat, 0)
+            if expected[cat] > 0:
+                delta += max(remaining, 0)
+            elif expected[cat] < 0:
+                delta += min(remaining, 0)
+        series.append(expected)
+        balance += delta
+        source = "avg" if not planned else "est" if len(planned) == len(categories) else "est+avg"
+        rows.append({"year_week": yw, "delta": delta, "balance": balance, "source": source})
+    return rows
+
+
+def random_inputs(rng):
+    past, future = forecast.horizon(datetime.date(2025, 3, 12))
+    totals, estimates = {}, {}
+    first = rng.randrange(len(past))
+    for yw in past[first:] + future[:rng.randrange(3)]:
+        doc = {"incomes": {}, "expenses": {}}
+        for cat in rng.sample(CATEGORIES, rng.randrange(len(CATEGORIES) + 1)):
+            amount = round(rng.uniform(1, 500), 2)
+            if cat in INCOMES:
+                doc["incomes"][cat] = amount
+            else:
+                doc["expenses"][cat] = -amount
+        totals[yw] = doc
+    for yw in rng.sample(future, rng.randrange(len(future))):
+        doc = estimates[yw] = {"expected_incomes": {}, "expected_expenses": {}}
+        for cat in rng.sample(CATEGORIES, rng.randrange(1, len(CATEGORIES) + 1)):
+            amount = round(rng.uniform(1, 500), 2)
+            if cat in INCOMES:
+                doc["expected_incomes"][cat] = amount
+            else:
+                doc["expected_expenses"][cat] = -amount
+    return round(rng.uniform(-100, 5000), 2), past, future, totals, estimates
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_build_matches_plain_python(seed):
+    inputs = random_inputs(random.Random(seed))
+    rows = forecast.build(*inputs)
+    expected = reference(*inputs)
+    assert [row["year_week"] for row in rows] == [row["year_week"] for row in expected]
+    for row, want in zip(rows, expected):
+        assert row["delta"] == pytest.approx(want["delta"], abs=0.006)
+        assert row["balance"] == pytest.approx(want["balance"], abs=0.006)
+        assert row["source"] == want["source"], row["year_week"]
+
+
+def test_build_without_history_keeps_the_balance():
+    past, future = forecast.horizon(datetime.date(2025, 3, 12))
+    rows = forecast.build(100.0, past, future, {}, {})
+    assert len(rows) == forecast.MAX_WEEKS
+    assert {(row["delta"], row["balance"], row["source"]) for row in rows} == {(0.0, 100.0, "avg")}
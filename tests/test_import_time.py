@@ -0,0 +1,7 @@
+from bench import import_time
+
+
+def test_import_bot_within_budget():
+    # the probe itself fails when importing bot creates a MongoClient or an Application
+    median, samples = import_time.sample(3)
+    assert median <= import_time.BUDGET, samples
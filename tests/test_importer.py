@@ -0,0 +1,59 @@
+import pytest
+from handlers.importer import _parse_amount, categorize, import_file
+
+
+@pytest.mark.parametrize("text, amount", [
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("-1.234,56", -1234.56),
+    ("1,234,567", 1234567),
+    ("1.234.567,8", 1234567.8),
+    ("12,5", 12.5),
+    ("-12.50", -12.5),
+    ("0,125", 0.125),
+    ("1 234,56", 1234.56),
+    (42, 42.0),
+])
+def test_parse_amount(text, amount):
+    assert _parse_amount(text) == pytest.approx(amount)
+
+
+@pytest.mark.parametrize("text", ["1,234", "-1,234", "1.234", "+1,234", "1,23,4", "1.234.56", "1,2.345,6", "12,34,56"])
+def test_parse_amount_rejects_ambiguous(text):
+    with pytest.raises(ValueError):
+        _parse_amount(text)
+
+
+@pytest.mark.parametrize("description, category", [
+    ("Current account fee", "other"),
+    ("Split between multiple people", "other"),
+    ("Tips from the evening shift", "tips"),
+    ("LIDL Berlin 0423", "groceries"),
+    ("Monthly rent March", "rent"),
+    ("Barbershop", "other"),
+    ("Friday at the bar", "party"),
+    ("Netflix.com", "subscriptions"),
+    ("salary", "salary"),
+])
+def test_categorize(description, category):
+    assert categorize(description) == category
+
+
+def test_reimport_adds_nothing(store, tmp_path):
+    path = tmp_path / "statement.csv"
+    path.write_text(
+        "Date;Amount;Description\n"
+        "03.03.2025;-4,50;Coffee\n"
+        "03.03.2025;-4,50;Coffee\n"
+        "04.03.2025;2.000,00;Payroll ACME\n"
+        "05.03.2025;-1,234;Landlord\n",
+        encoding="utf-8",
+    )
+    first = import_file(str(path), "csv", 42, "ann")
+    second = import_file(str(path), "csv", 42, "ann")
+
+    assert (first["rows"], first["inserted"], first["duplicates"]) == (4, 3, 0)
+    assert first["rejected"] == ["line 5: ambiguous amount '-1,234'"]
+    assert (second["inserted"], second["duplicates"]) == (0, 3)
+    records = sorted((r["category"], r["amount"]) for r in store.iter_records(42))
+    assert records == [("other", -4.5), ("other", -4.5), ("salary", 2000.0)]
@@ -0,0 +1,158 @@
+import datetime
+import os
+import re
+import pymongo
+import pytest
+from pymongo import monitoring
+import config
+import isoweeks
+import migrations
+import repository as repo
+from tests.conftest import make_settings
+from tests.helpers import make_record
+
+# explain() needs a real mongod (mongomock has none), e.g.
+#   TEST_MONGO_URI=mongodb://127.0.0.1:27017 python -m pytest tests/test_migrations.py
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI")
+TABLES = ("records", "records_archive", "week_summaries", "week_totals")
+
+
+def run_hot_queries(store):
+    # what /balance, /showrecords, /weekstats, exports and budget alerts read
+    week = isoweeks.current()
+    store.insert_records([make_record("r1", 1, -5.0, "groceries", created_at=datetime.datetime.utcnow())])
+    store.get_balance(1)
+    store.records_by_day_category(1, week.year, week.week)
+    store.records_by_week_category(1, [week.key])
+    store.week_totals(1, [week.key])
+    list(store.iter_records(1, week[:2], week[:2]))
+    list(store.iter_records(1))
+    store.week_records(1, week.year, week.week, datetime.datetime.utcnow())
+    store.records_since(datetime.datetime.utcnow() - datetime.timedelta(minutes=1))
+
+
+def mongo_state(db):
+    indexes = {name: db[name].index_information() for name in db.list_collection_names()}
+    return indexes, list(db.migrations.find({}, {"applied_at": 0}).sort("_id", 1))
+
+
+def sqlite_state(store):
+    return store.conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+
+
+def test_bootstrap_is_idempotent(store):
+    db = config.connect() if store.name == "mongo" else None
+    before = mongo_state(db) if db is not None else sqlite_state(store)
+    store.bootstrap()
+    store.bootstrap()
+    after = mongo_state(db) if db is not None else sqlite_state(store)
+    assert after == before
+    if db is not None:
+        assert [doc["state"] for doc in after[1]] == ["done"] * len(migrations.MIGRATIONS)
+
+
+def test_sqlite_hot_queries_use_indexes(sqlite_store):
+    statements = []
+    sqlite_store.conn.set_trace_callback(statements.append)
+    try:
+        run_hot_queries(sqlite_store)
+    finally:
+        sqlite_store.conn.set_trace_callback(None)
+
+    plans = {}
+    for sql in statements:
+        if sql.lstrip().upper().startswith("SELECT"):
+            plans[sql] = [row[3] for row in sqlite_store.conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    assert plans
+    for sql, plan in plans.items():
+        for detail in plan:
+            match = re.match(r"(SCAN|SEARCH) (\w+)", detail)
+            if match and match.group(2) in TABLES:
+                assert match.group(1) == "SEARCH", f"{detail} in {sql}"
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate") and event.command[event.command_name] in TABLES:
+            self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def plan_stages(explained):
+    # every "stage" in an explain document, however the server nests the plans
+    if isinstance(explained, dict):
+        stage = explained.get("stage")
+        yield from [stage] if isinstance(stage, str) else []
+        for value in explained.values():
+            yield from plan_stages(value)
+    elif isinstance(explained, list):
+        for value in explained:
+            yield from plan_stages(value)
+
+
+@pytest.mark.skipif(not TEST_MONGO_URI, reason="set TEST_MONGO_URI to explain against a real mongod")
+def test_mongo_hot_queries_use_indexes(monkeypatch):
+    recorder = CommandRecorder()
+    real_client = pymongo.MongoClient
+    monkeypatch.setattr(config, "MongoClient", lambda *args, **kwargs: real_client(
+        *args, **{**kwargs, "event_listeners": [*kwargs["event_listeners"], recorder]}
+    ))
+    settings = make_settings(STORAGE_BACKEND="mongo", MONGO_URI=TEST_MONGO_URI, MONGO_TLS=False, DB_NAME="expenses_explain")
+    store = repo.configure(settings)
+    try:
+        db = config.connect(settings)
+        db.client.drop_database(settings.DB_NAME)
+        store.bootstrap()
+        recorder.commands.clear()
+        run_hot_queries(store)
+
+        assert recorder.commands
+        for command in recorder.commands:
+            command = {key: value for key, value in command.items() if not key.startswith("$") and key != "lsid"}
+            stages = set(plan_stages(db.command("explain", command, verbosity="queryPlanner")))
+            assert "COLLSCAN" not in stages, f"{command}: {stages}"
+    finally:
+        repo.shutdown()
+        config.close()
+
+
+def test_stale_migration_claim_is_run_again(mongo_store):
+    # a worker died in migration 3: its claim stays "running" and the summary unmarked
+    db = config.connect()
+    db.migrations.replace_one({"_id": 3}, {
+        "_id": 3, "name": "mark_week_summaries_complete", "state": "running",
+        "started_at": datetime.datetime.utcnow() - datetime.timedelta(seconds=config.MIGRATION_LOCK_TIMEOUT + 1),
+    })
+    db.week_summaries.insert_one({"_id": "1:2020-01", "tenant": 1, "year": 2020, "week": 1, "rows": []})
+
+    mongo_store.bootstrap()
+    assert db.migrations.find_one({"_id": 3})["state"] == "done"
+    assert db.week_summaries.find_one({"_id": "1:2020-01"})["complete"] is True
+
+
+def test_running_migration_claim_is_waited_for(mongo_store, monkeypatch):
+    # another worker is in migration 3 and finishes it while this one waits
+    db = config.connect()
+    db.migrations.replace_one({"_id": 3}, {
+        "_id": 3, "name": "mark_week_summaries_complete", "state": "running", "started_at": datetime.datetime.utcnow(),
+    })
+    db.week_summaries.insert_one({"_id": "1:2020-01", "tenant": 1, "year": 2020, "week": 1, "rows": []})
+    polls = []
+
+    def sleep(seconds):
+        polls.append(seconds)
+        db.migrations.update_one({"_id": 3}, {"$set": {"state": "done"}})
+
+    monkeypatch.setattr(migrations.time, "sleep", sleep)
+    mongo_store.bootstrap()
+    assert polls == [migrations.CLAIM_POLL_INTERVAL]
+    # not run here, the other worker owns it
+    assert "complete" not in db.week_summaries.find_one({"_id": "1:2020-01"})
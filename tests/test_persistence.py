@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+from telegram.request import BaseRequest
+from dispatcher import UpdateDispatcher
+from persistence import StoragePersistence
+
+ASKED = 0
+
+
+class FakeRequest(BaseRequest):
+    # answers getMe so Application.initialize works offline, the handlers here send nothing
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        me = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "test_bot"}
+        return 200, json.dumps({"ok": True, "result": me}).encode()
+
+
+class Worker:
+    # one bot process: its own Application, persistence and dispatcher on the shared storage
+
+    def __init__(self, name, calls):
+        async def ask(update, context):
+            calls.append((name, "ask"))
+            return ASKED
+
+        async def answer(update, context):
+            calls.append((name, "answer", update.message.text))
+            context.user_data["answer"] = update.message.text
+            return ConversationHandler.END
+
+        # a flush_delay no test waits for, states must not depend on it
+        self.persistence = StoragePersistence(flush_delay=60)
+        self.app = (
+            Application.builder()
+            .token("123:test")
+            .request(FakeRequest())
+            .get_updates_request(FakeRequest())
+            .persistence(self.persistence)
+            .build()
+        )
+        self.app.add_handler(ConversationHandler(
+            entry_points=[CommandHandler("ask", ask)],
+            states={ASKED: [MessageHandler(filters.TEXT & ~filters.COMMAND, answer)]},
+            fallbacks=[],
+            name="ask",
+            persistent=True,
+        ))
+        self.dispatcher = UpdateDispatcher(self.app, workers=1, persistence=self.persistence)
+        self.dispatcher.on_processed = lambda update, seconds: self.processed.set()
+        self.processed = asyncio.Event()
+
+    async def start(self):
+        await self.app.initialize()
+        await self.dispatcher.start()
+
+    async def stop(self):
+        await self.dispatcher.stop()
+        await self.app.shutdown()
+
+    async def handle(self, update_id, text):
+        self.processed.clear()
+        assert self.dispatcher.submit(Update.de_json(update_data(update_id, text), self.app.bot))
+        await self.processed.wait()
+
+
+def update_data(update_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "Ann"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+def test_conversation_continues_on_another_worker(store):
+    calls = []
+
+    async def main():
+        first, second = Worker("first", calls), Worker("second", calls)
+        await first.start()
+        await second.start()
+        try:
+            await first.handle(1, "/ask")
+            await second.handle(2, "groceries")
+            # the conversation ended on the second worker, the first must see that too
+            await first.handle(3, "rent")
+            await first.handle(4, "/ask")
+            return second.app.user_data[7]
+        finally:
+            await first.stop()
+            await second.stop()
+
+    user_data = asyncio.run(main())
+    assert calls == [("first", "ask"), ("second", "answer", "groceries"), ("first", "ask")]
+    assert user_data == {"answer": "groceries"}
+    assert store.find_states(["user:7"])[0]["data"] == {"answer": "groceries"}
@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+import pytest
+from telegram import Update
+from telegram.ext import MessageHandler
+import archive
+import isoweeks
+import repository as repo
+from handlers.records import QUICK_ADD_FILTER, quick_add
+from tests.helpers import make_context, make_record, make_update
+
+CATEGORIES = ["salary", "bonus", "groceries", "rent", "travel", "other"]
+WEEKS = 6
+
+
+def seed(store):
+    # two tenants over the last WEEKS weeks, the oldest archived into summaries
+    rng = random.Random(15)
+    this_week = isoweeks.current()
+    records = []
+    for i in range(400):
+        category = rng.choice(CATEGORIES)
+        amount = round(rng.uniform(0.01, 250), 2)
+        records.append(make_record(
+            f"r{i}", rng.choice([1, 2]), amount if category in ("salary", "bonus") else -amount, category,
+            week=isoweeks.shift(this_week, -rng.randrange(WEEKS)), day=rng.randrange(7),
+        ))
+    repo.insert_records_sync([dict(record) for record in records])
+    assert archive.run(WEEKS // 2) > 0
+    return records
+
+
+def python_day_groups(records, tenant, week):
+    # what /showrecords computed in Python before records_by_day_category
+    days = {}
+    for r in records:
+        if r["tenant"] == tenant and (r["year"], r["week"]) == week[:2]:
+            days.setdefault(r["date"].date(), {}).setdefault(r["category"], 0)
+            days[r["date"].date()][r["category"]] += r["amount"]
+    return days
+
+
+def python_week_groups(records, tenant, week):
+    # count, totals and per-category sums of one week, as /weekstats shows them
+    doc = {"count": 0, "income": 0, "expense": 0, "incomes": {}, "expenses": {}, "categories": {}}
+    for r in records:
+        if r["tenant"] == tenant and (r["year"], r["week"]) == week[:2]:
+            total_field, side = ("income", "incomes") if r["amount"] >= 0 else ("expense", "expenses")
+            doc["count"] += 1
+            doc[total_field] += r["amount"]
+            doc[side][r["category"]] = doc[side].get(r["category"], 0) + r["amount"]
+            doc["categories"][r["category"]] = doc["categories"].get(r["category"], 0) + r["amount"]
+    return doc
+
+
+def test_day_category_rows_match_python_grouping(store):
+    records = seed(store)
+    this_week = isoweeks.current()
+    for tenant in (1, 2):
+        for w in range(WEEKS):
+            week = isoweeks.shift(this_week, -w)
+            rows = store.records_by_day_category(tenant, week.year, week.week)
+            days = {}
+            for row in rows:
+                days.setdefault(row["day"], {})[row["category"]] = row["income"] + row["expense"]
+            expected = python_day_groups(records, tenant, week)
+            assert days.keys() == expected.keys()
+            for day, cats in expected.items():
+                assert days[day] == pytest.approx(cats)
+            assert [row["day"] for row in rows] == sorted(row["day"] for row in rows)
+            assert sum(row["count"] for row in rows) == python_week_groups(records, tenant, week)["count"]
+
+
+def test_week_sums_match_python_grouping(store):
+    records = seed(store)
+    this_week = isoweeks.current()
+    weeks = [isoweeks.shift(this_week, -w) for w in range(WEEKS)]
+    for tenant in (1, 2):
+        totals = store.week_totals(tenant, [week.key for week in weeks])
+        by_category = store.records_by_week_category(tenant, [week.key for week in weeks])
+        for week in weeks:
+            expected = python_week_groups(records, tenant, week)
+            if not expected["count"]:
+                assert week.key not in totals and week.key not in by_category
+                continue
+            doc = totals[week.key]
+            assert doc["count"] == expected["count"]
+            for field in ("income", "expense", "incomes", "expenses"):
+                assert doc[field] == pytest.approx(expected[field])
+            assert by_category[week.key]["count"] == expected["count"]
+            assert by_category[week.key]["categories"] == pytest.approx(expected["categories"])
+
+
+def test_day_rows_split_income_and_expense_per_tenant(store):
+    week = isoweeks.current()
+    repo.insert_records_sync([
+        make_record("a", 1, -10.0, "groceries", week=week, day=0),
+        make_record("b", 2, -99.0, "groceries", week=week, day=0),
+        make_record("c", 1, 500.0, "salary", week=week, day=0),
+    ])
+    rows = store.records_by_day_category(1, week.year, week.week)
+    assert [(row["category"], row["income"], row["expense"], row["count"]) for row in rows] == [
+        ("groceries", 0, -10.0, 1), ("salary", 500.0, 0, 1),
+    ]
+
+
+def message_update(kind, text):
+    message = {
+        "message_id": 5,
+        "date": int(time.time()),
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "Ann"},
+        "text": text,
+    }
+    return Update.de_json({"update_id": 1, kind: message}, None)
+
+
+def test_quick_add_ignores_edited_messages():
+    handler = MessageHandler(QUICK_ADD_FILTER, quick_add)
+    assert handler.check_update(message_update("message", "-12 groceries"))
+    # the edited copy has no update.message, quick_add must not see it
+    assert not handler.check_update(message_update("edited_message", "-12 groceries"))
+    assert not handler.check_update(message_update("message", "groceries -12"))
+
+
+def test_quick_add_redelivery_adds_nothing(store):
+    update = make_update("-12.5 groceries\n+2000 salary", chat_id=42, message_id=5)
+    asyncio.run(quick_add(update, make_context()))
+    asyncio.run(quick_add(update, make_context()))
+    assert update.message.sent[0].startswith("✅ Added 2 records")
+    assert update.message.sent[1] == "ℹ️ These records were already added."
+    assert sorted(r["amount"] for r in store.iter_records(42)) == [-12.5, 2000]
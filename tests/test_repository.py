@@ -0,0 +1,48 @@
+import asyncio
+import time
+import repository as repo
+from handlers.balance import balance
+from tests.helpers import make_context, make_update
+
+
+def test_concurrent_updates_interleave(store, monkeypatch):
+    # One chat's slow storage call runs on the pool, so another chat's
+    # update is handled meanwhile and the event loop keeps ticking.
+    get_balance = store.get_balance
+
+    def slow_get_balance(tenant):
+        if tenant == 1:
+            time.sleep(0.5)
+        return get_balance(tenant)
+
+    monkeypatch.setattr(store, "get_balance", slow_get_balance)
+    replies = []
+
+    async def handle(tenant):
+        update = make_update(chat_id=tenant)
+        await balance(update, make_context())
+        replies.append(tenant)
+
+    async def main():
+        await repo.set_initial_balance(1, 10)
+        await repo.set_initial_balance(2, 20)
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beat = asyncio.create_task(heartbeat())
+        started = time.perf_counter()
+        await asyncio.gather(handle(1), handle(2))
+        elapsed = time.perf_counter() - started
+        beat.cancel()
+        return ticks, elapsed
+
+    ticks, elapsed = asyncio.run(main())
+    assert replies == [2, 1]
+    # a blocked loop would not tick at all during the 0.5 s call
+    assert ticks >= 0.5 / 0.01 / 2
+    assert elapsed < 1.0